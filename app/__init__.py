@@ -49,6 +49,14 @@ def create_app(config_name):
     from .api_1_0 import api as api_blueprint
     app.register_blueprint(api_blueprint, url_prefix='/api')
 
+    if global_variable.RUN_JOBS_IN_WEB:
+        from .util.job_queue import start_dispatcher
+
+        @app.before_first_request
+        def _start_dispatcher():
+            # 执行队列在web进程收到第一个请求时才启动：命令行和gunicorn的master进程不会取任务执行
+            start_dispatcher(app)
+
     # from .api_1_0.model import api_1_0 as api_blueprint
     # app.register_blueprint(api_blueprint, url_prefix='/api_1_0')
     return app
@@ -4,7 +4,7 @@ from ..util.custom_decorator import login_required
 api = Blueprint('api', __name__)
 
 from . import api_msg_manage, module_manage, project_manage, report_manage, build_in_manage, case_manage, login, \
-    test_tool, task_manage, file_manage, config, suite_manage, case_set_manage, errors
+    test_tool, task_manage, file_manage, config, suite_manage, case_set_manage, job_manage, errors
 
 
 
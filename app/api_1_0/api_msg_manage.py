@@ -4,6 +4,9 @@ from app.models import *
 from app.util.case_change.core import HarParser
 from . import api, login_required
 from ..util.http_run import RunCase
+from ..util.http_client import RetryPolicy
+from ..util.run_profiler import RunProfiler
+from ..util.cassette import cassette_config, list_cassettes
 from ..util.utils import *
 
 
@@ -30,6 +33,7 @@ def add_api_msg():
     variable = data.get('variable')
     json_variable = data.get('jsonVariable')
     param = data.get('param')
+    retry = json.dumps(data.get('retry')) if data.get('retry') else None
     if not project_name:
         return jsonify({'msg': '项目不能为空', 'status': 0})
     if not module_id:
@@ -43,6 +47,13 @@ def add_api_msg():
     if status_url == -1:
         if 'http' not in url:
             return jsonify({'msg': '基础url为空时，请补全api地址', 'status': 0})
+    try:
+        RetryPolicy.from_config(retry)
+        # 为空或0时使用默认的超时时间
+        connect_timeout = positive_number(data.get('connectTimeout') or None, '连接超时时间')
+        read_timeout = positive_number(data.get('readTimeout') or None, '响应超时时间')
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
 
     project_id = Project.query.filter_by(name=project_name).first().id
     num = auto_num(data.get('num'), ApiMsg, module_id=module_id)
@@ -71,6 +82,9 @@ def add_api_msg():
         old_data.param = param
         old_data.extract = extract
         old_data.module_id = module_id
+        old_data.connect_timeout = connect_timeout
+        old_data.read_timeout = read_timeout
+        old_data.retry = retry
         db.session.commit()
         return jsonify({'msg': '修改成功', 'status': 1, 'api_msg_id': api_msg_id, 'num': num})
     else:
@@ -93,6 +107,9 @@ def add_api_msg():
                                status_url=status_url,
                                variable_type=variable_type,
                                json_variable=json_variable,
+                               connect_timeout=connect_timeout,
+                               read_timeout=read_timeout,
+                               retry=retry,
                                extract=extract, )
             db.session.add(new_cases)
             db.session.commit()
@@ -116,7 +133,10 @@ def edit_api_msg():
              'variable': json.loads(_edit.variable),
              'json_variable': _edit.json_variable,
              'extract': json.loads(_edit.extract),
-             'validate': json.loads(_edit.validate)}
+             'validate': json.loads(_edit.validate),
+             'connect_timeout': _edit.connect_timeout,
+             'read_timeout': _edit.read_timeout,
+             'retry': json.loads(_edit.retry) if _edit.retry else None}
     return jsonify({'data': _data, 'status': 1})
 
 
@@ -136,12 +156,32 @@ def run_api_msg():
     case_data_id = [(item['num'], item['apiMsgId']) for item in api_msg_data]
     case_data_id.sort(key=lambda x: x[0])
     api_msg = [ApiMsg.query.filter_by(id=c[1]).first() for c in case_data_id]
+    try:
+        cassette = cassette_config(data.get('cassetteMode'), data.get('cassetteName') or project_name)
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
 
     d = RunCase(project_names=project_name, api_data=api_msg, config_id=config_id)
-    res = json.loads(d.run_case())
+    d.cassette = cassette
+    profiler = RunProfiler() if data.get('profile') else None
+    try:
+        res = json.loads(profiler.run(d.run_case) if profiler else d.run_case())
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
+    if profiler:
+        return jsonify({'msg': '测试完成', 'data': res, 'profile': profiler.summary(), 'status': 1})
     return jsonify({'msg': '测试完成', 'data': res, 'status': 1})
 
 
+@api.route('/cassette/list', methods=['POST'])
+@login_required
+def find_cassette():
+    """ 查看已有的录制 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    return jsonify({'data': list_cassettes(), 'status': 1})
+
+
 @api.route('/apiMsg/find', methods=['POST'])
 @login_required
 def find_api_msg():
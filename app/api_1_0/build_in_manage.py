@@ -2,8 +2,8 @@ import types
 from flask import jsonify, request, current_app
 from . import api, login_required
 from ..util.global_variable import *
-import importlib
 from ..util.utils import parse_function, extract_functions
+from ..util.func_registry import func_registry
 import traceback
 
 
@@ -47,6 +47,7 @@ def save_func():
         return jsonify({'msg': '文件名不存在', 'status': 0})
     with open('{}/{}'.format(FUNC_ADDRESS, func_name), 'w', encoding='utf8') as f:
         f.write(func_data)
+    func_registry.invalidate('func_list.{}'.format(func_name.replace('.py', '')))
     return jsonify({'msg': '保存成功', 'status': 1})
 
 
@@ -69,9 +70,7 @@ def check_func():
         return jsonify({'msg': '文件名不存在', 'status': 0})
     try:
         import_path = 'func_list.{}'.format(func_file_name.replace('.py', ''))
-        func_list = importlib.reload(importlib.import_module(import_path))
-        module_functions_dict = {name: item for name, item in vars(func_list).items() if
-                                 isinstance(item, types.FunctionType)}
+        module_functions_dict = func_registry.functions(import_path)
 
         ext_func = extract_functions(func_name)
         if len(ext_func) == 0:
@@ -114,4 +113,12 @@ def remove_func():
         return jsonify({'msg': '文件名不存在', 'status': 0})
     else:
         os.remove('{}/{}'.format(FUNC_ADDRESS, func_name))
+        func_registry.invalidate('func_list.{}'.format(func_name.replace('.py', '')))
     return jsonify({'msg': '删除成功', 'status': 1})
+
+
+@api.route('/func/stats', methods=['POST'])
+@login_required
+def func_stats():
+    """ 函数文件的加载次数和耗时 """
+    return jsonify({'data': func_registry.stats(), 'status': 1})
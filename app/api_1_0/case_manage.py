@@ -3,6 +3,10 @@ from . import api, login_required
 from app.models import *
 from flask_login import current_user
 from ..util.utils import *
+from ..util.http_client import RetryPolicy
+from ..util.parameters import check_parameters
+from ..util.http_run import RunCase
+from ..util.plan_check import PlanCheck
 
 
 @api.route('/case/add', methods=['POST'])
@@ -15,6 +19,8 @@ def add_case():
     desc = data.get('desc')
     ids = data.get('ids')
     times = data.get('times')
+    deadline = data.get('deadline') or None
+    parameters = data.get('parameters') or None
     case_set_id = data.get('caseSetId')
     func_address = json.dumps(data.get('funcAddress'))
     project = data.get('project')
@@ -22,8 +28,7 @@ def add_case():
     project_id = project_data.id
     variable = data.get('variable')
     api_cases = data.get('apiCases')
-    merge_variable = json.dumps(json.loads(variable) + json.loads(project_data.variables))
-    _temp_check = extract_variables(convert(json.loads(merge_variable)))
+    _temp_check = unresolved_variables(json.loads(variable) + json.loads(project_data.variables))
     if not case_set_id:
         return jsonify({'msg': '请选择用例集', 'status': 0})
     if re.search('\${(.*?)}', '{}{}'.format(variable, json.dumps(api_cases)), flags=0) and not func_address:
@@ -39,6 +44,19 @@ def add_case():
     if variable_check:
         return jsonify({'msg': variable_check, 'status': 0})
 
+    for c in api_cases:
+        try:
+            RetryPolicy.from_config(c.get('retry'))
+        except ValueError as e:
+            return jsonify({'msg': '步骤{}的{}'.format(c.get('case_name'), e), 'status': 0})
+
+    if parameters:
+        try:
+            check_parameters(parameters)
+        except ValueError as e:
+            return jsonify({'msg': '{}'.format(e), 'status': 0})
+        parameters = json.dumps(parameters, ensure_ascii=False)
+
     num = auto_num(data.get('num'), Case, project_id=project_id, case_set_id=case_set_id)
     if ids:
         old_data = Case.query.filter_by(id=ids).first()
@@ -51,6 +69,8 @@ def add_case():
             num_sort(num, old_num, list_data, old_data)
             old_data.name = name
             old_data.times = times
+            old_data.deadline = deadline
+            old_data.parameters = parameters
             old_data.project_id = project_id
             old_data.desc = desc
             old_data.case_set_id = case_set_id
@@ -75,6 +95,7 @@ def add_case():
                 old_api_case.status = json.dumps(c['status'])
                 old_api_case.up_func = c['up_func']
                 old_api_case.down_func = c['down_func']
+                old_api_case.retry = json.dumps(c['retry']) if c.get('retry') else None
                 db.session.commit()
             else:
                 new_api_case = CaseData(num=_num,
@@ -91,7 +112,8 @@ def add_case():
                                         status_validate=json.dumps(c['statusCase']['validate']),
                                         status_param=json.dumps(c['statusCase']['param']),
                                         status=json.dumps(c['status']),
-                                        name=c['case_name'], up_func=c['up_func'], down_func=c['down_func'])
+                                        name=c['case_name'], up_func=c['up_func'], down_func=c['down_func'],
+                                        retry=json.dumps(c['retry']) if c.get('retry') else None)
                 db.session.add(new_api_case)
                 db.session.commit()
         return jsonify({'msg': '修改成功', 'status': 1})
@@ -103,7 +125,8 @@ def add_case():
         else:
 
             new_case = Case(num=num, name=name, desc=desc, project_id=project_id, variable=variable,
-                            func_address=func_address, case_set_id=case_set_id, times=times)
+                            func_address=func_address, case_set_id=case_set_id, times=times, deadline=deadline,
+                            parameters=parameters)
             db.session.add(new_case)
             db.session.commit()
             case_id = new_case.id
@@ -119,7 +142,8 @@ def add_case():
                                         status_validate=json.dumps(c['statusCase']['validate']),
                                         status_param=json.dumps(c['statusCase']['param']),
                                         status=json.dumps(c['status']),
-                                        name=c['case_name'], up_func=c['up_func'], down_func=c['down_func'])
+                                        name=c['case_name'], up_func=c['up_func'], down_func=c['down_func'],
+                                        retry=json.dumps(c['retry']) if c.get('retry') else None)
                 db.session.add(new_api_case)
                 db.session.commit()
             return jsonify({'msg': '新建成功', 'status': 1, 'case_id': case_id})
@@ -207,10 +231,39 @@ def del_api_case():
     current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
     case_id = data.get('id')
     _data = CaseData.query.filter_by(id=case_id).first()
+    # 删除步骤也算用例有修改，按修改选择用例时要执行
+    Case.query.filter_by(id=_data.case_id).update({'update_time': datetime.datetime.utcnow()})
     db.session.delete(_data)
     return jsonify({'msg': '删除成功', 'status': 1})
 
 
+@api.route('/case/compile', methods=['POST'])
+@login_required
+def compile_case():
+    """ 只编译、检查用例，不发请求：返回编译后的步骤、无法解析的变量和函数、各阶段耗时和估算的请求数 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    if not data.get('projectName'):
+        return jsonify({'msg': '请选择项目', 'status': 0})
+    if not Project.query.filter_by(name=data.get('projectName')).first():
+        return jsonify({'msg': '项目{}不存在'.format(data.get('projectName')), 'status': 0})
+    case_ids = data.get('sceneIds')
+    if not case_ids:
+        return jsonify({'msg': '请选择用例', 'status': 0})
+    if not isinstance(case_ids, list):
+        return jsonify({'msg': '用例id必须是列表', 'status': 0})
+    try:
+        case_ids = [positive_int(case_id, '用例id') for case_id in case_ids]
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
+    missing = set(case_ids) - {c.id for c in Case.query.filter(Case.id.in_(case_ids)).all()}
+    if missing:
+        return jsonify({'msg': '用例{}不存在'.format(','.join(map(str, sorted(missing)))), 'status': 0})
+    run_case = RunCase(data.get('projectName'), case_ids)
+    run_case.run_type = True
+    return jsonify({'msg': '编译完成', 'status': 1, 'data': PlanCheck(run_case).run()})
+
+
 @api.route('/case/edit', methods=['POST'])
 @login_required
 def edit_case():
@@ -241,12 +294,15 @@ def edit_case():
                           'param': json.loads(case.param),
                           'extract': json.loads(case.extract),
                           'validate': json.loads(case.validate),
+                          'retry': json.loads(case.retry) if case.retry else None,
                           'statusCase': {'variable': json.loads(case.status_variables),
                                          'extract': json.loads(case.status_extract),
                                          'validate': json.loads(case.status_validate),
                                          'param': json.loads(case.status_param)}, })
     _data2 = {'num': _data.num, 'name': _data.name, 'desc': _data.desc, 'cases': case_data, 'setId': _data.case_set_id,
-              'func_address': json.loads(_data.func_address), 'times': _data.times}
+              'func_address': json.loads(_data.func_address), 'times': _data.times,
+              'deadline': _data.deadline,
+              'parameters': json.loads(_data.parameters) if _data.parameters else []}
     if _data.variable:
         _data2['variable'] = json.loads(_data.variable)
     else:
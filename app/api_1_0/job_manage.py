@@ -0,0 +1,38 @@
+import time
+from flask import jsonify, request, current_app
+from . import api, login_required
+from app.models import *
+from ..util.job_queue import job_data, FINISHED_STATUS
+
+
+@api.route('/job/status', methods=['POST'])
+@login_required
+def job_status():
+    """ 查询执行任务的状态，wait大于0时等待任务结束，最多等wait秒(不超过30秒)后返回 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    job_id = data.get('jobId')
+    wait = min(float(data.get('wait') or 0), 30)
+    end_time = time.time() + wait
+    job = RunJob.query.filter_by(id=job_id).first()
+    if not job:
+        return jsonify({'msg': '任务不存在', 'status': 0})
+    while job.status not in FINISHED_STATUS and time.time() < end_time:
+        time.sleep(0.5)
+        db.session.refresh(job)
+    return jsonify({'data': job_data(job), 'status': 1})
+
+
+@api.route('/job/list', methods=['POST'])
+@login_required
+def job_list():
+    """ 查询执行任务列表 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    page = data.get('page') if data.get('page') else 1
+    per_page = data.get('sizePage') if data.get('sizePage') else 10
+    jobs = RunJob.query
+    if data.get('status'):
+        jobs = jobs.filter_by(status=data.get('status'))
+    pagination = jobs.order_by(RunJob.id.desc()).paginate(page, per_page=per_page, error_out=False)
+    return jsonify({'data': [job_data(j) for j in pagination.items], 'total': pagination.total, 'status': 1})
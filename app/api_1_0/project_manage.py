@@ -3,6 +3,8 @@ from . import api
 from app.models import *
 import json
 from ..util.custom_decorator import login_required
+from ..util.env_resolver import env_resolver
+from ..util.utils import non_negative_int
 from flask_login import current_user
 
 
@@ -35,14 +37,9 @@ def get_pro_gather():
                                              Case.query.filter_by(case_set_id=s.id).all()]
 
         # 获取每个项目下的url
-        if p.environment_choice == 'first':
-            pro_url[p.name] = json.loads(p.host)
-        elif p.environment_choice == 'second':
-            pro_url[p.name] = json.loads(p.host_two)
-        elif p.environment_choice == 'third':
-            pro_url[p.name] = json.loads(p.host_three)
-        elif p.environment_choice == 'fourth':
-            pro_url[p.name] = json.loads(p.host_four)
+        hosts = env_resolver.project_hosts(p.id)
+        if hosts is not None:
+            pro_url[p.name] = hosts
 
     if my_pros:
         my_pros = {'pro_name': my_pros.name, 'model_list': pro[my_pros.name]}
@@ -102,6 +99,11 @@ def add_project():
     ids = data.get('id')
     header = data.get('header')
     variable = data.get('variable')
+    try:
+        # 为空时使用默认值，0为不截断
+        report_body_limit = non_negative_int(data.get('reportBodyLimit'), '报告响应内容长度上限', None)
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
     if ids:
         old_project_data = Project.query.filter_by(id=ids).first()
         if Project.query.filter_by(name=project_name).first() and project_name != old_project_data.name:
@@ -116,7 +118,9 @@ def add_project():
             old_project_data.host_four = host_four
             old_project_data.headers = header
             old_project_data.variables = variable
+            old_project_data.report_body_limit = report_body_limit
             db.session.commit()
+            env_resolver.invalidate()
             return jsonify({'msg': '修改成功', 'status': 1})
     else:
         if Project.query.filter_by(name=project_name).first():
@@ -127,9 +131,11 @@ def add_project():
                                   host_two=host_two,
                                   user_id=user_id,
                                   environment_choice=environment_choice,
-                                  host_three=host_three, host_four=host_four, headers=header, variables=variable)
+                                  host_three=host_three, host_four=host_four, headers=header, variables=variable,
+                                  report_body_limit=report_body_limit)
             db.session.add(new_project)
             db.session.commit()
+            env_resolver.invalidate()
             return jsonify({'msg': '新建成功', 'status': 1})
 
 
@@ -150,6 +156,8 @@ def del_project():
     if pro_data.configs.all():
         return jsonify({'msg': '请先删除项目下的业务配置', 'status': 0})
     db.session.delete(pro_data)
+    db.session.commit()
+    env_resolver.invalidate()
     return jsonify({'msg': '删除成功', 'status': 1})
 
 
@@ -170,5 +178,6 @@ def edit_project():
              'host_four': json.loads(_edit.host_four),
              'headers': json.loads(_edit.headers),
              'environment_choice': _edit.environment_choice,
-             'variables': json.loads(_edit.variables)}
+             'variables': json.loads(_edit.variables),
+             'report_body_limit': _edit.report_body_limit}
     return jsonify({'data': _data, 'status': 1})
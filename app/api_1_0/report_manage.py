@@ -1,11 +1,20 @@
+import base64
 import json
-import copy
+import uuid
 from flask import jsonify, request
 from . import api, login_required
 from app.models import *
 from ..util.http_run import RunCase
+from ..util.load_runner import LoadRunner
+from ..util.job_queue import enqueue, register_job, cancel_job, job_data, FINISHED_STATUS
+from ..util.run_control import RunControl, request_cancel
 from ..util.global_variable import *
 from ..util.report.report import render_html_report
+from ..util.report_store import read_report, read_summary, report_path, failed_cases
+from ..util.blob_store import get_blob
+from ..util.run_profiler import RunProfiler
+from ..util.cassette import cassette_config
+from ..util.utils import positive_int, non_negative_int, positive_number
 
 
 @api.route('/report/run', methods=['POST'])
@@ -18,12 +27,179 @@ def run_cases():
         return jsonify({'msg': '请选择项目', 'status': 0})
     if not data.get('sceneIds'):
         return jsonify({'msg': '请选择用例', 'status': 0})
-    run_case = RunCase(data.get('projectName'), data.get('sceneIds'))
+    try:
+        cassette = cassette_config(data.get('cassetteMode'), data.get('cassetteName') or data.get('projectName'))
+        concurrency = positive_int(data.get('concurrency'), '并发数')
+        step_concurrency = positive_int(data.get('stepConcurrency'), '步骤并发数')
+        parameter_concurrency = positive_int(data.get('parameterConcurrency'), '参数组合并发数')
+        max_failed_cases = non_negative_int(data.get('maxFailedCases'), '失败用例数上限')
+        time_budget = positive_number(data.get('timeBudget') or None, '执行时限')
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
     if data.get('reportStatus'):
+        # 不生成报告时直接返回执行结果
+        run_case = RunCase(data.get('projectName'), data.get('sceneIds'), concurrency=concurrency,
+                           step_concurrency=step_concurrency, parameter_concurrency=parameter_concurrency)
         run_case.make_report = False
+        run_case.run_type = True
+        run_case.cassette = cassette
+        # 不生成报告时没有报告id，用临时的标记名在并发执行的进程间共享失败用例数
+        run_case.run_control = RunControl(job_id='sync_{}'.format(uuid.uuid4().hex), failfast=data.get('failfast'),
+                                          max_failed_cases=max_failed_cases, time_budget=time_budget)
+        profiler = RunProfiler() if data.get('profile') else None
+        try:
+            res = json.loads(profiler.run(run_case.run_case) if profiler else run_case.run_case())
+        except ValueError as e:
+            return jsonify({'msg': '{}'.format(e), 'status': 0})
+        result = {'report_id': run_case.new_report_id, 'data': res}
+        if profiler:
+            result['profile'] = profiler.summary(run_case.new_report_id)
+        return jsonify({'msg': '测试完成', 'status': 1, 'data': result})
+
+    job_id = enqueue('report_run', {'project_name': data.get('projectName'), 'case_ids': data.get('sceneIds'),
+                                    'concurrency': concurrency,
+                                    'step_concurrency': step_concurrency,
+                                    'parameter_concurrency': parameter_concurrency,
+                                    'failfast': data.get('failfast'),
+                                    'max_failed_cases': max_failed_cases,
+                                    'time_budget': time_budget,
+                                    'profile': data.get('profile'), 'cassette': cassette})
+    return jsonify({'msg': '已加入执行队列', 'status': 1, 'data': {'job_id': job_id, 'report_id': None}})
+
+
+@register_job('report_run')
+def report_run_job(project_name, case_ids, concurrency=None, step_concurrency=None, parameter_concurrency=None,
+                   failfast=False, max_failed_cases=0, time_budget=None, profile=False, cassette=None, job_id=None):
+    """ 执行队列中的用例执行任务，profile为True时性能分析结果放在任务结果中 """
+    run_case = RunCase(project_name, case_ids, concurrency=concurrency, step_concurrency=step_concurrency,
+                       parameter_concurrency=parameter_concurrency)
     run_case.run_type = True
+    run_case.cassette = cassette
+    run_case.run_control = RunControl(job_id=job_id, failfast=failfast, max_failed_cases=max_failed_cases,
+                                      time_budget=time_budget)
+    profiler = RunProfiler() if profile else None
+    res = json.loads(profiler.run(run_case.run_case) if profiler else run_case.run_case())
+    result = {'report_id': run_case.new_report_id, 'stat': res['stat'], 'aborted': res.get('aborted')}
+    if profiler:
+        result['profile'] = profiler.summary(run_case.new_report_id)
+    return result
+
+
+@api.route('/report/rerun', methods=['POST'])
+@login_required
+def rerun_cases():
+    """ 只重跑报告中失败的用例，生成关联原报告的新报告，统计和原报告合并 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    report_data = Report.query.filter_by(id=data.get('reportId')).first()
+    if not report_data:
+        return jsonify({'msg': '报告不存在', 'status': 0})
+    if not os.path.exists(report_path(report_data.id)):
+        return jsonify({'msg': '报告还未生成、或不支持重跑', 'status': 0})
+    try:
+        concurrency = positive_int(data.get('concurrency'), '并发数')
+        step_concurrency = positive_int(data.get('stepConcurrency'), '步骤并发数')
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
+    cases = failed_cases(report_data.id)
+    if not cases:
+        return jsonify({'msg': '报告中没有失败的用例', 'status': 0})
+    case_ids = []
+    for case_id, name in cases:
+        if case_id is None:
+            # 旧报告没有记录用例id，按名称查找
+            case = Case.query.filter_by(project_id=report_data.project_id, name=name).first()
+            case_id = case.id if case else None
+        if case_id is None or not Case.query.filter_by(id=case_id).first():
+            return jsonify({'msg': '用例“{}”已不存在，无法重跑'.format(name), 'status': 0})
+        if case_id not in case_ids:
+            case_ids.append(case_id)
+    project_name = Project.query.filter_by(id=report_data.project_id).first().name
+    job_id = enqueue('report_rerun', {'project_name': project_name, 'case_ids': case_ids,
+                                      'parent_report_id': report_data.id,
+                                      'concurrency': concurrency,
+                                      'step_concurrency': step_concurrency})
+    return jsonify({'msg': '已加入执行队列', 'status': 1,
+                    'data': {'job_id': job_id, 'report_id': None, 'case_ids': case_ids}})
+
+
+@register_job('report_rerun')
+def report_rerun_job(project_name, case_ids, parent_report_id, concurrency=None, step_concurrency=None, job_id=None):
+    """ 执行队列中的重跑任务，执行完成后新报告中是合并后的结果 """
+    run_case = RunCase(project_name, case_ids, concurrency=concurrency, step_concurrency=step_concurrency)
+    run_case.run_type = True
+    run_case.parent_report_id = parent_report_id
+    run_case.run_control = RunControl(job_id=job_id)
     res = json.loads(run_case.run_case())
-    return jsonify({'msg': '测试完成', 'status': 1, 'data': {'report_id': run_case.new_report_id, 'data': res}})
+    summary = read_summary(run_case.new_report_id)
+    return {'report_id': run_case.new_report_id, 'parent_id': parent_report_id, 'stat': summary['stat'],
+            'rerun_stat': res['stat']}
+
+
+@api.route('/report/cancel', methods=['POST'])
+@login_required
+def cancel_run():
+    """ 取消执行，执行中的用例在下一个步骤前停止，已执行的部分照常生成报告 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    if data.get('jobId'):
+        job = RunJob.query.filter_by(id=data.get('jobId')).first()
+        if not job:
+            return jsonify({'msg': '任务不存在', 'status': 0})
+        if job.status in FINISHED_STATUS:
+            return jsonify({'msg': '任务已结束', 'status': 0})
+        return jsonify({'msg': '已取消', 'status': 1, 'data': job_data(cancel_job(job))})
+    if data.get('reportId'):
+        request_cancel(report_id=data.get('reportId'))
+        return jsonify({'msg': '已取消', 'status': 1})
+    return jsonify({'msg': '请选择要取消的执行', 'status': 0})
+
+
+@api.route('/report/load', methods=['POST'])
+@login_required
+def load_cases():
+    """ 用业务用例压测 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    if not data.get('projectName'):
+        return jsonify({'msg': '请选择项目', 'status': 0})
+    case_ids = data.get('sceneIds')
+    if not case_ids and data.get('caseSetId'):
+        case_ids = [c.id for c in Case.query.filter_by(case_set_id=data.get('caseSetId')).order_by(Case.num.asc())]
+    if not case_ids:
+        return jsonify({'msg': '请选择用例', 'status': 0})
+    try:
+        users = positive_int(data.get('users'), '虚拟用户数')
+        # 为0时和不填一样：同时启动、不限速
+        ramp_up = positive_number(data.get('rampUp') or None, '启动时长', 0)
+        rps = positive_number(data.get('rps') or None, '每秒请求数', 0)
+        duration = positive_number(data.get('duration') or None, '持续时间')
+        iterations = positive_int(data.get('iterations'), '执行次数')
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
+    if users > LOAD_MAX_USERS:
+        return jsonify({'msg': '虚拟用户数不能超过{}'.format(LOAD_MAX_USERS), 'status': 0})
+    if duration and duration > LOAD_MAX_DURATION:
+        return jsonify({'msg': '持续时间不能超过{:g}秒'.format(LOAD_MAX_DURATION), 'status': 0})
+    if iterations > LOAD_MAX_ITERATIONS:
+        return jsonify({'msg': '执行次数不能超过{}'.format(LOAD_MAX_ITERATIONS), 'status': 0})
+    job_id = enqueue('load_run', {'project_name': data.get('projectName'), 'case_ids': case_ids, 'users': users,
+                                  'ramp_up': ramp_up, 'rps': rps, 'duration': duration, 'iterations': iterations})
+    return jsonify({'msg': '已加入执行队列', 'status': 1, 'data': {'job_id': job_id, 'report_id': None}})
+
+
+@register_job('load_run')
+def load_run_job(project_name, case_ids, users=1, ramp_up=0, rps=0, duration=None, iterations=1, job_id=None):
+    """ 执行队列中的压测任务，压测结果放在任务结果中；取消后各虚拟用户执行完当前一次就停止 """
+    run_case = RunCase(project_name, case_ids)
+    run_case.run_type = True
+    run_control = RunControl(job_id=job_id)
+    load_runner = LoadRunner(run_case.all_cases_data(), users=users, ramp_up=ramp_up, rps=rps, duration=duration,
+                             iterations=iterations, run_control=run_control)
+    try:
+        return load_runner.run()
+    finally:
+        run_control.clear()
 
 
 @api.route('/report/list', methods=['POST'])
@@ -34,9 +210,9 @@ def get_report():
     current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
     report_id = data.get('reportId')
     state = data.get('state')
-    _address = REPORT_ADDRESS + str(report_id) + '.txt'
+    d = read_report(report_id, state)
 
-    if not os.path.exists(_address):
+    if d is None:
         report_data = Report.query.filter_by(id=report_id).first()
         report_data.read_status = '异常'
         db.session.commit()
@@ -45,21 +221,6 @@ def get_report():
     report_data = Report.query.filter_by(id=report_id).first()
     report_data.read_status = '已读'
     db.session.commit()
-    with open(_address, 'r') as f:
-        d = json.loads(f.read())
-
-    if state == 'success':
-        _d = copy.deepcopy(d['details'])
-        d['details'].clear()
-        for d1 in _d:
-            if d1['success']:
-                d['details'].append(d1)
-    elif state == 'error':
-        _d = copy.deepcopy(d['details'])
-        d['details'].clear()
-        for d1 in _d:
-            if not d1['success']:
-                d['details'].append(d1)
     return jsonify(d)
 
 
@@ -71,9 +232,9 @@ def download_report():
     current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
     report_id = data.get('reportId')
     data_or_report = data.get('dataOrReport')
-    _address = REPORT_ADDRESS + str(report_id) + '.txt'
-    with open(_address, 'r') as f:
-        res = json.loads(f.read())
+    res = read_report(report_id)
+    if res is None:
+        return jsonify({'msg': '报告还未生成、或生成失败', 'status': 0})
     d = render_html_report(res,
                            html_report_name='接口自动化测试报告',
                            html_report_template=r'{}/extent_report_template.html'.format(TEMP_REPORT),
@@ -81,6 +242,23 @@ def download_report():
     return jsonify({'data': d, 'status': 1})
 
 
+@api.route('/report/blob', methods=['POST'])
+@login_required
+def get_report_blob():
+    """ 获取报告中被截断的完整响应内容 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    offset = data.get('offset') or 0
+    size = data.get('size')
+    content = get_blob(data.get('digest'), offset, size)
+    if content is None:
+        return jsonify({'msg': '内容不存在', 'status': 0})
+    try:
+        return jsonify({'data': content.decode('utf-8'), 'encoding': 'utf-8', 'status': 1})
+    except UnicodeDecodeError:
+        return jsonify({'data': base64.b64encode(content).decode('ascii'), 'encoding': 'base64', 'status': 1})
+
+
 @api.route('/report/del', methods=['POST'])
 @login_required
 def del_report():
@@ -114,7 +292,7 @@ def find_report():
     report = pagination.items
     total = pagination.total
     report = [{'name': c.case_names, 'project_name': project_name, 'id': c.id, 'read_status': c.read_status,
-               'address': c.data.replace('.txt', '')} for c in report]
+               'address': c.data.replace('.txt', ''), 'parent_id': c.parent_id, 'base_id': c.base_id} for c in report]
     return jsonify({'data': report, 'total': total, 'status': 1})
 
 
@@ -5,19 +5,48 @@ from app.models import *
 from ..util.custom_decorator import login_required
 from app import scheduler
 from ..util.http_run import RunCase
-from ..util.utils import change_cron, auto_num
+from ..util.utils import change_cron, auto_num, positive_int, non_negative_int, positive_number
 from ..util.email.SendEmail import SendEmail
 from ..util.report.report import render_html_report
+from ..util.report_store import read_report
+from ..util.job_queue import enqueue, register_job
+from ..util.run_control import RunControl
+from ..util.run_profiler import RunProfiler
+from ..util.cassette import cassette_config
+from ..util.plan_check import PlanCheck
+from ..util.change_select import select_changed_cases
 from ..util.global_variable import *
 
 
-def aps_test(project_name, case_ids, send_address=None, send_password=None, task_to_address=None):
-    d = RunCase(project_names=project_name, case_ids=case_ids)
+def aps_test(project_name, case_ids, send_address=None, send_password=None, task_to_address=None, concurrency=1,
+             run_control=None, cassette=None, reference_report_id=None):
+    """
+    reference_report_id不为空时只执行参考报告之后有修改或在参考报告中失败的用例，跳过的用例放在skipped_cases中；
+    跳过的用例沿用参考报告中的结果合并到新报告，新报告仍包含全部用例，可以作为下一次的参考报告。
+    参考报告不存在时执行全部用例
+    """
+    d = RunCase(project_names=project_name, case_ids=case_ids, concurrency=concurrency)
     d.run_type = True
-    d.all_cases_data()
+    d.run_control = run_control
+    d.cassette = cassette
+    if reference_report_id:
+        try:
+            selected_ids, _, skipped = select_changed_cases(case_ids, reference_report_id)
+        except ValueError as e:
+            current_app.logger.info('{}，执行全部用例'.format(e))
+        else:
+            if not selected_ids:
+                # 没有要执行的用例时不生成报告
+                d.skipped_cases = skipped
+                return d
+            if skipped:
+                d.case_ids, d.skipped_cases = selected_ids, skipped
+                d.base_report_id = reference_report_id
     res = json.loads(d.run_case())
 
     if send_address:
+        # 返回的数据不含请求/响应详情，邮件报告使用完整的报告文件
+        res = read_report(d.new_report_id) or res
         task_to_address = task_to_address.split(',')
         file = render_html_report(res,
                                   html_report_name='{}接口自动化测试报告'.format(
@@ -29,14 +58,17 @@ def aps_test(project_name, case_ids, send_address=None, send_password=None, task
     return d
 
 
-@api.route('/task/run', methods=['POST'])
-@login_required
-def run_task():
-    """ 单次运行任务 """
-    data = request.json
-    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
-    ids = data.get('id')
-    _data = Task.query.filter_by(id=ids).first()
+def aps_job(project_name, case_ids, send_address=None, send_password=None, task_to_address=None, concurrency=1,
+            time_budget=None, task_id=None, select_mode=None):
+    """ 定时任务触发时只把执行加入队列，由执行进程执行 """
+    enqueue('task_run', {'project_name': project_name, 'case_ids': case_ids, 'send_address': send_address,
+                         'send_password': send_password, 'task_to_address': task_to_address,
+                         'concurrency': concurrency, 'time_budget': time_budget, 'task_id': task_id,
+                         'select_mode': select_mode})
+
+
+def task_case_ids(_data):
+    """ 任务要执行的用例id：选了用例时为所选用例，否则为所选用例集(都没选时为项目所有用例集)下的用例 """
     case_ids = []
     if len(json.loads(_data.case_id)) != 0:
         case_ids += [i['id'] for i in json.loads(_data.case_id)]
@@ -50,10 +82,101 @@ def run_task():
         for set_id in _set_ids:
             for case_data in Case.query.filter_by(case_set_id=set_id).order_by(Case.num.asc()).all():
                 case_ids.append(case_data.id)
+    return case_ids
+
+
+@api.route('/task/run', methods=['POST'])
+@login_required
+def run_task():
+    """
+    单次运行任务；selectMode为changed时只执行参考报告(reportId，默认为任务上次执行的报告)之后有修改或失败的用例，
+    返回选中和跳过的用例
+    """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    ids = data.get('id')
+    _data = Task.query.filter_by(id=ids).first()
+    case_ids = task_case_ids(_data)
     project_name = Project.query.filter_by(id=_data.project_id).first().name
-    result = aps_test(project_name, case_ids)
+    try:
+        cassette = cassette_config(data.get('cassetteMode'), data.get('cassetteName') or project_name)
+        concurrency = positive_int(data.get('concurrency'), '并发数', _data.concurrency)
+        max_failed_cases = non_negative_int(data.get('maxFailedCases'), '失败用例数上限')
+        time_budget = positive_number(data.get('timeBudget') or None, '执行时限', _data.time_budget)
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
+
+    selection, msg, report_id = {}, '已加入执行队列', None
+    if data.get('selectMode') == 'changed':
+        report_id = data.get('reportId') or _data.last_report_id
+        try:
+            if not report_id:
+                raise ValueError('任务还没有执行过')
+            selected_ids, selected, skipped = select_changed_cases(case_ids, report_id)
+        except ValueError as e:
+            # 没有可用的参考报告时执行全部用例
+            report_id, msg = None, '{}，执行全部用例，已加入执行队列'.format(e)
+        else:
+            selection = {'reference_report_id': report_id, 'selected': selected, 'skipped': skipped}
+            if not selected_ids:
+                return jsonify({'msg': '参考报告之后没有修改或失败的用例，不需要执行', 'status': 1,
+                                'data': dict(selection, job_id=None, report_id=None)})
+    elif data.get('selectMode'):
+        return jsonify({'msg': '不支持的用例选择方式：{}'.format(data.get('selectMode')), 'status': 0})
 
-    return jsonify({'msg': '测试成功', 'status': 1, 'data': {'report_id': result.new_report_id}})
+    job_id = enqueue('task_run', {'project_name': project_name, 'case_ids': case_ids,
+                                  'concurrency': concurrency,
+                                  'failfast': data.get('failfast'), 'max_failed_cases': max_failed_cases,
+                                  'time_budget': time_budget,
+                                  'profile': data.get('profile'), 'cassette': cassette, 'task_id': _data.id,
+                                  'reference_report_id': report_id})
+
+    return jsonify({'msg': msg, 'status': 1, 'data': dict(selection, job_id=job_id, report_id=None)})
+
+
+@register_job('task_run')
+def task_run_job(project_name, case_ids, send_address=None, send_password=None, task_to_address=None, concurrency=1,
+                 failfast=False, max_failed_cases=0, time_budget=None, profile=False, cassette=None, task_id=None,
+                 select_mode=None, reference_report_id=None, job_id=None):
+    """
+    执行队列中的任务，时间预算从开始执行时算起；profile为True时性能分析结果放在任务结果中。
+    指定了参考报告，或select_mode为changed时以任务上次执行的报告为参考，只执行有修改或失败的用例；
+    执行完记录本次的报告id，跳过的用例已合并到本次报告中
+    """
+    task = Task.query.filter_by(id=task_id).first() if task_id else None
+    if not reference_report_id and task and select_mode == 'changed':
+        reference_report_id = task.last_report_id
+    run_control = RunControl(job_id=job_id, failfast=failfast, max_failed_cases=max_failed_cases,
+                             time_budget=time_budget)
+    profiler = RunProfiler() if profile else None
+    args = (project_name, case_ids, send_address, send_password, task_to_address)
+    kwargs = {'concurrency': concurrency, 'run_control': run_control, 'cassette': cassette,
+              'reference_report_id': reference_report_id}
+    result = profiler.run(aps_test, *args, **kwargs) if profiler else aps_test(*args, **kwargs)
+    if task and result.new_report_id:
+        task.last_report_id = result.new_report_id
+        db.session.commit()
+    res = {'report_id': result.new_report_id, 'skipped': result.skipped_cases}
+    if profiler and result.new_report_id:
+        res['profile'] = profiler.summary(result.new_report_id)
+    return res
+
+
+@api.route('/task/compile', methods=['POST'])
+@login_required
+def compile_task():
+    """ 只编译、检查任务中的用例，不发请求，用于定时执行前检查 """
+    data = request.json
+    current_app.logger.info('url:{} ,method:{},请求参数:{}'.format(request.url, request.method, data))
+    _data = Task.query.filter_by(id=data.get('id')).first()
+    if not _data:
+        return jsonify({'msg': '任务不存在', 'status': 0})
+    case_ids = task_case_ids(_data)
+    if not case_ids:
+        return jsonify({'msg': '任务中没有用例', 'status': 0})
+    run_case = RunCase(project_names=Project.query.filter_by(id=_data.project_id).first().name, case_ids=case_ids)
+    run_case.run_type = True
+    return jsonify({'msg': '编译完成', 'status': 1, 'data': PlanCheck(run_case).run()})
 
 
 @api.route('/task/start', methods=['POST'])
@@ -66,24 +189,14 @@ def start_task():
     _data = Task.query.filter_by(id=ids).first()
 
     config_time = change_cron(_data.task_config_time)
-    case_ids = []
-    if len(json.loads(_data.case_id)) != 0:
-        case_ids += [i['id'] for i in json.loads(_data.case_id)]
-    else:
-        if len(json.loads(_data.case_id)) == 0 and len(json.loads(_data.set_id)) == 0:
-            project_id = Project.query.filter_by(name=_data.project_name).first().id
-            _set_ids = [_set.id for _set in
-                        CaseSet.query.filter_by(project_id=project_id).order_by(CaseSet.num.asc()).all()]
-        else:
-            _set_ids = [i['id'] for i in json.loads(_data.set_id)]
-        for set_id in _set_ids:
-            for case_data in Case.query.filter_by(case_set_id=set_id).order_by(Case.num.asc()).all():
-                case_ids.append(case_data.id)
+    case_ids = task_case_ids(_data)
     # scheduler.add_job(str(ids), aps_test, trigger='cron', args=['asd'], **config_time)
     project_name = Project.query.filter_by(id=_data.project_id).first().name
-    scheduler.add_job(aps_test, 'cron',
+    scheduler.add_job(aps_job, 'cron',
                       args=[project_name, case_ids, _data.task_send_email_address, _data.email_password,
                             _data.task_to_email_address],
+                      kwargs={'concurrency': _data.concurrency, 'time_budget': _data.time_budget, 'task_id': _data.id,
+                              'select_mode': _data.select_mode},
                       id=str(ids), **config_time)  # 添加任务
     _data.status = '启动'
     db.session.commit()
@@ -110,6 +223,14 @@ def add_task():
     to_email = data.get('toEmail')
     send_email = data.get('sendEmail')
     password = data.get('password')
+    try:
+        concurrency = positive_int(data.get('concurrency'), '并发数')
+        time_budget = positive_number(data.get('timeBudget') or None, '执行时限')
+    except ValueError as e:
+        return jsonify({'msg': '{}'.format(e), 'status': 0})
+    select_mode = data.get('selectMode') or None
+    if select_mode not in (None, 'changed'):
+        return jsonify({'msg': '不支持的用例选择方式：{}'.format(select_mode), 'status': 0})
     # 0 0 1 * * *
     if not (not to_email and not send_email and not password) and not (to_email and send_email and password):
         return jsonify({'msg': '发件人、收件人、密码3个必须都为空，或者都必须有值', 'status': 0})
@@ -131,6 +252,9 @@ def add_task():
             old_task_data.task_to_email_address = to_email
             old_task_data.task_send_email_address = send_email
             old_task_data.email_password = password
+            old_task_data.concurrency = concurrency
+            old_task_data.time_budget = time_budget
+            old_task_data.select_mode = select_mode
             old_task_data.num = num
             if old_task_data.status != '创建' and old_task_data.task_config_time != time_config:
                 scheduler.reschedule_job(str(task_id), trigger='cron', **change_cron(time_config))  # 修改任务
@@ -153,6 +277,9 @@ def add_task():
                             task_to_email_address=to_email,
                             task_send_email_address=send_email,
                             task_config_time=time_config,
+                            concurrency=concurrency,
+                            time_budget=time_budget,
+                            select_mode=select_mode,
                             num=num)
             db.session.add(new_task)
             db.session.commit()
@@ -170,7 +297,8 @@ def edit_task():
     _data = {'num': c.num, 'task_name': c.task_name, 'task_config_time': c.task_config_time, 'task_type': c.task_type,
              'set_ids': json.loads(c.set_id), 'case_ids': json.loads(c.case_id),
              'task_to_email_address': c.task_to_email_address, 'task_send_email_address': c.task_send_email_address,
-             'password': c.email_password}
+             'password': c.email_password, 'concurrency': c.concurrency,
+             'time_budget': c.time_budget, 'select_mode': c.select_mode, 'last_report_id': c.last_report_id}
 
     return jsonify({'data': _data, 'status': 1})
 
@@ -5,6 +5,7 @@ from flask import jsonify, request
 from app.models import *
 from . import api
 from ..util.tool_func import *
+from ..util.func_registry import func_registry
 
 
 @api.route('/buildIdentity')
@@ -59,13 +60,10 @@ def is_function(tup):
 
 @api.route('/runCmd', methods=['POST'])
 def run_cmd():
-    import importlib
-
     data = request.json
     name = data.get('funcName')
     import_path = 'func_list.build_in_func'
-    func_list = importlib.reload(importlib.import_module(import_path))
-    module_functions_dict = dict(filter(is_function, vars(func_list).items()))
+    module_functions_dict = func_registry.functions(import_path)
     module_functions_dict[name]()
 
     return jsonify({'msg': '完成', 'status': 1})
@@ -105,6 +105,7 @@ class Project(db.Model):
     principal = db.Column(db.String(), nullable=True)
     variables = db.Column(db.String(), comment='项目的公共变量')
     headers = db.Column(db.String(), comment='项目的公共头部信息')
+    report_body_limit = db.Column(db.Integer(), comment='报告中响应内容保留的最大长度，超出的完整内容另存，为空时使用默认值')
     created_time = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow, comment='创建时间')
     modules = db.relationship('Module', order_by='Module.num.asc()', lazy='dynamic')
     configs = db.relationship('Config', order_by='Config.num.asc()', lazy='dynamic')
@@ -129,6 +130,8 @@ class Config(db.Model):
     variables = db.Column(db.String(), comment='配置参数')
     func_address = db.Column(db.String(), comment='配置函数')
     created_time = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow, comment='创建时间')
+    update_time = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow,
+                            comment='最后修改时间')
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), comment='所属的项目id')
 
 
@@ -152,7 +155,11 @@ class Case(db.Model):
     func_address = db.Column(db.String(), comment='用例需要引用的函数')
     variable = db.Column(db.String(), comment='用例公共参数')
     times = db.Column(db.Integer(), nullable=True, comment='执行次数')
+    deadline = db.Column(db.Float(), nullable=True, comment='用例单次执行的总时限(秒)，为空不限制')
+    parameters = db.Column(db.String(), nullable=True, comment='参数化配置，每个参数组合执行一次用例')
     created_time = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow, comment='创建时间')
+    update_time = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow,
+                            comment='最后修改时间')
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), comment='所属的项目id')
     case_set_id = db.Column(db.Integer, db.ForeignKey('case_set.id'), comment='所属的用例集id')
 
@@ -161,6 +168,8 @@ class ApiMsg(db.Model):
     __tablename__ = 'api_msg'
     id = db.Column(db.Integer(), primary_key=True, comment='主键，自增')
     timestamp = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow)
+    update_time = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow,
+                            comment='最后修改时间')
     num = db.Column(db.Integer(), nullable=True, comment='接口序号')
     name = db.Column(db.String(), nullable=True, comment='接口名称')
     desc = db.Column(db.String(), nullable=True, comment='接口描述')
@@ -178,6 +187,9 @@ class ApiMsg(db.Model):
     header = db.Column(db.String(), comment='头部信息')
     module_id = db.Column(db.Integer, db.ForeignKey('module.id'), comment='所属的接口模块id')
     project_id = db.Column(db.Integer, nullable=True, comment='所属的项目id')
+    connect_timeout = db.Column(db.Float(), nullable=True, comment='建立连接的超时时间(秒)，为空使用默认值')
+    read_timeout = db.Column(db.Float(), nullable=True, comment='等待响应的超时时间(秒)，为空使用默认值')
+    retry = db.Column(db.String(), nullable=True, comment='失败重试设置，json格式，为空不重试')
 
 
 class ApiSuite(db.Model):
@@ -196,6 +208,8 @@ class CaseData(db.Model):
     __tablename__ = 'case_data'
     id = db.Column(db.Integer(), primary_key=True, comment='主键，自增')
     timestamp = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow)
+    update_time = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow,
+                            comment='最后修改时间')
     num = db.Column(db.Integer(), nullable=True, comment='步骤序号，执行顺序按序号来')
     status = db.Column(db.String(), comment='状态，true表示执行，false表示不执行')
     name = db.Column(db.String(), comment='步骤名称')
@@ -211,6 +225,7 @@ class CaseData(db.Model):
     status_extract = db.Column(db.String)
     validate = db.Column(db.String())
     status_validate = db.Column(db.String)
+    retry = db.Column(db.String(), nullable=True, comment='失败重试设置，json格式，为空时使用接口的设置')
     case_id = db.Column(db.Integer, db.ForeignKey('case.id'))
     api_msg_id = db.Column(db.Integer, db.ForeignKey('api_msg.id'))
 
@@ -223,6 +238,8 @@ class Report(db.Model):
     read_status = db.Column(db.String, nullable=True, comment='阅读状态')
     data = db.Column(db.String(65500), nullable=True)
     project_id = db.Column(db.String(), nullable=True)
+    parent_id = db.Column(db.Integer(), nullable=True, comment='重跑失败用例生成的报告，对应的原报告id')
+    base_id = db.Column(db.Integer(), nullable=True, comment='按修改只执行部分用例生成的报告，跳过的用例沿用的参考报告id')
 
 
 class Task(db.Model):
@@ -239,9 +256,29 @@ class Task(db.Model):
     task_send_email_address = db.Column(db.String(252), comment='发件人邮箱')
     email_password = db.Column(db.String(), comment='发件人邮箱密码')
     status = db.Column(db.String(), default=u'创建', comment='任务的运行状态，默认是创建')
+    concurrency = db.Column(db.Integer(), default=1, comment='用例并发执行的进程数，1为顺序执行')
+    time_budget = db.Column(db.Float(), nullable=True, comment='单次执行的总时限(秒)，为空不限制')
+    select_mode = db.Column(db.String(), nullable=True, comment='用例选择方式：为空执行全部用例，changed只执行参考报告后有修改或失败的用例')
+    last_report_id = db.Column(db.Integer(), nullable=True, comment='最近一次执行生成的报告id，按修改选择用例时作为参考报告')
     project_id = db.Column(db.String(), nullable=True)
 
 
+class RunJob(db.Model):
+    __tablename__ = 'run_job'
+    id = db.Column(db.Integer, primary_key=True, comment='主键，自增')
+    job_type = db.Column(db.String(), comment='任务类型，对应注册的执行函数')
+    params = db.Column(db.String(), comment='执行参数，json格式')
+    status = db.Column(db.String(), default='queued', index=True, comment='queued/running/success/failed')
+    report_id = db.Column(db.Integer(), nullable=True, comment='执行生成的报告id')
+    result = db.Column(db.String(), nullable=True, comment='执行结果或异常信息，json格式')
+    worker = db.Column(db.String(), nullable=True, comment='执行该任务的进程')
+    created_time = db.Column(db.DateTime, default=datetime.datetime.now, comment='入队时间')
+    start_time = db.Column(db.DateTime, nullable=True, comment='开始执行时间')
+    end_time = db.Column(db.DateTime, nullable=True, comment='执行结束时间')
+    heartbeat = db.Column(db.DateTime, nullable=True, comment='执行进程最近一次心跳时间')
+    attempts = db.Column(db.Integer(), default=0, comment='已执行次数，执行进程异常退出后会重新入队')
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
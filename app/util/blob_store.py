@@ -0,0 +1,65 @@
+# encoding: utf-8
+import hashlib
+import os
+import uuid
+
+from .global_variable import BLOB_ADDRESS
+
+
+def blob_path(digest):
+    """ 按sha256存储，前两位作为子目录，避免单个目录文件过多 """
+    return os.path.join(BLOB_ADDRESS, digest[:2], digest)
+
+
+def put_blob(content):
+    """ 保存内容并返回sha256，相同内容只保存一份 """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    digest = hashlib.sha256(content).hexdigest()
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再改名，并发写同一内容时不会读到写了一半的文件
+        temp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    return digest
+
+
+def get_blob(digest, offset=0, size=None):
+    """ 读取保存的内容，可以只读其中一段；不存在时返回None """
+    if not digest or not all(c in '0123456789abcdef' for c in digest):
+        return None
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size) if size else f.read()
+
+
+def spill_response_body(meta_data, limit):
+    """
+    响应内容超过limit字节时，完整内容存到blob，报告中只保留前limit个字符的文本，
+    并记录response_blob供报告页面按需读取。limit为空或小于等于0时不处理。
+    """
+    response = meta_data.get('response') if meta_data else None
+    if not limit or limit <= 0 or not response:
+        return meta_data
+    content = response.get('content')
+    if content is None:
+        return meta_data
+    size = len(content)
+    if size <= limit:
+        return meta_data
+
+    response['response_blob'] = {'digest': put_blob(content), 'size': size, 'inline_size': limit}
+    text = response.get('text') or ''
+    if 'image' in (response.get('content_type') or ''):
+        # 截断的图片无法显示，不保留
+        text = ''
+    response['content'] = text[:limit]
+    response['text'] = text[:limit]
+    response['json'] = None
+    return meta_data
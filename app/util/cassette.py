@@ -0,0 +1,209 @@
+# encoding: utf-8
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import uuid
+from http.client import HTTPMessage
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError
+from urllib3.response import HTTPResponse
+from .blob_store import put_blob, get_blob
+from .global_variable import CASSETTE_ADDRESS
+
+CASSETTE_MODES = ('record', 'replay')
+# 录制的是解码后的内容，回放时这些头部已经不对应
+_SKIP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class CassetteMiss(ConnectionError):
+    """ 回放时没有录制过该请求，步骤按error记录 """
+    pass
+
+
+def _hash(content):
+    if content is None:
+        content = b''
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+
+def cassette_dir(name):
+    # 名称作为目录名，去掉路径分隔符等字符
+    return os.path.join(CASSETTE_ADDRESS, re.sub(r'[^\w\-.]', '_', '{}'.format(name)))
+
+
+class Cassette(object):
+    """
+    录制/回放的请求和响应。按 请求方式+url 分文件保存(JSON Lines，一行一次请求)，响应内容存到blob。
+    回放时优先匹配请求体相同的记录，没有时按录制顺序匹配；同一个请求录制了多次时按顺序依次回放，回放完后重复最后一次。
+    一个用例使用一个Cassette对象，回放顺序按用例计算。
+    每条记录带有录制的执行id(run)，重新录制只替换本次执行录制到的请求：同一个请求只使用最后一次执行录制的记录，
+    其它请求保留之前的录制。
+    """
+
+    def __init__(self, name, mode, run=None):
+        if mode not in CASSETTE_MODES:
+            raise ValueError('录制模式只能是{}'.format('/'.join(CASSETTE_MODES)))
+        self.name = name
+        self.mode = mode
+        self.run = run
+        self.path = cassette_dir(name)
+        self._cursors = {}
+
+    def to_dict(self):
+        return {'name': self.name, 'mode': self.mode, 'run': self.run}
+
+    @staticmethod
+    def new_run():
+        """ 一次录制的执行id，执行中的所有用例、并发的进程共用 """
+        return uuid.uuid4().hex
+
+    def _key_path(self, method, url):
+        return os.path.join(self.path, '{}.jsonl'.format(_hash('{} {}'.format(method.upper(), url))))
+
+    def record(self, request, response):
+        headers = [(k, v) for k, v in response.raw.headers.iteritems() if k.lower() not in _SKIP_HEADERS] \
+            if getattr(response.raw, 'headers', None) is not None else list(response.headers.items())
+        entry = {'run': self.run, 'method': request.method, 'url': request.url, 'body_hash': _hash(request.body),
+                 'status_code': response.status_code, 'reason': response.reason, 'headers': headers,
+                 'body': put_blob(response.content or b''), 'encoding': response.encoding}
+        os.makedirs(self.path, exist_ok=True)
+        # 追加写一行，并发执行的多个进程可以写同一个文件
+        with open(self._key_path(request.method, request.url), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    @staticmethod
+    def _read(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        # 只使用最后一次执行录制的记录
+        return [e for e in entries if e.get('run') == entries[-1].get('run')] if entries else entries, len(entries)
+
+    @classmethod
+    def _load(cls, path):
+        """ 读取录制文件，文件没变时使用缓存 """
+        if not os.path.exists(path):
+            return []
+        mtime = os.path.getmtime(path)
+        with _cache_lock:
+            cached = _cache.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        entries, _ = cls._read(path)
+        with _cache_lock:
+            _cache[path] = (mtime, entries)
+        return entries
+
+    def compact(self):
+        """ 录制结束后删除被本次执行重新录制的请求的旧记录 """
+        if not self.run or not os.path.exists(self.path):
+            return
+        for file_name in os.listdir(self.path):
+            path = os.path.join(self.path, file_name)
+            entries, total = self._read(path)
+            if len(entries) == total or entries[-1].get('run') != self.run:
+                continue
+            with open('{}.tmp'.format(path), 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace('{}.tmp'.format(path), path)
+
+    def match(self, request):
+        path = self._key_path(request.method, request.url)
+        entries = self._load(path)
+        if not entries:
+            return None
+        body_hash = _hash(request.body)
+        same_body = [e for e in entries if e['body_hash'] == body_hash]
+        candidates, cursor_key = (same_body, (path, body_hash)) if same_body else (entries, (path, None))
+        index = self._cursors.get(cursor_key, 0)
+        self._cursors[cursor_key] = index + 1
+        return candidates[min(index, len(candidates) - 1)]
+
+
+class _OriginalResponse(object):
+    """ requests从原始响应的msg中读取cookies """
+
+    def __init__(self, headers):
+        self.msg = HTTPMessage()
+        for key, value in headers:
+            self.msg[key] = value
+
+    def isclosed(self):
+        return True
+
+
+class RecordingAdapter(BaseAdapter):
+    """ 请求照常发出，响应保存到cassette """
+
+    def __init__(self, adapter, cassette):
+        super(RecordingAdapter, self).__init__()
+        self.adapter = adapter
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.record(request, response)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(HTTPAdapter):
+    """ 不发出请求，直接返回录制的响应；没有录制过的请求抛出CassetteMiss """
+
+    def __init__(self, cassette):
+        super(ReplayAdapter, self).__init__(pool_connections=1, pool_maxsize=1)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        entry = self.cassette.match(request)
+        if entry is None:
+            raise CassetteMiss('录制"{}"中没有该请求：{} {}'.format(self.cassette.name, request.method, request.url),
+                               request=request)
+        content = get_blob(entry['body']) or b''
+        headers = list(entry['headers']) + [('Content-Length', '{}'.format(len(content)))]
+        raw = HTTPResponse(body=io.BytesIO(content), headers=headers, status=entry['status_code'],
+                           reason=entry['reason'], preload_content=False, decode_content=False,
+                           original_response=_OriginalResponse(headers))
+        response = self.build_response(request, raw)
+        if entry.get('encoding'):
+            response.encoding = entry['encoding']
+        return response
+
+
+def cassette_config(mode, name):
+    """ 请求参数中的录制设置，mode为空时不录制也不回放；mode有误时抛出ValueError """
+    if not mode:
+        return None
+    if mode not in CASSETTE_MODES:
+        raise ValueError('录制模式只能是{}'.format('/'.join(CASSETTE_MODES)))
+    if not name:
+        raise ValueError('请填写录制名称')
+    return {'name': name, 'mode': mode}
+
+
+def list_cassettes():
+    """ 已有的录制及其中的请求数 """
+    if not os.path.exists(CASSETTE_ADDRESS):
+        return []
+    cassettes = []
+    for name in sorted(os.listdir(CASSETTE_ADDRESS)):
+        path = os.path.join(CASSETTE_ADDRESS, name)
+        if not os.path.isdir(path):
+            continue
+        requests_num = 0
+        for file_name in os.listdir(path):
+            with open(os.path.join(path, file_name), 'r', encoding='utf-8') as f:
+                requests_num += sum(1 for line in f if line.strip())
+        cassettes.append({'name': name, 'requests': requests_num})
+    return cassettes
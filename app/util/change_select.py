@@ -0,0 +1,79 @@
+# encoding: utf-8
+import datetime
+import json
+import os
+
+from app.models import Case, CaseData, ApiMsg, Report
+from .global_variable import FUNC_ADDRESS
+from .report_store import report_path, report_cases
+
+
+def _changed(update_time, reference_time):
+    """ 没有修改时间的旧数据无法判断，按有修改处理 """
+    return update_time is None or update_time > reference_time
+
+
+def _func_file_time(file_name):
+    path = os.path.join(FUNC_ADDRESS, file_name)
+    if not os.path.exists(path):
+        return None
+    return datetime.datetime.utcfromtimestamp(os.path.getmtime(path))
+
+
+def select_changed_cases(case_ids, report_id):
+    """
+    按修改选择要执行的用例：参考报告之后用例、用例步骤、步骤引用的接口或引用的函数文件有修改，
+    在参考报告中失败或不在参考报告中的用例需要执行，其它的跳过。
+    返回 (要执行的用例id, [{'case_id', 'name', 'reasons'}], 跳过的用例[{'case_id', 'name', 'reason'}])，
+    要执行的用例id保持case_ids中的顺序
+    """
+    report = Report.query.filter_by(id=report_id).first()
+    if not report or not os.path.exists(report_path(report_id)):
+        raise ValueError('参考报告{}不存在'.format(report_id))
+    reference_time = report.timestamp
+    reported = {}
+    for case_id, name, success in report_cases(report_id):
+        # 同一个用例执行了多次(执行次数、参数化)时，有一次失败就算失败
+        reported[case_id] = reported.get(case_id, True) and success
+
+    cases = {c.id: c for c in Case.query.filter(Case.id.in_(case_ids)).all()}
+    api_cases_map = {}
+    for api_case in CaseData.query.filter(CaseData.case_id.in_(case_ids)).all():
+        api_cases_map.setdefault(api_case.case_id, []).append(api_case)
+    api_msg_ids = list({api_case.api_msg_id for api_cases in api_cases_map.values() for api_case in api_cases})
+    api_msgs = {a.id: a for a in ApiMsg.query.filter(ApiMsg.id.in_(api_msg_ids)).all()} if api_msg_ids else {}
+    func_times = {}
+
+    selected_ids, selected, skipped = [], [], []
+    for case_id in case_ids:
+        case = cases.get(int(case_id))
+        if not case:
+            continue
+        reasons = []
+        if case.id not in reported:
+            reasons.append('参考报告中没有执行')
+        elif not reported[case.id]:
+            reasons.append('参考报告中执行失败')
+        if _changed(case.update_time, reference_time):
+            reasons.append('用例有修改')
+        for api_case in api_cases_map.get(case.id, []):
+            if _changed(api_case.update_time, reference_time):
+                reasons.append('步骤{}有修改'.format(api_case.name))
+            api_msg = api_msgs.get(api_case.api_msg_id)
+            if api_msg and _changed(api_msg.update_time, reference_time):
+                reason = '接口{}有修改'.format(api_msg.name)
+                if reason not in reasons:
+                    reasons.append(reason)
+        for file_name in json.loads(case.func_address or '[]'):
+            if file_name not in func_times:
+                func_times[file_name] = _func_file_time(file_name)
+            if func_times[file_name] and func_times[file_name] > reference_time:
+                reasons.append('函数文件{}有修改'.format(file_name))
+
+        if reasons:
+            selected_ids.append(case.id)
+            selected.append({'case_id': case.id, 'name': case.name, 'reasons': reasons})
+        else:
+            skipped.append({'case_id': case.id, 'name': case.name,
+                            'reason': '参考报告{}之后没有修改且执行成功'.format(report_id)})
+    return selected_ids, selected, skipped
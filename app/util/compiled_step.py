@@ -0,0 +1,147 @@
+# encoding: utf-8
+import copy
+import json
+
+from .global_variable import CONTENT_TYPE, STEP_CACHE_SIZE, REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT
+from .plan_cache import PlanCache
+from .http_client import RetryPolicy
+
+# 编译步骤用到的字段，字段值组成的元组就是步骤的版本号
+CASE_DATA_FIELDS = ('name', 'up_func', 'down_func', 'param', 'status_param', 'variable', 'json_variable',
+                    'status_variables', 'extract', 'status_extract', 'validate', 'status_validate', 'retry')
+API_MSG_FIELDS = ('name', 'method', 'header', 'status_url', 'url', 'project_id', 'up_func', 'down_func', 'param',
+                  'variable_type', 'variable', 'json_variable', 'extract', 'validate', 'connect_timeout',
+                  'read_timeout', 'retry')
+
+
+class CompiledStep(object):
+    """
+    预先解析好的步骤：json字符串字段只解析一次，用例和接口的覆盖选择也已确定，
+    每次执行(包括重复执行次数)只需要用to_teststep生成新的HttpRunner步骤数据
+    """
+    __slots__ = ('name', 'group', 'method', 'headers', 'project_id', 'status_url', 'url', 'setup_hooks',
+                 'teardown_hooks', 'params', 'data', 'files', 'upload_files', 'json', 'extract', 'validate', 'timeout',
+                 'retry')
+
+    def __init__(self, case_data, api_case, run_type):
+        self.name = case_data.name
+        self.group = '{}'.format(api_case.id)  # 请求按接口id分组统计
+        self.method = api_case.method
+        header = json.loads(api_case.header)
+        self.headers = {h['key']: h['value'] for h in header if h['key']} if header else None
+        self.project_id = api_case.project_id
+        self.status_url = api_case.status_url
+        self.url = api_case.url.split('?')[0] if api_case.status_url != '-1' else api_case.url
+        # (连接超时, 读取超时)，接口没有设置时使用默认值
+        self.timeout = (api_case.connect_timeout or REQUEST_CONNECT_TIMEOUT,
+                        api_case.read_timeout or REQUEST_READ_TIMEOUT)
+
+        # 步骤设置了重试时使用步骤的设置，否则使用接口的设置
+        retry_policy = RetryPolicy.from_config(getattr(case_data, 'retry', None) or api_case.retry)
+        self.retry = retry_policy.to_dict() if retry_policy else None
+
+        hook_data = case_data if run_type else api_case
+        self.setup_hooks = hook_data.up_func or None
+        self.teardown_hooks = hook_data.down_func or None
+
+        self.params = None
+        if not run_type or json.loads(case_data.status_param)[0]:
+            if not run_type or json.loads(case_data.status_param)[1]:
+                _param = json.loads(case_data.param)
+            else:
+                _param = json.loads(api_case.param)
+            self.params = {param['key']: param['value'] for param in _param if param.get('key')}
+
+        self.data, self.files, self.upload_files, self.json = {}, {}, [], None
+        if not run_type or json.loads(case_data.status_variables)[0]:
+            status_variables = json.loads(case_data.status_variables)[1] if run_type else True
+            _json_variables = case_data.json_variable if status_variables else api_case.json_variable
+            _variables = json.loads(case_data.variable)
+            self._compile_variables(api_case, _variables, _json_variables)
+
+        self.extract = None
+        if not run_type or json.loads(case_data.status_extract)[0]:
+            if not run_type or json.loads(case_data.status_extract)[1]:
+                _extract_temp = case_data.extract
+            else:
+                _extract_temp = api_case.extract
+            self.extract = [(ext['key'], ext['value']) for ext in json.loads(_extract_temp) if ext.get('key')]
+
+        self.validate = None
+        if not run_type or json.loads(case_data.status_validate)[0]:
+            if not run_type or json.loads(case_data.status_validate)[1]:
+                _validate_temp = case_data.validate
+            else:
+                _validate_temp = api_case.validate
+            self.validate = [(val['comparator'], val['key'], val['value']) for val in json.loads(_validate_temp)
+                             if val.get('key')]
+
+    def _compile_variables(self, api_case, _variables, _json_variables):
+        if api_case.method == 'GET':
+            return
+        if api_case.variable_type in ('text', 'data'):
+            for variable in _variables:
+                if not variable.get('key'):
+                    continue
+                if variable['param_type'] == 'string':
+                    if api_case.variable_type == 'text':
+                        self.files[variable['key']] = (None, variable['value'])
+                    else:
+                        self.data[variable['key']] = variable['value']
+                elif variable['param_type'] == 'file':
+                    # 上传文件只记录路径，执行前再打开
+                    self.files[variable['key']] = (variable['value'].split('/')[-1], variable['value'],
+                                                   CONTENT_TYPE['.{}'.format(variable['value'].split('.')[-1])])
+                    self.upload_files.append(variable['key'])
+        elif api_case.variable_type == 'json':
+            if _json_variables:
+                self.json = json.loads(_json_variables)
+
+    @property
+    def extract_keys(self):
+        return [key for key, _ in self.extract or []]
+
+    def to_teststep(self, pro_base_url):
+        """ 生成新的HttpRunner步骤数据，执行过程中对步骤数据的修改不会影响编译结果 """
+        step = {'name': self.name,
+                'request': {'method': self.method, 'files': dict(self.files), 'data': dict(self.data),
+                            'group': self.group, 'timeout': list(self.timeout)}}
+        if self.headers is not None:
+            step['request']['headers'] = dict(self.headers)
+        if self.status_url != '-1':
+            step['request']['url'] = pro_base_url['{}'.format(self.project_id)][int(self.status_url)] + self.url
+        else:
+            step['request']['url'] = self.url
+        if self.setup_hooks:
+            step['setup_hooks'] = [self.setup_hooks]
+        if self.teardown_hooks:
+            step['teardown_hooks'] = [self.teardown_hooks]
+        if self.params is not None:
+            step['request']['params'] = dict(self.params)
+        if self.retry is not None:
+            step['request']['retry'] = copy.deepcopy(self.retry)
+        if self.upload_files:
+            step['upload_files'] = list(self.upload_files)
+        if self.json is not None:
+            step['request']['json'] = copy.deepcopy(self.json)
+        if self.extract is not None:
+            step['extract'] = [{key: value} for key, value in self.extract]
+        if self.validate is not None:
+            step['validate'] = [{comparator: [key, value]} for comparator, key, value in self.validate]
+            step['output'] = ['token']
+        return step
+
+
+step_cache = PlanCache(STEP_CACHE_SIZE)
+
+
+def compile_step(case_data, api_case, run_type):
+    """ 获取编译好的步骤，步骤和接口的相关字段都没变时直接复用 """
+    key = (run_type, case_data.id, api_case.id)
+    version = tuple(getattr(case_data, f, None) for f in CASE_DATA_FIELDS) + \
+        tuple(getattr(api_case, f) for f in API_MSG_FIELDS)
+    compiled = step_cache.get(key, version)
+    if compiled is None:
+        compiled = CompiledStep(case_data, api_case, run_type)
+        step_cache.put(key, version, compiled)
+    return compiled
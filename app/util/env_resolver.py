@@ -0,0 +1,51 @@
+# encoding: utf-8
+import json
+import threading
+import time
+
+from app import db
+from app.models import Project
+from .global_variable import ENV_CACHE_TTL
+
+# 项目的环境选择对应保存基础url的字段
+ENVIRONMENT_COLUMNS = {'first': 'host', 'second': 'host_two', 'third': 'host_three', 'fourth': 'host_four'}
+
+
+class EnvironmentResolver(object):
+    """
+    缓存每个项目当前所选环境的基础url列表，执行用例和页面接口共用。
+    项目修改、删除时主动失效；其他进程修改的项目最多ttl秒后生效。
+    """
+
+    def __init__(self, ttl=ENV_CACHE_TTL):
+        self.ttl = ttl
+        self._hosts = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        hosts = {}
+        for row in db.session.query(Project.id, Project.environment_choice, Project.host, Project.host_two,
+                                    Project.host_three, Project.host_four).all():
+            column = ENVIRONMENT_COLUMNS.get(row.environment_choice)
+            if column:
+                hosts['{}'.format(row.id)] = json.loads(getattr(row, column))
+        return hosts
+
+    def base_urls(self):
+        """ {项目id: [基础url, ...]}，返回的数据只读，不要修改 """
+        with self._lock:
+            if self._hosts is None or time.time() - self._loaded_at > self.ttl:
+                self._hosts = self._load()
+                self._loaded_at = time.time()
+            return self._hosts
+
+    def project_hosts(self, project_id):
+        return self.base_urls().get('{}'.format(project_id))
+
+    def invalidate(self):
+        with self._lock:
+            self._hosts = None
+
+
+env_resolver = EnvironmentResolver()
@@ -0,0 +1,106 @@
+# encoding: utf-8
+import hashlib
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+import time
+import types
+
+
+def _file_md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+class FuncRegistry(object):
+    """
+    func_list下函数文件的注册表：文件的修改时间、大小都没变时直接使用已加载的模块，
+    变化后再比较内容的md5，内容确实改了才reload。加载出来的函数表所有调用方共用，不要修改。
+    """
+
+    def __init__(self):
+        self._modules = {}
+        self._lock = threading.Lock()
+
+    def _stat(self, path):
+        stat = os.stat(path)
+        return stat.st_mtime, stat.st_size
+
+    def _load(self, import_path, entry):
+        start_time = time.time()
+        if import_path in sys.modules:
+            path = getattr(sys.modules[import_path], '__file__', None)
+            if path and os.path.exists(path):
+                # 同一秒内修改且大小不变时pyc缓存判断不出来，删掉后按源文件重新编译
+                cache_path = importlib.util.cache_from_source(path)
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
+            importlib.invalidate_caches()
+            module = importlib.reload(sys.modules[import_path])
+        else:
+            importlib.invalidate_caches()
+            module = importlib.import_module(import_path)
+        entry['module'] = module
+        entry['functions'] = {name: item for name, item in vars(module).items()
+                              if isinstance(item, types.FunctionType)}
+        entry['path'] = module.__file__
+        entry['stat'] = self._stat(module.__file__)
+        entry['md5'] = _file_md5(module.__file__)
+        entry['loads'] += 1
+        entry['load_time'] += time.time() - start_time
+        entry['last_load_time'] = round(time.time() - start_time, 6)
+
+    def module(self, import_path):
+        """ 获取函数文件模块，文件有修改时才重新加载 """
+        with self._lock:
+            entry = self._modules.get(import_path)
+            if entry is None:
+                entry = {'loads': 0, 'hits': 0, 'load_time': 0.0, 'last_load_time': 0.0}
+                self._load(import_path, entry)
+                self._modules[import_path] = entry
+                return entry
+
+            stat = self._stat(entry['path']) if os.path.exists(entry['path']) else None
+            if stat is None:
+                # 文件被删除
+                self._modules.pop(import_path)
+                sys.modules.pop(import_path, None)
+                raise ImportError('No module named {}'.format(import_path))
+            if stat != entry['stat']:
+                md5 = _file_md5(entry['path'])
+                if md5 != entry['md5']:
+                    self._load(import_path, entry)
+                    return entry
+                entry['stat'] = stat
+            entry['hits'] += 1
+            return entry
+
+    def functions(self, import_path):
+        """ 函数文件中定义的函数 {函数名: 函数} """
+        return self.module(import_path)['functions']
+
+    def load_functions(self, import_paths):
+        """ 合并多个函数文件的函数，后面的覆盖前面的同名函数 """
+        functions = {}
+        for import_path in import_paths:
+            functions.update(self.functions(import_path))
+        return functions
+
+    def invalidate(self, import_path):
+        """ 函数文件保存或删除后，下次使用时强制比较文件内容 """
+        with self._lock:
+            entry = self._modules.get(import_path)
+            if entry is not None:
+                entry['stat'] = None
+
+    def stats(self):
+        with self._lock:
+            return {import_path: {'loads': entry['loads'], 'reloads': entry['loads'] - 1, 'hits': entry['hits'],
+                                  'load_time': round(entry['load_time'], 6),
+                                  'last_load_time': entry['last_load_time']}
+                    for import_path, entry in self._modules.items()}
+
+
+func_registry = FuncRegistry()
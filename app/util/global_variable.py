@@ -689,11 +689,33 @@ CONTENT_TYPE = {
     '.zip': 'application/zip',
     '.zoo': 'application/x-zoo',
 }
-REPORT_ADDRESS = os.path.abspath('..') + r'/reports/'
-LOG_ADDRESS = os.path.abspath('..') + r'/logs/'
+# 多台机器部署执行进程时，REPORT_ADDRESS、FILE_ADDRESS通过环境变量指向共享存储
+REPORT_ADDRESS = os.environ.get('REPORT_ADDRESS') or os.path.abspath('..') + r'/reports/'
+LOG_ADDRESS = os.environ.get('LOG_ADDRESS') or os.path.abspath('..') + r'/logs/'
 TEMP_REPORT = os.path.abspath('.') + r'/app/util/report'
 FUNC_ADDRESS = os.path.abspath('.') + r'/func_list'
-FILE_ADDRESS = os.path.abspath('..') + r'/files/'
+FILE_ADDRESS = os.environ.get('FILE_ADDRESS') or os.path.abspath('..') + r'/files/'
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))  # 每个基础url保持的最大连接数
+HTTP_POOL_KEEP_ALIVE = int(os.environ.get('HTTP_POOL_KEEP_ALIVE', 60))  # 连接池空闲多少秒后重建，0为不过期
+PLAN_CACHE_SIZE = int(os.environ.get('PLAN_CACHE_SIZE', 500))  # 缓存编译好的用例执行计划的最大数量
+VARIABLE_CACHE_SIZE = int(os.environ.get('VARIABLE_CACHE_SIZE', 200))  # 缓存解析好的变量列表的最大数量
+STEP_CACHE_SIZE = int(os.environ.get('STEP_CACHE_SIZE', 5000))  # 缓存预解析的步骤的最大数量
+ENV_CACHE_TTL = int(os.environ.get('ENV_CACHE_TTL', 30))  # 项目环境基础url缓存的有效秒数
+BLOB_ADDRESS = REPORT_ADDRESS + r'blobs/'  # 报告中超长响应内容的存储目录
+CONTROL_ADDRESS = REPORT_ADDRESS + r'control/'  # 执行的取消标记和失败用例数
+CASSETTE_ADDRESS = REPORT_ADDRESS + r'cassettes/'  # 录制的请求和响应，回放时代替真实接口
+REPORT_BODY_LIMIT = int(os.environ.get('REPORT_BODY_LIMIT', 65536))  # 项目未设置时，报告中响应内容保留的最大长度
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))  # 执行队列没有任务时，多少秒后再查一次数据库
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))  # 执行中的任务多少秒更新一次心跳
+JOB_STALE_TIMEOUT = float(os.environ.get('JOB_STALE_TIMEOUT', 60))  # 心跳超过多少秒没更新的任务重新入队
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))  # 任务最多执行次数，超过后不再重新入队
+REQUEST_CONNECT_TIMEOUT = float(os.environ.get('REQUEST_CONNECT_TIMEOUT', 10))  # 接口未设置时，建立连接的超时秒数
+REQUEST_READ_TIMEOUT = float(os.environ.get('REQUEST_READ_TIMEOUT', 120))  # 接口未设置时，等待响应的超时秒数
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', 20))  # 性能分析返回的最耗时函数个数
+LOAD_MAX_USERS = int(os.environ.get('LOAD_MAX_USERS', 200))  # 压测最多的虚拟用户数(线程数)
+LOAD_MAX_DURATION = float(os.environ.get('LOAD_MAX_DURATION', 3600))  # 压测最长的持续秒数
+LOAD_MAX_ITERATIONS = int(os.environ.get('LOAD_MAX_ITERATIONS', 10000))  # 压测每个用户最多的执行次数
+RUN_JOBS_IN_WEB = os.environ.get('RUN_JOBS_IN_WEB', '1') == '1'  # 为0时web进程不执行队列任务，只由worker执行
 
 
 def _check_file_path():
@@ -705,6 +727,12 @@ def _check_file_path():
         os.makedirs(FILE_ADDRESS)
     if not os.path.exists(LOG_ADDRESS):
         os.makedirs(LOG_ADDRESS)
+    if not os.path.exists(BLOB_ADDRESS):
+        os.makedirs(BLOB_ADDRESS)
+    if not os.path.exists(CONTROL_ADDRESS):
+        os.makedirs(CONTROL_ADDRESS)
+    if not os.path.exists(CASSETTE_ADDRESS):
+        os.makedirs(CASSETTE_ADDRESS)
 
 
 _check_file_path()
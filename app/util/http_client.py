@@ -0,0 +1,304 @@
+# encoding: utf-8
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from httprunner.client import HttpSession
+from httprunner.exceptions import MyBaseError, ParamsError
+from requests.adapters import BaseAdapter
+from requests import exceptions as requests_exceptions
+from requests.exceptions import RequestException, Timeout
+from .global_variable import HTTP_POOL_SIZE, HTTP_POOL_KEEP_ALIVE
+from .http_timing import TimedHTTPAdapter, start_timing, stop_timing
+from .cassette import CassetteMiss, RecordingAdapter, ReplayAdapter
+
+
+class HostPool(object):
+    """
+    单个基础url(scheme://host:port)的keep-alive连接池，空闲超过keep_alive秒后重建。
+    步骤并发、参数组合并发和压测的多个线程共用同一个连接池，检查和重建加锁，只会建一个新的连接池
+    """
+
+    def __init__(self, base_url, pool_size=HTTP_POOL_SIZE, keep_alive=HTTP_POOL_KEEP_ALIVE):
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.last_used = time.time()
+        # 重建前的连接池统计累加在这里
+        self.closed_requests = 0
+        self.closed_connections = 0
+        self._lock = threading.Lock()
+
+    def get_adapter(self):
+        with self._lock:
+            now = time.time()
+            if self.keep_alive and now - self.last_used > self.keep_alive:
+                requests_num, connections_num = self._pool_counts()
+                self.closed_requests += requests_num
+                self.closed_connections += connections_num
+                self.adapter.close()
+                self.adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            self.last_used = now
+            return self.adapter
+
+    def _pool_counts(self):
+        requests_num, connections_num = 0, 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            if pool is not None:
+                requests_num += pool.num_requests
+                connections_num += pool.num_connections
+        return requests_num, connections_num
+
+    def stats(self):
+        with self._lock:
+            requests_num, connections_num = self._pool_counts()
+            return {'requests': self.closed_requests + requests_num,
+                    'connections': self.closed_connections + connections_num}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def pool_key(url):
+    """ 连接池按基础url区分，如 https://host:443/api/login => https://host:443 """
+    parsed = urlparse(url)
+    return '{}://{}'.format(parsed.scheme, parsed.netloc)
+
+
+def get_host_pool(url):
+    """ 获取url所属基础url的连接池，同一进程内的所有执行共用 """
+    global _pools_pid
+    key = pool_key(url)
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # fork出来的子进程不能复用父进程的socket，丢弃继承下来的连接池
+            _pools.clear()
+            _pools_pid = os.getpid()
+        if key not in _pools:
+            _pools[key] = HostPool(key)
+        return _pools[key]
+
+
+def connection_stats():
+    """ 当前进程各基础url连接池的请求数和新建连接数 """
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    return {pool.base_url: pool.stats() for pool in pools}
+
+
+def diff_connection_stats(before, after):
+    """ 计算一次执行期间的连接复用情况，同一进程内有多个执行同时进行时为近似值 """
+    stats = {}
+    for base_url, _after in after.items():
+        _before = before.get(base_url, {'requests': 0, 'connections': 0})
+        requests_num = _after['requests'] - _before['requests']
+        if requests_num <= 0:
+            continue
+        stats[base_url] = {'requests': requests_num,
+                           'connections': _after['connections'] - _before['connections']}
+    return reuse_ratio(stats)
+
+
+def reuse_ratio(stats):
+    """ 补充连接复用率：1 - 新建连接数/请求数 """
+    for _stats in stats.values():
+        _stats['reuse_ratio'] = round(1 - float(_stats['connections']) / _stats['requests'], 4) \
+            if _stats['requests'] else 0
+    return stats
+
+
+class PooledAdapter(BaseAdapter):
+    """ 按请求的基础url把请求转给进程内共享的连接池 """
+
+    def send(self, request, **kwargs):
+        return get_host_pool(request.url).get_adapter().send(request, **kwargs)
+
+    def close(self):
+        # 连接池由整个进程共用，session关闭时不关闭连接池
+        pass
+
+
+class RequestListener(object):
+    """ 请求监听，name为步骤request中的group(接口id) """
+
+    def before_request(self, name):
+        pass
+
+    def after_request(self, name, meta_data, error=None):
+        """ 在请求的finally中调用，error为请求抛出的异常；实现中不能抛出异常，否则会覆盖请求本身的异常 """
+        pass
+
+
+class StepTimeout(MyBaseError):
+    """ 请求超时或超过用例/任务的执行时限，步骤按超时错误记录 """
+    pass
+
+
+def limit_timeout(timeout, remaining):
+    """ 请求的(连接超时, 读取超时)都不超过剩余时间 """
+    if timeout is None:
+        return remaining, remaining
+    if not isinstance(timeout, (list, tuple)):
+        timeout = (timeout, timeout)
+    return tuple(min(t, remaining) if t else remaining for t in timeout)
+
+
+# 重试设置中exceptions可以使用的异常名称
+RETRY_EXCEPTIONS = {'ConnectionError': requests_exceptions.ConnectionError,
+                    'Timeout': requests_exceptions.Timeout,
+                    'ConnectTimeout': requests_exceptions.ConnectTimeout,
+                    'ReadTimeout': requests_exceptions.ReadTimeout,
+                    'ChunkedEncodingError': requests_exceptions.ChunkedEncodingError}
+
+
+class RetryPolicy(object):
+    """
+    步骤的失败重试设置，如 {"times": 3, "backoff": 0.5, "max_backoff": 10, "jitter": 0.5,
+    "status_codes": [502, 503, 504], "exceptions": ["ConnectionError", "Timeout"]}。
+    times为总共最多请求几次；第n次重试前等待 min(backoff * 2^(n-1), max_backoff) 秒，再随机加上最多jitter倍的等待时间。
+    响应状态码在status_codes中，或请求抛出exceptions中的异常时重试。
+    """
+
+    def __init__(self, times=1, backoff=0.5, max_backoff=10, jitter=0.5, status_codes=(502, 503, 504),
+                 exceptions=('ConnectionError', 'Timeout')):
+        self.times = int(times)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.jitter = float(jitter)
+        self.status_codes = [int(code) for code in status_codes]
+        unknown = [name for name in exceptions if name not in RETRY_EXCEPTIONS]
+        if unknown:
+            raise ValueError('不支持的重试异常：{}，可选：{}'.format(','.join(unknown), ','.join(RETRY_EXCEPTIONS)))
+        self.exceptions = tuple(RETRY_EXCEPTIONS[name] for name in exceptions)
+
+    @classmethod
+    def from_config(cls, config):
+        """ 解析json字符串或dict格式的重试设置，为空时返回None；设置有误时抛出ValueError """
+        if not config:
+            return None
+        if isinstance(config, str):
+            config = json.loads(config)
+        try:
+            return cls(**config)
+        except (TypeError, ValueError) as e:
+            raise ValueError('重试设置有误：{}'.format(e))
+
+    def to_dict(self):
+        return {'times': self.times, 'backoff': self.backoff, 'max_backoff': self.max_backoff, 'jitter': self.jitter,
+                'status_codes': list(self.status_codes),
+                'exceptions': [name for name, e in RETRY_EXCEPTIONS.items() if e in self.exceptions]}
+
+    def retryable(self, status_code, error):
+        if isinstance(error, CassetteMiss):
+            return False
+        if error is not None:
+            return isinstance(error, self.exceptions)
+        return status_code in self.status_codes
+
+    def wait_time(self, attempt, status_code, error, deadline=None):
+        """ 第attempt次请求后需要重试时返回等待秒数，不需要重试或等待后会超过执行时限时返回None """
+        if attempt >= self.times or not self.retryable(status_code, error):
+            return None
+        wait = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        wait += random.uniform(0, wait * self.jitter)
+        if deadline and time.time() + wait >= deadline:
+            return None
+        return wait
+
+
+class RunSession(HttpSession):
+    """
+    执行用例使用的session，请求走共享的keep-alive连接池，cookies仍然按用例隔离。
+    deadline为执行时限的时间戳，请求的超时时间不超过剩余时间，已超时的步骤不再发请求。
+    """
+
+    def __init__(self, base_url=None, *args, **kwargs):
+        super(RunSession, self).__init__(base_url, *args, **kwargs)
+        adapter = PooledAdapter()
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.request_listener = None
+        self.deadline = None
+        self.cassette = None
+
+    def use_cassette(self, cassette):
+        """ 录制模式下请求照常发出并保存响应，回放模式下不发请求，直接返回录制的响应 """
+        self.cassette = cassette
+        adapter = RecordingAdapter(PooledAdapter(), cassette) if cassette.mode == 'record' else ReplayAdapter(cassette)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, name=None, **kwargs):
+        """ 步骤request中带有retry设置时，失败后按设置重试，每次请求的状态和耗时记录在response的attempts中 """
+        policy = RetryPolicy.from_config(kwargs.pop('retry', None))
+        timeout = kwargs.get('timeout')
+        if isinstance(timeout, list):
+            # 步骤数据解析后元组变成了列表，requests只接受元组
+            kwargs['timeout'] = tuple(timeout)
+
+        attempts = []
+        while True:
+            if attempts:
+                self.init_meta_data()
+            response, error = None, None
+            try:
+                response = self._request_once(method, url, name, dict(kwargs))
+            except (RequestException, StepTimeout) as e:
+                error = e
+            attempts.append({'attempt': len(attempts) + 1,
+                             'status_code': response.status_code if response is not None else None,
+                             'response_time_ms': self.meta_data['response']['response_time_ms'],
+                             'timings': self.meta_data['response'].get('timings'),
+                             'error': repr(error) if error is not None else None})
+            wait = policy.wait_time(len(attempts), attempts[-1]['status_code'], error, self.deadline) \
+                if policy and not isinstance(error, StepTimeout) else None
+            if wait is None:
+                break
+            attempts[-1]['wait_ms'] = round(wait * 1000, 2)
+            time.sleep(wait)
+
+        if policy:
+            self.meta_data['response']['attempts'] = attempts
+        if isinstance(error, Timeout):
+            self.meta_data['response']['timeout'] = True
+            raise StepTimeout('请求超时: {}'.format(error))
+        if error is not None:
+            raise error
+        return response
+
+    def _request_once(self, method, url, name, kwargs):
+        if self.deadline:
+            remaining = self.deadline - time.time()
+            if remaining <= 0:
+                raise StepTimeout('超过执行时限，步骤未执行')
+            kwargs['timeout'] = limit_timeout(kwargs.get('timeout'), remaining)
+
+        if self.request_listener:
+            self.request_listener.before_request(name)
+        start_timing()
+        error = None
+        try:
+            return super(RunSession, self).request(method, url, name=name, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # 请求各阶段的耗时，按基础url和接口id汇总
+            timings = stop_timing()
+            try:
+                host = pool_key(self._build_url(url))
+            except ParamsError:
+                # 没有基础url时请求本身已经抛出同样的异常，这里不能再抛出覆盖它
+                host = pool_key(url)
+            timings.update({'host': host, 'api_msg_id': name})
+            self.meta_data['response']['timings'] = timings
+            if self.request_listener:
+                self.request_listener.after_request(name, self.meta_data, error)
@@ -1,14 +1,30 @@
 import copy
 import json
+import functools
+import os
+import time
 
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from app.models import *
 from httprunner import HttpRunner
+from httprunner.exceptions import MyBaseError
 from ..util.global_variable import *
 from ..util.utils import merge_config, encode_object
-from httprunner import (loader, parser, utils)
-import importlib
+from ..util.step_scheduler import StepScheduler
+from ..util.http_client import RunSession, connection_stats, diff_connection_stats, reuse_ratio
+from ..util.plan_cache import plan_cache, plan_version
+from ..util.env_resolver import env_resolver
+from ..util.compiled_step import compile_step
+from ..util.func_registry import func_registry
+from ..util.http_timing import merge_timing, timing_summary
+from ..util.cassette import Cassette
+from ..util.parameters import iter_parameters
+from ..util.report_store import ReportWriter, BufferedWriter, RunResult, StreamResult, report_path, format_stat, \
+    merge_rerun_report, merge_changed_report, STAT_KEYS
+from httprunner import (loader, parser, utils, report, logger)
 
 
 class MyHttpRunner(HttpRunner):
@@ -16,105 +32,313 @@ class MyHttpRunner(HttpRunner):
     修改HttpRunner，用例初始化时导入函数
     """
 
-    def __init__(self):
-        super(MyHttpRunner, self).__init__()
+    def __init__(self, report_writer=None, request_listener=None, run_control=None):
+        if run_control and run_control.failfast:
+            super(MyHttpRunner, self).__init__(failfast=True)
+        else:
+            super(MyHttpRunner, self).__init__()
+        self.report_writer = report_writer
+        self.request_listener = request_listener
+        self.run_control = run_control
+        self.stop_reason = None
 
     def parse_tests(self, testcases, variables_mapping=None):
-        """ parse testcases configs, including variables/parameters/name/request.
-
-        Args:
-            testcases (list): testcase list, with config unparsed.
-            variables_mapping (dict): if variables_mapping is specified, it will override variables in config block.
-
-        Returns:
-            list: parsed testcases list, with config variables/parameters/name/request parsed.
-
+        """
+        逐个产生解析好的用例：参数化的用例每次只生成一个参数组合，执行完一个再生成下一个，不预先生成全部组合。
+        每个组合深拷贝config和teststeps：HttpRunner执行步骤时会修改步骤中的request、setup_hooks等数据，
+        参数组合并发执行时不能共用
         """
         self.exception_stage = "parse tests"
         variables_mapping = variables_mapping or {}
 
-        parsed_testcases_list = []
         for testcase in testcases:
-            # parse config parameters
             config_parameters = testcase.setdefault("config", {}).pop("parameters", [])
-
-            cartesian_product_parameters_list = parser.parse_parameters(
-                config_parameters,
-                self.project_mapping["debugtalk"]["variables"],
-                self.project_mapping["debugtalk"]["functions"]
-            ) or [{}]
-
-            for parameter_mapping in cartesian_product_parameters_list:
-                testcase_dict = testcase
-                config = testcase_dict.setdefault("config", {})
-
-                testcase_dict["config"]["functions"] = {}
-
-                # imported_module = importlib.reload(importlib.import_module('func_list.build_in'))
-                # testcase_dict["config"]["functions"].update(loader.load_python_module(imported_module)["functions"])
-
-                if config.get('import_module_functions'):
-                    for f in config.get('import_module_functions'):
-                        imported_module = importlib.reload(importlib.import_module(f))
-                        debugtalk_module = loader.load_python_module(imported_module)
-                        testcase_dict["config"]["functions"].update(debugtalk_module["functions"])
-                testcase_dict["config"]["functions"].update(self.project_mapping["debugtalk"]["functions"])
-                # self.project_mapping["debugtalk"]["functions"].update(debugtalk_module["functions"])
-                raw_config_variables = config.get("variables", [])
-                parsed_config_variables = parser.parse_data(
-                    raw_config_variables,
-                    self.project_mapping["debugtalk"]["variables"],
-                    testcase_dict["config"]["functions"])
-
-                # priority: passed in > debugtalk.py > parameters > variables
-                # override variables mapping with parameters mapping
-                config_variables = utils.override_mapping_list(
-                    parsed_config_variables, parameter_mapping)
-                # merge debugtalk.py module variables
-                config_variables.update(self.project_mapping["debugtalk"]["variables"])
-                # override variables mapping with passed in variables_mapping
-                config_variables = utils.override_mapping_list(
-                    config_variables, variables_mapping)
-
-                testcase_dict["config"]["variables"] = config_variables
-
-                # parse config name
-                testcase_dict["config"]["name"] = parser.parse_data(
-                    testcase_dict["config"].get("name", ""),
-                    config_variables,
-                    self.project_mapping["debugtalk"]["functions"]
-                )
-
-                # parse config request
-                testcase_dict["config"]["request"] = parser.parse_data(
-                    testcase_dict["config"].get("request", {}),
-                    config_variables,
-                    self.project_mapping["debugtalk"]["functions"]
-                )
-                # put loaded project functions to config
-                # testcase_dict["config"]["functions"] = self.project_mapping["debugtalk"]["functions"]
-                parsed_testcases_list.append(testcase_dict)
-        return parsed_testcases_list
-
-
-def main_ate(cases):
-    runner = MyHttpRunner().run(cases)
+            if not config_parameters:
+                yield self.parse_testcase(testcase, {}, variables_mapping)
+                continue
+
+            for parameter_mapping in iter_parameters(config_parameters,
+                                                     self.project_mapping["debugtalk"]["variables"],
+                                                     self.project_mapping["debugtalk"]["functions"]):
+                testcase_dict = dict(testcase, config=copy.deepcopy(testcase["config"]),
+                                     teststeps=copy.deepcopy(testcase.get("teststeps", [])))
+                yield self.parse_testcase(testcase_dict, parameter_mapping, variables_mapping)
+
+    def parse_testcase(self, testcase_dict, parameter_mapping, variables_mapping):
+        """ 解析一个参数组合的config：导入函数、变量、名称和公共请求数据 """
+        config = testcase_dict.setdefault("config", {})
+
+        testcase_dict["config"]["functions"] = {}
+
+        # imported_module = importlib.reload(importlib.import_module('func_list.build_in'))
+        # testcase_dict["config"]["functions"].update(loader.load_python_module(imported_module)["functions"])
+
+        if config.get('import_module_functions'):
+            # 函数文件没有修改时直接使用已加载的函数
+            testcase_dict["config"]["functions"].update(
+                func_registry.load_functions(config.get('import_module_functions')))
+        testcase_dict["config"]["functions"].update(self.project_mapping["debugtalk"]["functions"])
+        # self.project_mapping["debugtalk"]["functions"].update(debugtalk_module["functions"])
+        raw_config_variables = config.get("variables", [])
+        parsed_config_variables = parser.parse_data(
+            raw_config_variables,
+            self.project_mapping["debugtalk"]["variables"],
+            testcase_dict["config"]["functions"])
+
+        # priority: passed in > debugtalk.py > parameters > variables
+        # override variables mapping with parameters mapping
+        config_variables = utils.override_mapping_list(
+            parsed_config_variables, parameter_mapping)
+        # merge debugtalk.py module variables
+        config_variables.update(self.project_mapping["debugtalk"]["variables"])
+        # override variables mapping with passed in variables_mapping
+        config_variables = utils.override_mapping_list(
+            config_variables, variables_mapping)
+
+        testcase_dict["config"]["variables"] = config_variables
+
+        # parse config name
+        testcase_dict["config"]["name"] = parser.parse_data(
+            testcase_dict["config"].get("name", ""),
+            config_variables,
+            self.project_mapping["debugtalk"]["functions"]
+        )
+
+        # parse config request
+        testcase_dict["config"]["request"] = parser.parse_data(
+            testcase_dict["config"].get("request", {}),
+            config_variables,
+            self.project_mapping["debugtalk"]["functions"]
+        )
+        # put loaded project functions to config
+        # testcase_dict["config"]["functions"] = self.project_mapping["debugtalk"]["functions"]
+        return testcase_dict
+
+    def initialize(self, testcases, report_writer=None):
+        """ 每个用例的请求改用共享连接池的RunSession，用例配置了cassette时录制或回放请求 """
+        report_writer = report_writer or self.report_writer
+        unittest_runner, test_suite = super(MyHttpRunner, self).initialize(testcases)
+        for testcase in test_suite:
+            testcase.runner.http_client_session = RunSession(testcase.runner.http_client_session.base_url)
+            testcase.runner.http_client_session.request_listener = self.request_listener
+            if testcase.config.get('cassette'):
+                testcase.runner.http_client_session.use_cassette(Cassette(**testcase.config['cassette']))
+        if report_writer:
+            # 步骤结果直接写入报告文件
+            unittest_runner.resultclass = functools.partial(StreamResult, report_writer)
+        else:
+            unittest_runner.resultclass = RunResult
+        if self.run_control:
+            # 每个步骤结束后检查取消标记
+            make_result = unittest_runner._makeResult
+            unittest_runner._makeResult = lambda: self.run_control.watch(make_result())
+        return unittest_runner, test_suite
+
+    def run(self, path_or_testcases, mapping=None):
+        """
+        用例逐个解析、执行、汇总，执行完的参数组合只保留汇总结果。
+        用例配置了parameter_concurrency时，参数组合按线程并发执行，结果仍按组合顺序汇总
+        """
+        testcases = self.load_tests(path_or_testcases)
+        # 计数先置0，被取消或失败用例数已达上限时一个用例都没有执行，统计也是完整的
+        self.summary = {"success": True, "stat": dict.fromkeys(STAT_KEYS, 0), "time": {},
+                        "platform": report.get_platform(), "details": [], "timing": {}}
+        for testcase in testcases:
+            config = testcase.get('config', {})
+            parameter_concurrency = config.get('parameter_concurrency', 1) if config.get('parameters') else 1
+            parsed_testcases = self.parse_tests([testcase], mapping)
+            if parameter_concurrency > 1:
+                results = self.run_parallel(parsed_testcases, parameter_concurrency)
+            else:
+                results = (self.run_testcase(parsed_testcase) for parsed_testcase in parsed_testcases)
+            for tests_result in results:
+                if tests_result is None:
+                    break
+                self.add_result(*tests_result)
+            if self.stop_reason:
+                break
+
+        if self.run_control and not self.stop_reason:
+            if self.run_control.cancelled():
+                self.stop_reason = 'cancelled'
+            elif self.run_control.deadline_exceeded():
+                self.stop_reason = 'time_budget'
+        return self
+
+    def run_testcase(self, parsed_testcase, report_writer=None):
+        """ 执行一个解析好的用例，需要停止时返回None；配置了step_concurrency的用例，步骤按依赖关系并发执行后再交给unittest记录结果 """
+        self.exception_stage = "running tests"
+        if self.run_control:
+            # 被取消或失败用例数达到上限后，后面的用例不再执行
+            self.stop_reason = self.stop_reason or self.run_control.stop_reason()
+            if self.stop_reason:
+                logger.log_info("Run stopped: {}".format(self.stop_reason))
+                return None
+        unittest_runner, test_suite = self.initialize([parsed_testcase], report_writer)
+        testcase = test_suite._tests[0]
+        logger.log_info("Start to run testcase: {}".format(testcase.config.get("name")))
+        testcase.runner.http_client_session.deadline = self.case_deadline(testcase)
+
+        step_concurrency = testcase.config.get('step_concurrency', 1)
+        if step_concurrency > 1:
+            scheduler = StepScheduler(testcase, step_concurrency, self.run_control)
+            testcase = scheduler.run()
+            result = unittest_runner.run(testcase)
+            result.start_at = scheduler.start_at
+        else:
+            result = unittest_runner.run(testcase)
+        if self.run_control and not result.wasSuccessful():
+            self.run_control.case_failed()
+        return testcase, result
+
+    def run_parallel(self, parsed_testcases, concurrency):
+        """ 参数组合按线程并发执行，同时最多提交concurrency的两倍个组合，按提交顺序返回结果 """
+        def _run(parsed_testcase):
+            report_writer = BufferedWriter(self.report_writer) if self.report_writer else None
+            return self.run_testcase(parsed_testcase, report_writer), report_writer
+
+        def _result(future):
+            tests_result, report_writer = future.result()
+            if report_writer:
+                report_writer.commit()
+            return tests_result
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = deque()
+            for parsed_testcase in parsed_testcases:
+                pending.append(executor.submit(_run, parsed_testcase))
+                if len(pending) >= concurrency * 2:
+                    yield _result(pending.popleft())
+            while pending:
+                yield _result(pending.popleft())
+
+    def add_result(self, testcase, result):
+        """ 汇总一个用例的执行结果，超时的步骤数和请求各阶段耗时一起汇总；生成报告时同时写入报告文件 """
+        self.exception_stage = "aggregate results"
+        testcase_summary = report.get_summary(result)
+        testcase_summary['stat']['timeouts'] = getattr(result, 'timeouts', 0)
+        self.summary["success"] &= testcase_summary["success"]
+        testcase_summary["name"] = testcase.config.get("name")
+        testcase_summary["base_url"] = testcase.config.get("request", {}).get("base_url", "")
+        testcase_summary["case_id"] = testcase.config.get("case_id")
+
+        in_out = utils.get_testcase_io(testcase)
+        utils.print_io(in_out)
+        testcase_summary["in_out"] = in_out
+
+        report.aggregate_stat(self.summary["stat"], testcase_summary["stat"])
+        report.aggregate_stat(self.summary["time"], testcase_summary["time"])
+        merge_timing(self.summary['timing'], getattr(result, 'timing', {}))
+        self.summary["details"].append(testcase_summary)
+        if self.report_writer:
+            self.report_writer.write_case(testcase_summary)
+
+    def case_deadline(self, testcase):
+        """
+        用例的执行时限：用例设置的deadline和整个执行的时间预算取较早的一个。
+        超过时限后步骤不再发请求，直接记为超时错误，所以超出预算后剩下的用例也会在报告中显示为超时
+        """
+        deadlines = []
+        if testcase.config.get('deadline'):
+            deadlines.append(time.time() + testcase.config['deadline'])
+        if self.run_control and self.run_control.deadline:
+            deadlines.append(self.run_control.deadline)
+        return min(deadlines) if deadlines else None
+
+
+def open_upload_files(cases):
+    """ 上传文件在执行前才打开，这样用例数据可以序列化后交给子进程执行 """
+    for case in (cases if isinstance(cases, list) else [cases]):
+        for step in case['teststeps']:
+            for key in step.pop('upload_files', []):
+                file_name, file_path, content_type = step['request']['files'][key]
+                step['request']['files'][key] = (file_name, open(file_path, 'rb'), content_type)
+
+
+def main_ate(cases, report_writer=None, run_control=None):
+    open_upload_files(cases)
+    before_stats = connection_stats()
+    runner = MyHttpRunner(report_writer, run_control=run_control).run(cases)
     summary = runner.summary
+    summary['connection'] = diff_connection_stats(before_stats, connection_stats())
+    summary.setdefault('timing', {})
+    if not summary['time']:
+        # 没有执行任何用例
+        summary['time'] = {'start_at': time.time(), 'duration': 0}
+    summary['aborted'] = runner.stop_reason
+    return summary
+
+
+def _main_ate_worker(case, part_path=None, body_limit=None, run_control=None):
+    """ 子进程执行单个用例，summary中含有文件句柄等对象，先按报告的序列化规则转成可传回主进程的数据
+        传入part_path时步骤结果写入该报告片段，由主进程按顺序拼接
+    """
+    report_writer = ReportWriter(part_path, body_limit) if part_path else None
+    try:
+        summary = main_ate([case], report_writer, run_control)
+    finally:
+        if report_writer:
+            report_writer.close()
+    return json.loads(json.dumps(summary, ensure_ascii=False, default=encode_object))
+
+
+def merge_summary(summaries, duration):
+    """ 把多个用例的summary按顺序合并成一个，格式和HttpRunner一次执行多个用例的summary一致 """
+    summary = {'success': True, 'stat': {}, 'time': {}, 'platform': summaries[0]['platform'], 'details': [],
+               'connection': {}, 'aborted': None, 'timing': {}}
+    for _summary in summaries:
+        summary['success'] &= _summary['success']
+        summary['aborted'] = summary['aborted'] or _summary['aborted']
+        report.aggregate_stat(summary['stat'], _summary['stat'])
+        report.aggregate_stat(summary['time'], _summary['time'])
+        summary['details'] += _summary['details']
+        merge_timing(summary['timing'], _summary.get('timing'))
+        for base_url, stats in _summary['connection'].items():
+            _stats = summary['connection'].setdefault(base_url, {'requests': 0, 'connections': 0})
+            _stats['requests'] += stats['requests']
+            _stats['connections'] += stats['connections']
+    reuse_ratio(summary['connection'])
+    # 并发执行时，总耗时取实际经过的时间而不是各用例耗时之和
+    summary['time']['duration'] = duration
     return summary
 
 
+def main_ate_parallel(cases, concurrency, report_writer=None, run_control=None):
+    """ 用例之间相互独立，按进程池并发执行，结果保持原用例顺序 """
+    start_time = time.time()
+    part_paths = ['{}.part{}'.format(report_writer.path, i) if report_writer else None for i in range(len(cases))]
+    body_limits = [report_writer.body_limit if report_writer else None] * len(cases)
+    with ProcessPoolExecutor(max_workers=min(concurrency, len(cases))) as executor:
+        summaries = list(executor.map(_main_ate_worker, cases, part_paths, body_limits,
+                                      [run_control] * len(cases)))
+    if report_writer:
+        for part_path in part_paths:
+            report_writer.append_file(part_path)
+    return merge_summary(summaries, time.time() - start_time)
+
+
 class RunCase(object):
-    def __init__(self, project_names=None, case_ids=None, api_data=None, config_id=None):
+    def __init__(self, project_names=None, case_ids=None, api_data=None, config_id=None, concurrency=1,
+                 step_concurrency=1, parameter_concurrency=1):
         self.project_names = project_names
         self.case_ids = case_ids
         self.config_id = config_id
         self.api_data = api_data
+        self.concurrency = concurrency or 1  # 业务用例并发执行的进程数，1为顺序执行
+        self.step_concurrency = step_concurrency or 1  # 用例内无依赖步骤并发执行的线程数，1为顺序执行
+        self.parameter_concurrency = parameter_concurrency or 1  # 参数化用例的参数组合并发执行的线程数
         self.project_data = Project.query.filter_by(name=self.project_names).first()
         self.project_id = self.project_data.id
         self.run_type = False  # 判断是接口调试(false)or业务用例执行(true)
         self.make_report = True
         self.new_report_id = None
         self.temp_extract = list()
+        self._loaded_cases = None
+        self.run_control = None  # 失败即停、取消等执行控制
+        self.cassette = None  # 录制/回放设置 {'name': 名称, 'mode': 'record'|'replay'}
+        self.parent_report_id = None  # 重跑失败用例时原报告的id，执行完把结果合并到新报告
+        self.skipped_cases = []  # 按修改选择用例时跳过的用例
+        self.base_report_id = None  # 按修改选择用例时的参考报告id，执行完把跳过的用例的结果合并到新报告
 
     def project_case(self):
         if self.project_names and not self.case_ids and not self.api_data:
@@ -159,158 +383,91 @@ class RunCase(object):
         pro_cfg_data['config']['variables'] = json.loads(project_data.variables)
         return pro_cfg_data
 
-    def get_test_case(self, case_data, pro_base_url):
+    def get_test_case(self, case_data, pro_base_url, api_case=None):
         if self.run_type:
             # 为true，获取api基础信息；case只包含可改变部分所以还需要api基础信息组合成全新的用例
-            api_case = ApiMsg.query.filter_by(id=case_data.api_msg_id).first()
+            api_case = api_case or ApiMsg.query.filter_by(id=case_data.api_msg_id).first()
         else:
             # 为false，基础信息和参数信息都在api里面，所以api_case = case_data，直接赋值覆盖
             api_case = case_data
 
-        temp_case_data = {'name': case_data.name,
-                          'request': {'method': api_case.method,
-                                      'files': {},
-                                      'data': {}}}
-        if json.loads(api_case.header):
-            temp_case_data['request']['headers'] = {h['key']: h['value'] for h in json.loads(api_case.header)
-                                                    if h['key']}
-
-        if api_case.status_url != '-1':
-            temp_case_data['request']['url'] = pro_base_url['{}'.format(api_case.project_id)][
-                                                   int(api_case.status_url)] + api_case.url.split('?')[0]
-        else:
-            temp_case_data['request']['url'] = api_case.url
-
-        # if 'https' in temp_case_data['request']['url']:
-        #     temp_case_data['request']['verify'] = False
-        # if api_case.func_address:
-        #     print(api_case.func_address)
-        #     temp_case_data['import_module_functions'] = [
-        #         'func_list.{}'.format(f.replace('.py', '')) for f in json.loads(api_case.func_address)]
-        # if self.run_type:
-        if not self.run_type:
-            if api_case.up_func:
-                temp_case_data['setup_hooks'] = [api_case.up_func]
-            if api_case.down_func:
-                temp_case_data['teardown_hooks'] = [api_case.down_func]
-        else:
-            if case_data.up_func:
-                temp_case_data['setup_hooks'] = [case_data.up_func]
-            if case_data.down_func:
-                temp_case_data['teardown_hooks'] = [case_data.down_func]
-
-        if not self.run_type or json.loads(case_data.status_param)[0]:
-            if not self.run_type or json.loads(case_data.status_param)[1]:
-                _param = json.loads(case_data.param)
-            else:
-                _param = json.loads(api_case.param)
-            temp_case_data['request']['params'] = {param['key']: param['value'] for param in
-                                                   _param if param.get('key')}
-
-        if not self.run_type or json.loads(case_data.status_variables)[0]:
-            if not self.run_type or json.loads(case_data.status_variables)[1]:
-                _json_variables = case_data.json_variable
-                _variables = json.loads(case_data.variable)
-
-            else:
-                _json_variables = api_case.json_variable
-                _variables = json.loads(case_data.variable)
-
-            if api_case.method == 'GET':
-                pass
-
-            elif api_case.variable_type == 'text':
-                for variable in _variables:
-                    if variable['param_type'] == 'string' and variable.get('key'):
-                        temp_case_data['request']['files'].update({variable['key']: (None, variable['value'])})
-                    elif variable['param_type'] == 'file' and variable.get('key'):
-                        temp_case_data['request']['files'].update({variable['key']: (
-                            variable['value'].split('/')[-1], open(variable['value'], 'rb'),
-                            CONTENT_TYPE['.{}'.format(variable['value'].split('.')[-1])])})
-
-            elif api_case.variable_type == 'data':
-                for variable in _variables:
-                    if variable['param_type'] == 'string' and variable.get('key'):
-                        temp_case_data['request']['data'].update({variable['key']: variable['value']})
-                    elif variable['param_type'] == 'file' and variable.get('key'):
-                        temp_case_data['request']['files'].update({variable['key']: (
-                            variable['value'].split('/')[-1], open(variable['value'], 'rb'),
-                            CONTENT_TYPE['.{}'.format(variable['value'].split('.')[-1])])})
-                        # temp_case_data['request']['files'].update({variable['key']: (
-                        #     variable['value'].split('/')[-1], "open({}, 'rb')".format(variable['value']),
-                        #     CONTENT_TYPE['.{}'.format(variable['value'].split('.')[-1])])})
-
-                        # temp_case_data['request']['files'].update({variable['key']: (
-                        #     variable['value'].split('/')[-1], '${' + 'open_file({})'.format(variable['value']) + '}',
-                        #     CONTENT_TYPE['.{}'.format(variable['value'].split('.')[-1])])})
-
-            elif api_case.variable_type == 'json':
-                if _json_variables:
-                    temp_case_data['request']['json'] = json.loads(_json_variables)
-                # temp_case_data['request']['json'] = _variables
-
-        if not self.run_type or json.loads(case_data.status_extract)[0]:
-            if not self.run_type or json.loads(case_data.status_extract)[1]:
-                _extract_temp = case_data.extract
-            else:
-                _extract_temp = api_case.extract
-
-            temp_case_data['extract'] = [{ext['key']: ext['value']} for ext in json.loads(_extract_temp) if
-                                         ext.get('key')]
-            self.temp_extract += [ext.get('key') for ext in json.loads(_extract_temp) if ext.get('key')]
-
-        if not self.run_type or json.loads(case_data.status_validate)[0]:
-            if not self.run_type or json.loads(case_data.status_validate)[1]:
-                _validate_temp = case_data.validate
-            else:
-                _validate_temp = api_case.validate
-            temp_case_data['validate'] = [{val['comparator']: [val['key'], val['value']]} for val in
-                                          json.loads(_validate_temp) if val.get('key')]
-
-            temp_case_data['output'] = ['token']
-
-        return temp_case_data
-
+        # json字段的解析和用例/接口数据的选择只在数据改动后做一次，之后复用预解析的步骤
+        compiled = compile_step(case_data, api_case, self.run_type)
+        self.temp_extract += compiled.extract_keys
+        return compiled.to_teststep(pro_base_url)
+
+    def load_cases(self):
+        """ 用IN查询一次性取出所有用例、步骤和引用的接口，避免按用例、按步骤逐条查询 """
+        if self._loaded_cases is None:
+            cases = {c.id: c for c in Case.query.filter(Case.id.in_(self.case_ids)).all()}
+            api_cases_map = {}
+            for api_case in CaseData.query.filter(CaseData.case_id.in_(self.case_ids)).order_by(
+                    CaseData.case_id.asc(), CaseData.num.asc()).all():
+                api_cases_map.setdefault(api_case.case_id, []).append(api_case)
+            api_msg_ids = list({api_case.api_msg_id for api_cases in api_cases_map.values() for api_case in api_cases})
+            api_msgs = {a.id: a for a in ApiMsg.query.filter(ApiMsg.id.in_(api_msg_ids)).all()} if api_msg_ids else {}
+            self._loaded_cases = (cases, api_cases_map, api_msgs)
+        return self._loaded_cases
+
+    def compile_case(self, case_data, api_cases, api_msgs, pro_config, pro_base_url):
+        """ 把一个业务用例编译成HttpRunner的用例数据 """
+        _temp_config = copy.deepcopy(pro_config)
+        _temp_config['config']['name'] = case_data.name
+        _temp_config['config']['case_id'] = case_data.id
+        if case_data.deadline:
+            _temp_config['config']['deadline'] = case_data.deadline
+        if case_data.parameters:
+            _temp_config['config']['parameters'] = json.loads(case_data.parameters)
+
+        # 获取需要导入的函数文件数据
+        _temp_config['config']['import_module_functions'] = ['func_list.{}'.format(
+            f.replace('.py', '')) for f in json.loads(case_data.func_address)]
+
+        # 获取业务集合的配置数据
+        scene_config = json.loads(case_data.variable) if case_data.variable else []
+
+        # 合并公用项目配置和业务集合配置
+        _temp_config = merge_config(_temp_config, scene_config)
+        for api_case in api_cases:
+            if api_case.status == 'true':  # 判断用例状态，是否执行
+                for t in range(api_case.time):  # 获取用例执行次数，遍历添加
+                    _temp_config['teststeps'].append(
+                        self.get_test_case(api_case, pro_base_url, api_msgs.get(api_case.api_msg_id)))
+        return _temp_config
 
     def all_cases_data(self):
         temp_case = []
         pro_config = self.pro_config(self.project_data)
 
-        # 获取项目中4个基础url
-        # pro_base_url = {'0': self.project_data.host, '1': self.project_data.host_two,
-        #                 '2': self.project_data.host_three, '3': self.project_data.host_four}
-        pro_base_url = {}
-        for pro_data in Project.query.all():
-            if pro_data.environment_choice == 'first':
-                pro_base_url['{}'.format(pro_data.id)] = json.loads(pro_data.host)
-            elif pro_data.environment_choice == 'second':
-                pro_base_url['{}'.format(pro_data.id)] = json.loads(pro_data.host_two)
-            if pro_data.environment_choice == 'third':
-                pro_base_url['{}'.format(pro_data.id)] = json.loads(pro_data.host_three)
-            if pro_data.environment_choice == 'fourth':
-                pro_base_url['{}'.format(pro_data.id)] = json.loads(pro_data.host_four)
+        # 获取各项目当前环境的基础url
+        pro_base_url = env_resolver.base_urls()
+        base_url_version = plan_version(pro_base_url)
         if self.case_ids:
-            for case_id in self.case_ids:
-                case_data = Case.query.filter_by(id=case_id).first()
+            cases, api_cases_map, api_msgs = self.load_cases()
+            for case_id in map(int, self.case_ids):
+                case_data = cases[case_id]
                 case_times = case_data.times if case_data.times else 1
+                api_cases = api_cases_map.get(case_id, [])
+                case_api_msgs = {api_case.api_msg_id: api_msgs[api_case.api_msg_id] for api_case in api_cases
+                                 if api_case.api_msg_id in api_msgs}
+
+                # 用例、步骤、引用的接口或项目有改动时版本号变化，否则直接使用缓存的执行计划
+                version = plan_version(self.project_data, base_url_version, case_data, api_cases,
+                                       [case_api_msgs[_id] for _id in sorted(case_api_msgs)])
+                _temp_config = plan_cache.get(case_id, version)
+                if _temp_config is None:
+                    _temp_config = self.compile_case(case_data, api_cases, case_api_msgs, pro_config, pro_base_url)
+                    plan_cache.put(case_id, version, _temp_config)
+
                 for s in range(case_times):
-                    _temp_config = copy.deepcopy(pro_config)
-                    _temp_config['config']['name'] = case_data.name
-
-                    # 获取需要导入的函数文件数据
-                    _temp_config['config']['import_module_functions'] = ['func_list.{}'.format(
-                        f.replace('.py', '')) for f in json.loads(case_data.func_address)]
-
-                    # 获取业务集合的配置数据
-                    scene_config = json.loads(case_data.variable) if case_data.variable else []
-
-                    # 合并公用项目配置和业务集合配置
-                    _temp_config = merge_config(_temp_config, scene_config)
-                    for api_case in CaseData.query.filter_by(case_id=case_id).order_by(CaseData.num.asc()).all():
-                        if api_case.status == 'true':  # 判断用例状态，是否执行
-                            for t in range(api_case.time):  # 获取用例执行次数，遍历添加
-                                _temp_config['teststeps'].append(self.get_test_case(api_case, pro_base_url))
-                    temp_case.append(_temp_config)
+                    _case_config = copy.deepcopy(_temp_config)
+                    if self.step_concurrency > 1:
+                        _case_config['config']['step_concurrency'] = self.step_concurrency
+                    if self.parameter_concurrency > 1:
+                        _case_config['config']['parameter_concurrency'] = self.parameter_concurrency
+                    if self.cassette:
+                        _case_config['config']['cassette'] = dict(self.cassette)
+                    temp_case.append(_case_config)
             return temp_case
 
         if self.api_data:
@@ -324,46 +481,91 @@ class RunCase(object):
             _temp_config = merge_config(_temp_config, _config)
             _temp_config['teststeps'] = [self.get_test_case(case, pro_base_url) for case in self.api_data]
             _temp_config['config']['output'] += copy.deepcopy(self.temp_extract)
+            if self.cassette:
+                _temp_config['config']['cassette'] = dict(self.cassette)
             return _temp_config
             # return temp_case
 
+    def discard_report(self, report_writer=None):
+        """ 执行出错时删除已经生成的报告记录和没写完的报告文件 """
+        if report_writer:
+            report_writer.close()
+        if not self.new_report_id:
+            return
+        if os.path.exists(report_path(self.new_report_id)):
+            os.remove(report_path(self.new_report_id))
+        db.session.rollback()
+        Report.query.filter_by(id=self.new_report_id).delete()
+        db.session.commit()
+        self.new_report_id = None
+
     def run_case(self):
         now_time = datetime.datetime.now()
         # current_app.logger.info('begin to run cases')
         if self.run_type and self.make_report:
             new_report = Report(
-                case_names=','.join([Case.query.filter_by(id=scene_id).first().name for scene_id in self.case_ids]),
+                case_names=','.join([self.load_cases()[0][int(scene_id)].name for scene_id in self.case_ids]),
                 data='{}.txt'.format(now_time.strftime('%Y/%m/%d %H:%M:%S')),
-                project_id=self.project_id, read_status='待阅')
+                project_id=self.project_id, read_status='待阅', parent_id=self.parent_report_id,
+                base_id=self.base_report_id)
             db.session.add(new_report)
             db.session.commit()
-        d = self.all_cases_data()
-        # current_app.logger.info('cases message: {}'.format(d))
-        res = main_ate(d)
+            self.new_report_id = new_report.id
+            if self.run_control:
+                self.run_control.report_id = self.new_report_id
+        if self.cassette and self.cassette['mode'] == 'record':
+            # 本次录制的记录替换同一请求之前的录制，其它请求的录制保留
+            self.cassette = dict(self.cassette, run=Cassette.new_run())
+        report_writer = None
+        try:
+            d = self.all_cases_data()
+            # current_app.logger.info('cases message: {}'.format(d))
+            # 生成报告时步骤结果边执行边写入文件，返回的数据中步骤记录不含请求/响应详情，完整报告通过报告id读取
+            body_limit = self.project_data.report_body_limit
+            report_writer = ReportWriter(report_path(self.new_report_id),
+                                         REPORT_BODY_LIMIT if body_limit is None else body_limit) \
+                if self.new_report_id else None
+            if self.run_type and self.concurrency > 1 and len(d) > 1:
+                res = main_ate_parallel(d, self.concurrency, report_writer, self.run_control)
+            else:
+                res = main_ate(d, report_writer, self.run_control)
+            # 被取消或失败用例数已达上限时可能一个用例都没有执行，也照常汇总并写入报告
+            jump_res = self.finish_report(res, now_time, report_writer)
+        except MyBaseError as e:
+            # 变量、函数找不到等用例数据有误，不生成报告
+            self.discard_report(report_writer)
+            raise ValueError('用例数据有误：{}'.format(e))
+        except Exception:
+            self.discard_report(report_writer)
+            raise
+        finally:
+            if self.run_control:
+                self.run_control.clear()
+            if self.cassette and self.cassette.get('run'):
+                Cassette(**self.cassette).compact()
+        return jump_res
 
+    def finish_report(self, res, now_time, report_writer=None):
+        """ 汇总执行结果，生成报告时写入汇总并关闭报告文件 """
         res['time']['duration'] = "%.2f" % res['time']['duration']
-        res['stat']['successes_1'] = res['stat']['successes']
-        res['stat']['failures_1'] = res['stat']['failures']
-        res['stat']['errors_1'] = res['stat']['errors']
-        res['stat']['successes'] = "{} ({}%)".format(res['stat']['successes'],
-                                                     int(res['stat']['successes'] / res['stat']['testsRun'] * 100))
-        res['stat']['failures'] = "{} ({}%)".format(res['stat']['failures'],
-                                                    int(res['stat']['failures'] / res['stat']['testsRun'] * 100))
-        res['stat']['errors'] = "{} ({}%)".format(res['stat']['errors'],
-                                                  int(res['stat']['errors'] / res['stat']['testsRun'] * 100))
-        res['stat']['successes_scene'] = 0
-        res['stat']['failures_scene'] = 0
-        for num_1, res_1 in enumerate(res['details']):
-            if res_1['success']:
-                res['stat']['successes_scene'] += 1
-            else:
-                res['stat']['failures_scene'] += 1
+        format_stat(res)
+
+        # 请求各阶段的平均耗时，按基础url和接口汇总
+        res['timing'] = timing_summary(res.get('timing'))
+        api_names = {'{}'.format(a.id): a.name for a in ApiMsg.query.filter(ApiMsg.id.in_(
+            [int(_id) for _id in res['timing'].get('apis', {}) if _id.isdigit()])).all()} \
+            if res['timing'].get('apis') else {}
+        for _id, _timing in res['timing'].get('apis', {}).items():
+            _timing['name'] = api_names.get(_id, _id)
 
         res['time']['start_at'] = now_time.strftime('%Y/%m/%d %H:%M:%S')
+        res['plan_cache'] = plan_cache.stats()
         jump_res = json.dumps(res, ensure_ascii=False, default=encode_object)
-        if self.run_type and self.make_report:
-            self.new_report_id = Report.query.filter_by(
-                data='{}.txt'.format(now_time.strftime('%Y/%m/%d %H:%M:%S'))).first().id
-            with open('{}{}.txt'.format(REPORT_ADDRESS, self.new_report_id), 'w') as f:
-                f.write(jump_res)
+        if report_writer:
+            report_writer.write_summary(res)
+            report_writer.close()
+            if self.parent_report_id:
+                merge_rerun_report(self.parent_report_id, self.new_report_id)
+            elif self.base_report_id:
+                merge_changed_report(self.base_report_id, self.new_report_id)
         return jump_res
@@ -0,0 +1,199 @@
+# encoding: utf-8
+import socket
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.response import HTTPResponse
+from urllib3.util.connection import allowed_gai_family
+
+# 请求的各阶段：dns解析、tcp连接、tls握手、发送请求、等待首字节、接收响应内容
+PHASES = ('dns_ms', 'connect_ms', 'tls_ms', 'send_ms', 'wait_ms', 'transfer_ms')
+
+_local = threading.local()
+
+
+def start_timing():
+    """ 开始记录当前线程的请求耗时，复用连接时dns、connect、tls都为0 """
+    _local.timings = dict({phase: 0 for phase in PHASES}, new_connections=0)
+
+
+def stop_timing():
+    """ 结束记录并返回各阶段耗时(毫秒)，没有开始记录时返回None """
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    if timings is not None:
+        for phase in PHASES:
+            timings[phase] = round(timings[phase], 2)
+    return timings
+
+
+def _add(phase, start_time):
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[phase] += (time.time() - start_time) * 1000
+
+
+def _count_new_connection():
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings['new_connections'] += 1
+
+
+class TimedConnectionMixin(object):
+    """ 单独计时dns解析：先解析出地址，再按地址依次建立连接 """
+
+    def _new_conn(self):
+        new_conn_start = start_time = time.time()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise NewConnectionError(self, 'Failed to establish a new connection: {}'.format(e))
+        finally:
+            _add('dns_ms', start_time)
+
+        start_time = time.time()
+        dns_host = self._dns_host
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address[4][0]
+                try:
+                    conn = super(TimedConnectionMixin, self)._new_conn()
+                    _count_new_connection()
+                    return conn
+                except NewConnectionError:
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+            _add('connect_ms', start_time)
+            self._new_conn_time = time.time() - new_conn_start
+
+    def _connect_before_send(self):
+        """ http连接在发送请求时才建立，先建立连接，发送的耗时不再包含dns解析和tcp连接 """
+        if getattr(self, 'sock', None) is None:
+            self.connect()
+
+    def request(self, *args, **kwargs):
+        self._connect_before_send()
+        start_time = time.time()
+        try:
+            return super(TimedConnectionMixin, self).request(*args, **kwargs)
+        finally:
+            _add('send_ms', start_time)
+            self._sent_time = time.time()
+
+    def request_chunked(self, *args, **kwargs):
+        self._connect_before_send()
+        start_time = time.time()
+        try:
+            return super(TimedConnectionMixin, self).request_chunked(*args, **kwargs)
+        finally:
+            _add('send_ms', start_time)
+            self._sent_time = time.time()
+
+    def getresponse(self, *args, **kwargs):
+        start_time = getattr(self, '_sent_time', None) or time.time()
+        try:
+            return super(TimedConnectionMixin, self).getresponse(*args, **kwargs)
+        finally:
+            _add('wait_ms', start_time)
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    """ https连接的connect包括tcp连接和tls握手，减去_new_conn的耗时就是tls握手的耗时 """
+
+    def connect(self):
+        start_time = time.time()
+        self._new_conn_time = 0
+        super(TimedHTTPSConnection, self).connect()
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings['tls_ms'] += (time.time() - start_time - self._new_conn_time) * 1000
+
+
+class TimedHTTPResponse(HTTPResponse):
+    """ 读取响应内容的耗时 """
+
+    def read(self, *args, **kwargs):
+        start_time = time.time()
+        try:
+            return super(TimedHTTPResponse, self).read(*args, **kwargs)
+        finally:
+            _add('transfer_ms', start_time)
+
+    def read_chunked(self, *args, **kwargs):
+        start_time = time.time()
+        try:
+            for chunk in super(TimedHTTPResponse, self).read_chunked(*args, **kwargs):
+                _add('transfer_ms', start_time)
+                yield chunk
+                start_time = time.time()
+        finally:
+            _add('transfer_ms', start_time)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+    ResponseCls = TimedHTTPResponse
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+    ResponseCls = TimedHTTPResponse
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """ 连接池使用计时的连接，没有开始记录的线程不受影响 """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+
+def add_timing(rollup, timings):
+    """ 把一个请求的耗时按基础url和接口id累加到rollup，rollup可以直接序列化后在进程间合并 """
+    if not timings:
+        return rollup
+    for group, key in (('hosts', timings.get('host')), ('apis', timings.get('api_msg_id'))):
+        if not key:
+            continue
+        _sum = rollup.setdefault(group, {}).setdefault(key, dict({phase: 0 for phase in PHASES},
+                                                                 requests=0, new_connections=0))
+        _sum['requests'] += 1
+        _sum['new_connections'] += timings.get('new_connections', 0)
+        for phase in PHASES:
+            _sum[phase] += timings.get(phase, 0)
+    return rollup
+
+
+def merge_timing(rollup, other):
+    for group, sums in (other or {}).items():
+        for key, _other in sums.items():
+            _sum = rollup.setdefault(group, {}).setdefault(key, dict({phase: 0 for phase in PHASES},
+                                                                     requests=0, new_connections=0))
+            for field, value in _other.items():
+                _sum[field] += value
+    return rollup
+
+
+def timing_summary(rollup):
+    """ 各阶段的累计耗时转成平均耗时 """
+    summary = {}
+    for group, sums in (rollup or {}).items():
+        summary[group] = {}
+        for key, _sum in sums.items():
+            _summary = {'requests': _sum['requests'], 'new_connections': _sum['new_connections']}
+            for phase in PHASES:
+                _summary['avg_{}'.format(phase)] = round(_sum[phase] / _sum['requests'], 2) \
+                    if _sum['requests'] else 0
+            summary[group][key] = _summary
+    return summary
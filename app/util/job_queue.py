@@ -0,0 +1,212 @@
+# encoding: utf-8
+import datetime
+import json
+import os
+import socket
+import threading
+import traceback
+
+from app import db
+from app.models import RunJob
+from .global_variable import JOB_POLL_INTERVAL, JOB_HEARTBEAT_INTERVAL, JOB_STALE_TIMEOUT, JOB_MAX_ATTEMPTS
+from .utils import encode_object
+from .run_control import request_cancel
+
+JOB_HANDLERS = {}
+FINISHED_STATUS = ('success', 'failed', 'cancelled')
+
+
+def register_job(job_type):
+    """ 注册任务类型的执行函数，执行函数接收入队时的参数和job_id，返回的dict中可带report_id """
+    def decorator(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+def worker_name():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), threading.current_thread().name)
+
+
+def enqueue(job_type, params):
+    """ 任务保存到数据库后返回任务id，由执行进程按入队顺序取出执行 """
+    job = RunJob(job_type=job_type, params=json.dumps(params, ensure_ascii=False), status='queued', attempts=0)
+    db.session.add(job)
+    db.session.commit()
+    if _dispatcher is not None:
+        _dispatcher.wake_up()
+    return job.id
+
+
+def claim_job():
+    """ 取出最早入队的任务并标记为执行中；多个进程同时取时只有一个能更新成功 """
+    while True:
+        job = RunJob.query.filter_by(status='queued').order_by(RunJob.id.asc()).first()
+        if job is None:
+            return None
+        now = datetime.datetime.now()
+        claimed = RunJob.query.filter_by(id=job.id, status='queued').update(
+            {'status': 'running', 'worker': worker_name(), 'start_time': now, 'heartbeat': now,
+             'attempts': RunJob.attempts + 1}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            db.session.refresh(job)
+            return job
+
+
+def cancel_job(job):
+    """ 还没开始执行的任务直接标记为取消，执行中的任务写取消标记，在步骤之间停止 """
+    cancelled = RunJob.query.filter_by(id=job.id, status='queued').update(
+        {'status': 'cancelled', 'end_time': datetime.datetime.now()}, synchronize_session=False)
+    db.session.commit()
+    if not cancelled and job.status == 'running':
+        request_cancel(job_id=job.id)
+    db.session.refresh(job)
+    return job
+
+
+def requeue_stale_jobs():
+    """ 执行进程异常退出时任务的心跳不再更新，超时后重新入队；执行次数达到上限的标记为失败 """
+    deadline = datetime.datetime.now() - datetime.timedelta(seconds=JOB_STALE_TIMEOUT)
+    stale = RunJob.query.filter(RunJob.status == 'running', RunJob.heartbeat < deadline)
+    requeued = stale.filter(RunJob.attempts < JOB_MAX_ATTEMPTS).update(
+        {'status': 'queued', 'worker': None}, synchronize_session=False)
+    failed = stale.filter(RunJob.attempts >= JOB_MAX_ATTEMPTS).update(
+        {'status': 'failed', 'end_time': datetime.datetime.now(),
+         'result': json.dumps({'error': '执行进程没有响应，已达到最大执行次数'}, ensure_ascii=False)},
+        synchronize_session=False)
+    db.session.commit()
+    return requeued, failed
+
+
+class Heartbeat(threading.Thread):
+    """ 任务执行期间定时更新心跳，使用独立的数据库session """
+
+    def __init__(self, app, job_id, interval=JOB_HEARTBEAT_INTERVAL):
+        super(Heartbeat, self).__init__(name='job-heartbeat-{}'.format(job_id), daemon=True)
+        self.app = app
+        self.job_id = job_id
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    RunJob.query.filter_by(id=self.job_id, status='running').update(
+                        {'heartbeat': datetime.datetime.now()}, synchronize_session=False)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def execute_job(job):
+    """ 执行任务并保存结果 """
+    try:
+        handler = JOB_HANDLERS[job.job_type]
+        result = handler(job_id=job.id, **json.loads(job.params)) or {}
+        job.status = 'success'
+        job.report_id = result.get('report_id')
+        job.result = json.dumps(result, ensure_ascii=False, default=encode_object)
+    except Exception:
+        db.session.rollback()
+        job = RunJob.query.filter_by(id=job.id).first()
+        job.status = 'failed'
+        job.result = json.dumps({'error': traceback.format_exc()}, ensure_ascii=False)
+    job.end_time = datetime.datetime.now()
+    db.session.commit()
+
+
+def job_data(job):
+    return {'job_id': job.id,
+            'job_type': job.job_type,
+            'status': job.status,
+            'report_id': job.report_id,
+            'result': json.loads(job.result) if job.result else None,
+            'created_time': job.created_time.strftime('%Y-%m-%d %H:%M:%S') if job.created_time else None,
+            'start_time': job.start_time.strftime('%Y-%m-%d %H:%M:%S') if job.start_time else None,
+            'end_time': job.end_time.strftime('%Y-%m-%d %H:%M:%S') if job.end_time else None}
+
+
+class JobDispatcher(threading.Thread):
+    """ 后台线程：循环从数据库取任务执行，队列为空时等待新任务入队或JOB_POLL_INTERVAL秒后再查 """
+
+    def __init__(self, app, poll_interval=JOB_POLL_INTERVAL, name='job-dispatcher'):
+        super(JobDispatcher, self).__init__(name=name, daemon=True)
+        self.app = app
+        self.poll_interval = poll_interval
+        self._event = threading.Event()
+        self._stopped = False
+
+    def wake_up(self):
+        self._event.set()
+
+    def stop(self):
+        self._stopped = True
+        self._event.set()
+
+    def run_once(self):
+        """ 执行一个任务，没有任务时返回False """
+        with self.app.app_context():
+            try:
+                requeue_stale_jobs()
+                job = claim_job()
+                if job is None:
+                    return False
+                self.app.logger.info('{}开始执行任务:{}，类型:{}'.format(worker_name(), job.id, job.job_type))
+                heartbeat = Heartbeat(self.app, job.id)
+                heartbeat.start()
+                try:
+                    execute_job(job)
+                finally:
+                    heartbeat.stop()
+                return True
+            finally:
+                db.session.remove()
+
+    def run(self):
+        while not self._stopped:
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                self.app.logger.info(traceback.format_exc())
+            self._event.wait(self.poll_interval)
+            self._event.clear()
+
+
+_dispatcher = None
+
+
+def start_dispatcher(app):
+    global _dispatcher
+    if _dispatcher is None or not _dispatcher.is_alive():
+        _dispatcher = JobDispatcher(app)
+        _dispatcher.start()
+    return _dispatcher
+
+
+def stop_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop()
+        _dispatcher = None
+
+
+def run_worker(app, concurrency=1):
+    """ 独立的执行进程：启动concurrency个执行线程从共享队列取任务，直到进程被中断 """
+    dispatchers = [JobDispatcher(app, name='job-worker-{}'.format(i)) for i in range(max(concurrency, 1))]
+    for dispatcher in dispatchers:
+        dispatcher.start()
+    try:
+        while any(dispatcher.is_alive() for dispatcher in dispatchers):
+            for dispatcher in dispatchers:
+                dispatcher.join(1)
+    except KeyboardInterrupt:
+        for dispatcher in dispatchers:
+            dispatcher.stop()
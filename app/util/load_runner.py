@@ -0,0 +1,167 @@
+# encoding: utf-8
+import copy
+import math
+import threading
+import time
+import traceback
+
+from httprunner import logger
+from app.models import ApiMsg
+from .http_client import RequestListener
+from .http_run import MyHttpRunner, open_upload_files
+
+
+def percentile(sorted_values, percent):
+    """ 线性插值计算百分位数，sorted_values需已排序 """
+    if not sorted_values:
+        return 0
+    k = (len(sorted_values) - 1) * percent / 100.0
+    f = int(math.floor(k))
+    c = min(f + 1, len(sorted_values) - 1)
+    return round(sorted_values[f] + (sorted_values[c] - sorted_values[f]) * (k - f), 2)
+
+
+class RateLimiter(object):
+    """ 所有虚拟用户共用的请求速率限制，按固定间隔发出请求 """
+
+    def __init__(self, rps):
+        self.interval = 1.0 / rps if rps else 0
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.time()
+            send_time = max(now, self._next_time)
+            self._next_time = send_time + self.interval
+        if send_time > now:
+            time.sleep(send_time - now)
+
+
+class LoadStats(RequestListener):
+    """ 按接口收集每个请求的响应时间和是否失败 """
+
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+        self.requests = {}
+        self.timings = {}
+        self.failures = {}
+        self.errors = {}
+        self.iterations = 0
+        self.failed_iterations = 0
+        self._lock = threading.Lock()
+
+    def before_request(self, name):
+        self.rate_limiter.acquire()
+
+    def after_request(self, name, meta_data, error=None):
+        """ 抛出异常、连接失败(状态码不是数字)或状态码>=400的请求算失败；没有响应时间的请求不参与响应时间统计 """
+        try:
+            response = (meta_data or {}).get('response') or {}
+            status_code = response.get('status_code')
+            response_time = response.get('response_time_ms')
+            failed = error is not None or not isinstance(status_code, int) or not status_code or status_code >= 400
+            with self._lock:
+                self.requests[name] = self.requests.get(name, 0) + 1
+                if isinstance(response_time, (int, float)):
+                    self.timings.setdefault(name, []).append(response_time)
+                if failed:
+                    self.failures[name] = self.failures.get(name, 0) + 1
+            if error is not None:
+                self.add_error(error)
+        except Exception as e:
+            logger.log_error('压测统计请求结果失败：{}'.format(e))
+
+    def add_error(self, error):
+        """ 按异常类型统计请求和执行过程中的异常次数 """
+        with self._lock:
+            error_type = type(error).__name__
+            self.errors[error_type] = self.errors.get(error_type, 0) + 1
+
+    def add_iteration(self, success):
+        with self._lock:
+            self.iterations += 1
+            if not success:
+                self.failed_iterations += 1
+
+    @staticmethod
+    def _summary(requests, timings, failures, duration):
+        timings = sorted(timings)
+        return {'requests': requests,
+                'failures': failures,
+                'rps': round(requests / duration, 2) if duration else 0,
+                'avg': round(sum(timings) / len(timings), 2) if timings else 0,
+                'min': timings[0] if timings else 0,
+                'max': timings[-1] if timings else 0,
+                'p50': percentile(timings, 50),
+                'p90': percentile(timings, 90),
+                'p99': percentile(timings, 99)}
+
+    def summary(self, duration):
+        names = {'{}'.format(a.id): a.name for a in
+                 ApiMsg.query.filter(ApiMsg.id.in_([int(n) for n in self.requests if n and n.isdigit()])).all()} \
+            if self.requests else {}
+        apis = []
+        for name, requests in self.requests.items():
+            _summary = self._summary(requests, self.timings.get(name, []), self.failures.get(name, 0), duration)
+            _summary.update({'api_msg_id': name, 'name': names.get(name, name)})
+            apis.append(_summary)
+        total = self._summary(sum(self.requests.values()),
+                              [t for timings in self.timings.values() for t in timings],
+                              sum(self.failures.values()), duration)
+        return {'total': total, 'apis': apis, 'iterations': self.iterations,
+                'failed_iterations': self.failed_iterations, 'errors': self.errors, 'duration': round(duration, 2)}
+
+
+class LoadRunner(object):
+    """
+    压测：把业务用例作为虚拟用户的执行流程，每个虚拟用户在自己的线程里循环执行全部用例。
+    虚拟用户在ramp_up秒内均匀启动，所有请求按rps限速(0为不限速)；
+    设置了duration时每个用户执行到时间结束，否则每个用户执行iterations次；被取消时每个用户执行完当前一次后停止。
+    参数由调用方校验。
+    """
+
+    def __init__(self, cases, users=1, ramp_up=0, rps=0, duration=None, iterations=1, run_control=None):
+        self.cases = cases
+        self.users = users
+        self.ramp_up = ramp_up
+        self.duration = duration
+        self.iterations = iterations
+        self.run_control = run_control
+        self.stats = LoadStats(RateLimiter(rps))
+        self.start_time = None
+
+    def _finished(self, iteration):
+        if self.run_control and self.run_control.cancelled():
+            return True
+        if self.duration:
+            return time.time() - self.start_time >= self.duration
+        return iteration >= self.iterations
+
+    def _user(self, index):
+        time.sleep(self.ramp_up * index / self.users)
+        iteration = 0
+        while not self._finished(iteration):
+            cases = copy.deepcopy(self.cases)
+            try:
+                open_upload_files(cases)
+                success = MyHttpRunner(request_listener=self.stats).run(cases).summary['success']
+            except Exception as e:
+                logger.log_error('压测用户{}执行失败：{}'.format(index, traceback.format_exc()))
+                self.stats.add_error(e)
+                success = False
+            self.stats.add_iteration(success)
+            iteration += 1
+
+    def run(self):
+        self.start_time = time.time()
+        users = [threading.Thread(target=self._user, args=(i,), daemon=True) for i in range(self.users)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        result = self.stats.summary(time.time() - self.start_time)
+        result.update({'users': self.users, 'ramp_up': self.ramp_up})
+        return result
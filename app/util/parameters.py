@@ -0,0 +1,142 @@
+# encoding: utf-8
+import csv
+import os
+
+from httprunner import exceptions, parser
+from openpyxl import load_workbook
+from .global_variable import FILE_ADDRESS
+
+# 参数值为这些后缀的文件名时，从上传的文件中按行读取
+PARAMETER_FILE_TYPES = ('.csv', '.xlsx')
+
+
+def check_parameters(parameters):
+    """ 用例参数化配置的格式：[{"参数名1-参数名2": 数据列表/文件名/函数}]，格式有误时抛出ValueError """
+    if not isinstance(parameters, list):
+        raise ValueError('参数化配置必须是列表')
+    for parameter in parameters:
+        if not isinstance(parameter, dict) or len(parameter) != 1:
+            raise ValueError('参数化配置的每一项只能有一个参数名')
+        name, content = list(parameter.items())[0]
+        if not name:
+            raise ValueError('参数名不能为空')
+        if not isinstance(content, (list, str)):
+            raise ValueError('参数{}的值只能是列表、数据文件名或函数'.format(name))
+        if isinstance(content, str) and content.endswith(PARAMETER_FILE_TYPES):
+            path = os.path.join(FILE_ADDRESS, content)
+            if not os.path.exists(path):
+                raise ValueError('参数{}的数据文件{}不存在'.format(name, content))
+            try:
+                # 只读到表头，检查声明的参数名在文件中都有对应的列
+                next(iter_file(path, name.split('-')), None)
+            except exceptions.ParamsError as e:
+                raise ValueError('{}'.format(e))
+
+
+def _check_columns(path, header, names):
+    missing = [name for name in names if name not in header]
+    if missing:
+        raise exceptions.ParamsError('参数数据文件{}中没有{}列'.format(os.path.basename(path), '、'.join(missing)))
+
+
+def iter_csv(path, names=()):
+    """ 按行读取csv，第一行为参数名；names中的参数名在第一行中没有时抛出ParamsError """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        _check_columns(path, reader.fieldnames or [], names)
+        for row in reader:
+            yield row
+
+
+def iter_xlsx(path, names=()):
+    """ 只读模式按行读取第一个sheet，第一行为参数名；names中的参数名在第一行中没有时抛出ParamsError """
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        header = None
+        for row in workbook.worksheets[0].values:
+            if header is None:
+                header = ['{}'.format(cell).strip() if cell is not None else '' for cell in row]
+                _check_columns(path, header, names)
+                continue
+            if any(cell is not None for cell in row):
+                yield dict(zip(header, row))
+        if header is None:
+            _check_columns(path, [], names)
+    finally:
+        workbook.close()
+
+
+def iter_file(path, names=()):
+    return iter_csv(path, names) if path.endswith('.csv') else iter_xlsx(path, names)
+
+
+class ParameterSource(object):
+    """
+    一个参数的数据来源，每次迭代从头产生 {参数名: 值}：
+    列表直接迭代；数据文件每次迭代重新按行读取，不整体读入内存；函数只调用一次，结果保存下来重复使用
+    """
+
+    def __init__(self, parameter, variables_mapping, functions_mapping):
+        name, self.content = list(parameter.items())[0]
+        self.names = name.split('-')
+        self.variables_mapping = variables_mapping
+        self.functions_mapping = functions_mapping
+        self._values = None
+
+    def _rows(self):
+        if isinstance(self.content, list):
+            for item in self.content:
+                yield dict(zip(self.names, item if isinstance(item, (list, tuple)) else [item]))
+        elif self.content.endswith(PARAMETER_FILE_TYPES):
+            # 文件保存后可能被替换，读取时也检查表头；某行的列比表头少时缺少的值为None
+            for row in iter_file(os.path.join(FILE_ADDRESS, self.content), self.names):
+                yield {name: row.get(name) for name in self.names}
+        else:
+            if self._values is None:
+                values = parser.parse_data(self.content, self.variables_mapping, self.functions_mapping)
+                if isinstance(values, (str, dict)) or not hasattr(values, '__iter__'):
+                    raise exceptions.ParamsError('参数{}的函数必须返回列表'.format('-'.join(self.names)))
+                self._values = [{name: item[name] for name in self.names} for item in values]
+            for item in self._values:
+                yield item
+
+    def __iter__(self):
+        return self._rows()
+
+    def count(self):
+        """ 参数值的个数，文件按行计数；函数的返回值要调用后才知道，返回None """
+        if isinstance(self.content, list):
+            return len(self.content)
+        if self.content.endswith(PARAMETER_FILE_TYPES):
+            return sum(1 for _ in self)
+        return None
+
+
+def count_parameters(parameters):
+    """ 参数组合的个数，有参数的值由函数生成时返回None """
+    total = 1
+    for parameter in parameters:
+        count = ParameterSource(parameter, {}, {}).count()
+        if count is None:
+            return None
+        total *= count
+    return total
+
+
+def _product(sources, mapping):
+    if not sources:
+        yield dict(mapping)
+        return
+    for item in sources[0]:
+        _mapping = dict(mapping, **item)
+        for result in _product(sources[1:], _mapping):
+            yield result
+
+
+def iter_parameters(parameters, variables_mapping, functions_mapping):
+    """
+    逐个产生参数的笛卡尔积组合，顺序和HttpRunner的parse_parameters一致。
+    第一个参数只读取一遍，后面的参数对前一个参数的每个值都重新迭代一遍，数据量大的文件放在第一个
+    """
+    sources = [ParameterSource(parameter, variables_mapping, functions_mapping) for parameter in parameters]
+    return _product(sources, {})
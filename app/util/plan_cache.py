@@ -0,0 +1,68 @@
+# encoding: utf-8
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from .global_variable import PLAN_CACHE_SIZE
+
+
+def row_data(row):
+    """ 数据行的全部字段 """
+    return {c.name: getattr(row, c.name) for c in row.__table__.columns}
+
+
+def plan_version(*items):
+    """ 根据编译用到的数据计算版本号，数据行按全部字段计算，任意字段修改后版本号都会变化 """
+    md5 = hashlib.md5()
+    for item in items:
+        if isinstance(item, (list, tuple)):
+            item = [row_data(i) if hasattr(i, '__table__') else i for i in item]
+        elif hasattr(item, '__table__'):
+            item = row_data(item)
+        md5.update(json.dumps(item, sort_keys=True, default=str).encode('utf-8'))
+    return md5.hexdigest()
+
+
+class PlanCache(object):
+    """
+    编译好的用例执行计划缓存，按用例id存储，版本号变化后重新编译，超出容量时淘汰最久未使用的。
+    缓存中的计划不能被修改，使用时先copy.deepcopy。
+    """
+
+    def __init__(self, max_size=PLAN_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            item = self._plans.get(key)
+            if item is not None and item[0] == version:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, plan):
+        with self._lock:
+            self._plans[key] = (version, plan)
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'size': len(self._plans), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(float(self.hits) / total, 4) if total else 0}
+
+
+plan_cache = PlanCache()
@@ -0,0 +1,141 @@
+# encoding: utf-8
+import time
+
+from httprunner import built_in, exceptions, loader, parser
+from .func_registry import func_registry
+from .parameters import check_parameters, count_parameters
+from .utils import extract_variables, extract_functions
+
+# HttpRunner内置的函数，用例没有引用函数文件也可以使用
+BUILTIN_FUNCTIONS = loader.load_python_module(built_in)['functions']
+
+
+def _strings(content):
+    """ 取出步骤数据中的所有字符串 """
+    if isinstance(content, str):
+        yield content
+    elif isinstance(content, dict):
+        for key, value in content.items():
+            yield from _strings(key)
+            yield from _strings(value)
+    elif isinstance(content, (list, tuple)):
+        for item in content:
+            yield from _strings(item)
+
+
+def _references(content):
+    """ 引用的变量名和函数名，按出现顺序去重 """
+    variables, functions = [], []
+    for text in _strings(content):
+        variables += [v for v in extract_variables(text) if v not in variables]
+        functions += [f.split('(')[0] for f in extract_functions(text) if f.split('(')[0] not in functions]
+    return variables, functions
+
+
+def _function_exists(name, functions):
+    try:
+        parser.get_mapping_function(name, functions)
+        return True
+    except exceptions.FunctionNotFound:
+        return False
+
+
+class PlanCheck(object):
+    """
+    编译执行计划并做静态检查，不发请求、不调用用例引用的函数：
+    检查引用的变量是否在项目/用例变量、参数化参数或前面步骤的提取中定义，引用的函数是否在函数文件中定义，
+    并按执行次数、步骤次数、参数组合数和重试次数估算请求数
+    """
+
+    def __init__(self, run_case):
+        self.run_case = run_case
+        self.phases = {'load_ms': 0, 'compile_ms': 0, 'functions_ms': 0, 'parameters_ms': 0, 'resolve_ms': 0}
+
+    def _timed(self, phase, func, *args):
+        start_time = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.phases[phase] += (time.time() - start_time) * 1000
+
+    def check_case(self, case):
+        config = case['config']
+        steps = case['teststeps']
+        unresolved = []
+
+        functions = dict(BUILTIN_FUNCTIONS)
+        try:
+            functions.update(self._timed('functions_ms', func_registry.load_functions,
+                                         config.get('import_module_functions') or []))
+        except Exception as e:
+            unresolved.append({'step': None, 'type': 'function_file', 'ref': None,
+                               'msg': '函数文件加载失败：{}'.format(e)})
+
+        parameters = config.get('parameters') or []
+        combinations = 1
+        try:
+            check_parameters(parameters)
+            combinations = self._timed('parameters_ms', count_parameters, parameters)
+        except ValueError as e:
+            unresolved.append({'step': None, 'type': 'parameters', 'ref': None, 'msg': '{}'.format(e)})
+
+        start_time = time.time()
+        known = {key for variable in config.get('variables', []) for key in variable}
+        known.update(name for parameter in parameters if isinstance(parameter, dict)
+                     for key in parameter for name in key.split('-'))
+        extracted = {}  # 变量名: 提取该变量的第一个步骤序号
+        for index, step in enumerate(steps):
+            for key in [k for extract in step.get('extract', []) for k in extract]:
+                extracted.setdefault(key, index)
+
+        def _check(content, step_index, step_name, available):
+            variables, _functions = _references(content)
+            for name in variables:
+                if name in known or available(name):
+                    continue
+                if name in extracted:
+                    msg = '变量${}在第{}个步骤才提取，第{}个步骤使用时还没有值'.format(name, extracted[name] + 1,
+                                                                      step_index + 1)
+                else:
+                    msg = '变量${}在项目变量、用例变量、参数化参数和步骤提取中都没有定义'.format(name)
+                unresolved.append({'step': step_name, 'index': step_index, 'type': 'variable', 'ref': name,
+                                   'msg': msg})
+            for name in _functions:
+                if not _function_exists(name, functions):
+                    unresolved.append({'step': step_name, 'index': step_index, 'type': 'function', 'ref': name,
+                                       'msg': '函数{}在引用的函数文件中没有定义'.format(name)})
+
+        _check(config.get('variables', []), None, '用例配置', lambda name: False)
+        _check(config.get('request', {}), None, '用例配置', lambda name: False)
+        max_requests = 0
+        for index, step in enumerate(steps):
+            # 请求和setup_hooks只能用前面步骤提取的变量，校验和teardown_hooks还可以用本步骤提取的变量
+            _check([step.get('request', {}), step.get('setup_hooks', [])], index, step['name'],
+                   lambda name: extracted.get(name, index) < index)
+            _check([step.get('validate', []), step.get('teardown_hooks', [])], index, step['name'],
+                   lambda name: extracted.get(name, index + 1) <= index)
+            max_requests += (step['request'].get('retry') or {}).get('times', 1)
+        self.phases['resolve_ms'] += (time.time() - start_time) * 1000
+
+        return {'name': config.get('name'),
+                'steps': steps,
+                'parameter_combinations': combinations,
+                'requests': len(steps) * combinations if combinations is not None else None,
+                'max_requests': max_requests * combinations if combinations is not None else None,
+                'unresolved': unresolved}
+
+    def run(self):
+        """ 返回每个用例的编译结果和检查结果、各阶段耗时、估算的请求数；请求数为None表示参数由函数生成，无法估算 """
+        start_time = time.time()
+        if self.run_case.case_ids:
+            self._timed('load_ms', self.run_case.load_cases)
+        cases = self._timed('compile_ms', self.run_case.all_cases_data)
+        cases = [self.check_case(case) for case in (cases if isinstance(cases, list) else [cases])]
+        self.phases['total_ms'] = (time.time() - start_time) * 1000
+        exact = all(case['requests'] is not None for case in cases)
+        return {'cases': cases,
+                'unresolved': sum(len(case['unresolved']) for case in cases),
+                'requests': sum(case['requests'] or 0 for case in cases),
+                'max_requests': sum(case['max_requests'] or 0 for case in cases),
+                'requests_exact': exact,
+                'phases': {phase: round(value, 2) for phase, value in self.phases.items()}}
@@ -8,6 +8,7 @@ from httprunner import logger
 from httprunner.compat import basestring, bytes, json, numeric_types
 from jinja2 import Template, escape
 from requests.structures import CaseInsensitiveDict
+from ..global_variable import REPORT_ADDRESS
 
 
 def stringify_data(meta_data, request_or_response):
@@ -68,7 +69,7 @@ def render_html_report(summary, html_report_name=None, html_report_template=None
     logger.log_info("Start to render Html report ...")
     logger.log_debug("render data: {}".format(summary))
 
-    report_dir_path = os.path.join(os.path.abspath('..') + r'/reports')
+    report_dir_path = REPORT_ADDRESS
     if html_report_name:
         summary["html_report_name"] = html_report_name
         # report_dir_path = os.path.join(report_dir_path, html_report_name)
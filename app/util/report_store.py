@@ -0,0 +1,284 @@
+# encoding: utf-8
+import json
+import os
+import shutil
+
+from httprunner.report import HtmlTestResult, aggregate_stat
+from .blob_store import spill_response_body
+from .http_client import StepTimeout
+from .http_timing import add_timing
+from .global_variable import REPORT_ADDRESS
+from .utils import encode_object
+
+# 报告汇总统计中的计数项
+STAT_KEYS = ('testsRun', 'failures', 'errors', 'skipped', 'expectedFailures', 'unexpectedSuccesses', 'successes',
+             'timeouts')
+
+def report_path(report_id, suffix='jsonl'):
+    return '{}{}.{}'.format(REPORT_ADDRESS, report_id, suffix)
+
+
+class ReportWriter(object):
+    """
+    流式写报告：每个步骤执行完就把记录追加到文件，内存里只保留不含请求/响应数据的简要记录。
+    文件为JSON Lines，每行 {"type": "record"|"case"|"summary", "data": {...}}：
+    一个用例的步骤记录(record)之后跟该用例的汇总(case)，文件最后一行是整个报告的汇总(summary)。
+    响应内容超过body_limit的部分存到blob，记录里只保留前面一段。
+    """
+
+    def __init__(self, path, body_limit=None):
+        self.path = path
+        self.body_limit = body_limit
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write(self, line_type, data):
+        self._file.write(json.dumps({'type': line_type, 'data': data}, ensure_ascii=False, default=encode_object))
+        self._file.write('\n')
+
+    def write_case(self, testcase_summary):
+        self.write('case', {k: v for k, v in testcase_summary.items() if k != 'records'})
+
+    def write_summary(self, summary):
+        self.write('summary', {k: v for k, v in summary.items() if k != 'details'})
+
+    def append_file(self, path):
+        """ 把并发执行的子进程写的报告片段按顺序拼接进来 """
+        self._file.flush()
+        with open(path, 'r', encoding='utf-8') as f:
+            shutil.copyfileobj(f, self._file)
+        os.remove(path)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class BufferedWriter(ReportWriter):
+    """ 并发执行的参数组合先把步骤记录保存在内存，按组合顺序汇总时再写入报告文件，避免不同组合的记录交错 """
+
+    def __init__(self, writer):
+        self.path = writer.path
+        self.body_limit = writer.body_limit
+        self.writer = writer
+        self._lines = []
+
+    def write(self, line_type, data):
+        self._lines.append(json.dumps({'type': line_type, 'data': data}, ensure_ascii=False, default=encode_object))
+
+    def commit(self):
+        for line in self._lines:
+            self.writer._file.write(line)
+            self.writer._file.write('\n')
+        self._lines = []
+
+    def close(self):
+        pass
+
+
+class RunResult(HtmlTestResult):
+    """ 在HtmlTestResult的基础上单独统计超时的步骤(仍按error记录)，并汇总请求各阶段的耗时 """
+
+    def __init__(self, stream, descriptions, verbosity):
+        super(RunResult, self).__init__(stream, descriptions, verbosity)
+        self.timeouts = 0
+        self.timing = {}
+
+    def add_timing(self, test):
+        meta_data = getattr(test, 'meta_data', None) or {}
+        add_timing(self.timing, meta_data.get('response', {}).get('timings'))
+
+    def _record_test(self, test, status, attachment=''):
+        self.add_timing(test)
+        super(RunResult, self)._record_test(test, status, attachment)
+
+    def addError(self, test, err):
+        if err[0] is not None and issubclass(err[0], StepTimeout):
+            self.timeouts += 1
+        super(RunResult, self).addError(test, err)
+
+
+class StreamResult(RunResult):
+    """ 步骤执行结果直接写入报告文件，records里只保留名称、状态和异常信息 """
+
+    def __init__(self, writer, stream, descriptions, verbosity):
+        super(StreamResult, self).__init__(stream, descriptions, verbosity)
+        self.writer = writer
+
+    def _record_test(self, test, status, attachment=''):
+        self.add_timing(test)
+        data = {'name': test.shortDescription(), 'status': status, 'attachment': attachment,
+                'meta_data': spill_response_body(getattr(test, 'meta_data', {}), self.writer.body_limit)}
+        self.writer.write('record', data)
+        if hasattr(test, 'meta_data'):
+            del test.meta_data
+        self.records.append({'name': data['name'], 'status': status, 'attachment': attachment, 'meta_data': {}})
+
+
+def _match_state(testcase_summary, state):
+    if state == 'success':
+        return testcase_summary['success']
+    if state == 'error':
+        return not testcase_summary['success']
+    return True
+
+
+def read_report(report_id, state=None):
+    """ 读取报告，state为success/error时只返回成功/失败的用例；报告不存在或还没写完时返回None """
+    path = report_path(report_id)
+    if os.path.exists(path):
+        summary, details, records = None, [], []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                if item['type'] == 'record':
+                    records.append(item['data'])
+                elif item['type'] == 'case':
+                    if _match_state(item['data'], state):
+                        item['data']['records'] = records
+                        details.append(item['data'])
+                    records = []
+                elif item['type'] == 'summary':
+                    summary = item['data']
+        if summary is None:
+            return None
+        summary['details'] = details
+        return summary
+
+    # 旧格式的报告，整个summary保存为一个json
+    path = report_path(report_id, 'txt')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            summary = json.loads(f.read())
+        summary['details'] = [d for d in summary['details'] if _match_state(d, state)]
+        return summary
+    return None
+
+
+def format_stat(res):
+    """
+    报告汇总的统计：超时的步骤单独计数，不再算在errors里；各项转成 "数量 (百分比)"，原始数量放在 xxx_1 中。
+    没有执行任何用例时缺少的计数按0处理
+    """
+    stat = res['stat']
+    for key in STAT_KEYS:
+        stat.setdefault(key, 0)
+    stat['errors'] -= stat['timeouts']
+    stat['successes_1'] = stat['successes']
+    stat['failures_1'] = stat['failures']
+    stat['errors_1'] = stat['errors']
+    stat['timeouts_1'] = stat['timeouts']
+    for key in ('successes', 'failures', 'errors', 'timeouts'):
+        stat[key] = "{} ({}%)".format(stat['{}_1'.format(key)],
+                                      int(stat['{}_1'.format(key)] / (stat['testsRun'] or 1) * 100))
+    stat['successes_scene'] = 0
+    stat['failures_scene'] = 0
+    for testcase_summary in res['details']:
+        if testcase_summary['success']:
+            stat['successes_scene'] += 1
+        else:
+            stat['failures_scene'] += 1
+    return res
+
+
+def _iter_cases(path):
+    """ 按用例读取报告文件，产生 (步骤记录的原始行, 用例汇总数据, 用例汇总的原始行)；用例之后的汇总行不产生 """
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            item = json.loads(line)
+            if item['type'] == 'record':
+                records.append(line)
+            elif item['type'] == 'case':
+                yield records, item['data'], line
+                records = []
+
+
+def read_summary(report_id):
+    """ 只读取报告的汇总，不含用例详情 """
+    summary = None
+    with open(report_path(report_id), 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('{"type": "summary"'):
+                summary = json.loads(line)['data']
+    return summary
+
+
+def report_cases(report_id):
+    """ 报告中执行过的用例 [(用例id, 用例名称, 是否成功)]，按报告中的顺序；旧报告没有记录用例id时id为None """
+    return [(testcase_summary.get('case_id'), testcase_summary['name'], testcase_summary['success'])
+            for _, testcase_summary, _ in _iter_cases(report_path(report_id))]
+
+
+def failed_cases(report_id):
+    """ 报告中执行失败的用例 [(用例id, 用例名称)]，按报告中的顺序去重 """
+    cases = []
+    for case_id, name, success in report_cases(report_id):
+        if not success and (case_id, name) not in cases:
+            cases.append((case_id, name))
+    return cases
+
+
+def _merge_report(parent_id, report_id, update_summary):
+    """
+    把只执行了部分用例的报告和原报告合并，写回新报告文件：原报告中再次执行的用例换成新的结果(位置不变)，
+    其它用例照搬原报告，统计按合并后的用例重新计算，其它汇总数据取新报告的，再由update_summary补充。
+    逐行处理，不整体读入内存
+    """
+    path = report_path(report_id)
+    rerun_summary = read_summary(report_id)
+    rerun_cases = {}
+    for case in _iter_cases(path):
+        rerun_cases.setdefault(case[1].get('case_id'), []).append(case)
+
+    parent_summary = read_summary(parent_id)
+    stat, details = {}, []
+    merged_path = '{}.merge'.format(path)
+    with open(merged_path, 'w', encoding='utf-8') as f:
+        rerun_ids = set(rerun_cases)
+        for case in _iter_cases(report_path(parent_id)):
+            case_id = case[1].get('case_id')
+            # 同一个用例执行了多次(执行次数、参数化)时，重跑的结果都放在第一次出现的位置
+            cases = rerun_cases.pop(case_id, []) if case_id in rerun_ids else [case]
+            for records, testcase_summary, case_line in cases:
+                f.writelines(records)
+                f.write(case_line)
+                aggregate_stat(stat, testcase_summary['stat'])
+                details.append({'success': testcase_summary['success']})
+        # 原报告中没有的用例(正常不会出现)放在最后
+        for cases in rerun_cases.values():
+            for records, testcase_summary, case_line in cases:
+                f.writelines(records)
+                f.write(case_line)
+                aggregate_stat(stat, testcase_summary['stat'])
+                details.append({'success': testcase_summary['success']})
+
+        summary = dict(rerun_summary)
+        summary.update(format_stat({'stat': stat, 'details': details}))
+        summary.pop('details')
+        summary['success'] = all(d['success'] for d in details)
+        update_summary(summary, rerun_summary, parent_summary)
+        f.write(json.dumps({'type': 'summary', 'data': summary}, ensure_ascii=False, default=encode_object))
+        f.write('\n')
+    os.replace(merged_path, path)
+    return summary
+
+
+def merge_rerun_report(parent_id, report_id):
+    """ 重跑失败用例的报告和原报告合并：开始时间取原报告的，耗时为两次之和，重跑本身的统计放在summary的rerun中 """
+    def _update(summary, rerun_summary, parent_summary):
+        summary['time'] = {'start_at': parent_summary['time']['start_at'],
+                           'duration': "%.2f" % (float(parent_summary['time']['duration']) +
+                                                 float(rerun_summary['time']['duration']))}
+        summary['rerun'] = {'parent_id': parent_id, 'stat': rerun_summary['stat'],
+                            'time': rerun_summary['time']}
+    return _merge_report(parent_id, report_id, _update)
+
+
+def merge_changed_report(base_id, report_id):
+    """
+    按修改只执行部分用例的报告和参考报告合并，跳过的用例沿用参考报告的结果：
+    开始时间和耗时仍是本次执行的，本次执行的统计放在summary的changed中
+    """
+    def _update(summary, run_summary, base_summary):
+        summary['changed'] = {'base_id': base_id, 'stat': run_summary['stat']}
+    return _merge_report(base_id, report_id, _update)
@@ -0,0 +1,90 @@
+# encoding: utf-8
+import os
+import time
+
+from .global_variable import CONTROL_ADDRESS
+
+
+def _marker_path(name):
+    return os.path.join(CONTROL_ADDRESS, name)
+
+
+def request_cancel(report_id=None, job_id=None):
+    """ 写取消标记，执行中的用例在下一个步骤开始前停止；标记放在共享的报告目录，其他机器的执行进程也能看到 """
+    name = 'report_{}.cancel'.format(report_id) if report_id else 'job_{}.cancel'.format(job_id)
+    with open(_marker_path(name), 'w'):
+        pass
+
+
+class RunControl(object):
+    """
+    一次执行的控制：
+    failfast为True时用例中有步骤失败就不再执行该用例后面的步骤；
+    max_failed_cases大于0时失败的用例数达到该值后不再执行后面的用例；
+    收到取消请求后在步骤之间停止；time_budget为整个执行的时间预算(秒)，超过后剩余步骤记为超时。
+    失败用例数记录在文件中，并发执行的多个进程共用。
+    """
+
+    def __init__(self, report_id=None, job_id=None, failfast=False, max_failed_cases=0, time_budget=None):
+        self.report_id = report_id
+        self.job_id = job_id
+        self.failfast = bool(failfast)
+        self.max_failed_cases = int(max_failed_cases or 0)
+        # 记录截止时间而不是预算，并发执行的子进程使用同一个截止时间
+        self.deadline = time.time() + float(time_budget) if time_budget else None
+        self._failed_cases = 0
+
+    def _markers(self):
+        markers = []
+        if self.report_id:
+            markers.append('report_{}'.format(self.report_id))
+        if self.job_id:
+            markers.append('job_{}'.format(self.job_id))
+        return markers
+
+    def cancelled(self):
+        return any(os.path.exists(_marker_path('{}.cancel'.format(m))) for m in self._markers())
+
+    def case_failed(self):
+        self._failed_cases += 1
+        markers = self._markers()
+        if markers:
+            # 每个失败的用例追加一个字节，文件大小就是所有进程的失败用例数
+            with open(_marker_path('{}.failed'.format(markers[0])), 'ab') as f:
+                f.write(b'1')
+
+    def failed_cases(self):
+        markers = self._markers()
+        path = _marker_path('{}.failed'.format(markers[0])) if markers else None
+        if path and os.path.exists(path):
+            return os.path.getsize(path)
+        return self._failed_cases
+
+    def deadline_exceeded(self):
+        return bool(self.deadline) and time.time() >= self.deadline
+
+    def stop_reason(self):
+        """ 需要停止执行时返回原因，否则返回None """
+        if self.cancelled():
+            return 'cancelled'
+        if self.max_failed_cases and self.failed_cases() >= self.max_failed_cases:
+            return 'max_failed_cases'
+        return None
+
+    def watch(self, result):
+        """ 每个步骤结束后检查是否被取消，取消后unittest不再执行后面的步骤 """
+        stop_test = result.stopTest
+
+        def _stop_test(test):
+            stop_test(test)
+            if self.cancelled():
+                result.stop()
+        result.stopTest = _stop_test
+        return result
+
+    def clear(self):
+        for m in self._markers():
+            for suffix in ('cancel', 'failed'):
+                path = _marker_path('{}.{}'.format(m, suffix))
+                if os.path.exists(path):
+                    os.remove(path)
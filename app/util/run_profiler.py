@@ -0,0 +1,67 @@
+# encoding: utf-8
+import cProfile
+import os
+import pstats
+import time
+
+from .global_variable import REPORT_ADDRESS, PROFILE_TOP
+from .report_store import report_path
+
+# 按阶段统计的函数：(文件路径结尾, 函数名)，耗时为函数的累计耗时，阶段之间有包含关系
+PROFILE_PHASES = {
+    'all_cases_data': ('http_run.py', 'all_cases_data'),
+    'merge_config': ('utils.py', 'merge_config'),
+    'parse_tests': ('http_run.py', 'parse_tests'),
+    'run_testcase': ('http_run.py', 'run_testcase'),
+    'network': (os.path.join('requests', 'sessions.py'), 'send'),
+}
+
+
+def profile_path(report_id=None):
+    """ 有报告时分析文件和报告放在一起，否则按时间生成文件名 """
+    if report_id:
+        return report_path(report_id, 'prof')
+    return '{}profile_{}.prof'.format(REPORT_ADDRESS, time.strftime('%Y%m%d%H%M%S'))
+
+
+class RunProfiler(object):
+    """
+    用cProfile执行一次运行，只统计调用线程：用例并发执行的子进程、步骤并发执行的线程中的耗时不在统计内。
+    只在请求参数profile为true时创建，不开启时没有任何额外开销。
+    """
+
+    def __init__(self, top=PROFILE_TOP):
+        self.top = top
+        self.profiler = cProfile.Profile()
+
+    def run(self, func, *args, **kwargs):
+        return self.profiler.runcall(func, *args, **kwargs)
+
+    def hot_functions(self, stats):
+        """ 按自身耗时排序的前top个函数 """
+        items = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+        return [{'function': '{}:{}({})'.format(file_name, line, func_name),
+                 'calls': calls,
+                 'tottime_ms': round(tottime * 1000, 2),
+                 'cumtime_ms': round(cumtime * 1000, 2)}
+                for (file_name, line, func_name), (_, calls, tottime, cumtime, _) in items]
+
+    @staticmethod
+    def phases(stats):
+        """ 计划编译、HttpRunner解析、用例执行和网络请求各自的累计耗时 """
+        phases = {}
+        for phase, (file_suffix, func_name) in PROFILE_PHASES.items():
+            cumtime = sum(value[3] for (file_name, _, _func_name), value in stats.stats.items()
+                          if _func_name == func_name and file_name.endswith(file_suffix))
+            phases[phase] = round(cumtime * 1000, 2)
+        return phases
+
+    def summary(self, report_id=None):
+        """ 保存分析文件(可用pstats/snakeviz查看)，返回文件名、各阶段耗时和最耗时的函数 """
+        path = profile_path(report_id)
+        self.profiler.dump_stats(path)
+        stats = pstats.Stats(self.profiler)
+        return {'file': os.path.basename(path),
+                'total_ms': round(stats.total_tt * 1000, 2),
+                'phases': self.phases(stats),
+                'hot_functions': self.hot_functions(stats)}
@@ -0,0 +1,167 @@
+# encoding: utf-8
+import copy
+import json
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from httprunner import exceptions
+from .utils import extract_variables, extract_functions
+
+
+def step_dependencies(teststeps):
+    """ 根据每个步骤extract的变量和请求、断言中$var的引用关系，返回每个步骤依赖的步骤下标集合
+        带前置/后置函数的步骤可能有副作用，按屏障处理：前面的步骤都执行完才执行它，后面的步骤都要等它
+    """
+    produced = {}  # 变量名 -> 最近一次extract该变量的步骤
+    consumed = {}  # 变量名 -> 引用过该变量的步骤，重新extract该变量前必须等这些步骤执行完
+    barrier = None
+    dependencies = []
+    for index, step in enumerate(teststeps):
+        content = json.dumps([step.get('request', {}), step.get('validate', [])], default=str)
+        references = set(extract_variables(content))
+        extract_keys = [key for ext in step.get('extract', []) for key in ext]
+        is_barrier = bool(extract_functions(json.dumps(step.get('setup_hooks', []) + step.get('teardown_hooks', []))))
+
+        depends = set(range(index)) if is_barrier else set()
+        if barrier is not None:
+            depends.add(barrier)
+        for name in references:
+            if name in produced:
+                depends.add(produced[name])
+        for name in extract_keys:
+            if name in produced:
+                depends.add(produced[name])
+            depends.update(consumed.get(name, set()))
+        depends.discard(index)
+        dependencies.append(depends)
+
+        for name in references:
+            consumed.setdefault(name, set()).add(index)
+        for name in extract_keys:
+            produced[name] = index
+            consumed[name] = set()
+        if is_barrier:
+            barrier = index
+    return dependencies
+
+
+def step_layers(teststeps):
+    """ 按依赖关系把步骤分层，同一层的步骤之间没有依赖，可以并发执行 """
+    levels = []
+    for depends in step_dependencies(teststeps):
+        levels.append(max([levels[d] + 1 for d in depends], default=0))
+    layers = [[] for _ in range(max(levels, default=-1) + 1)]
+    for index, level in enumerate(levels):
+        layers[level].append(index)
+    return layers
+
+
+class StepScheduler(object):
+    """
+    用例内步骤的并发调度：按依赖分层，同层步骤各自在复制出来的runner中并发执行，
+    执行完一层后把extract的变量和cookies合并回用例的runner，再执行下一层。
+    执行结果最后按原步骤顺序交给unittest重放，生成的summary和顺序执行时格式一致。
+    注意：只通过cookies产生依赖(没有$引用)的步骤需要顺序执行，不要开启并发。
+    """
+
+    def __init__(self, testcase, max_workers, run_control=None):
+        self.testcase = testcase
+        self.run_control = run_control
+        self.runner = testcase.runner
+        self.max_workers = max_workers
+        self.teststeps = [step for step in testcase.teststeps for _ in range(int(step.get('times', 1)))]
+        self.start_at = None
+
+    def _fork_runner(self):
+        """ 复制用例的runner，变量和cookies取当前快照，请求使用独立的session """
+        step_runner = copy.copy(self.runner)
+        step_runner.testcase_teardown_hooks = []  # 用例级后置函数只由原runner执行
+        step_runner.evaluated_validators = []
+        step_runner.context = copy.copy(self.runner.context)
+        step_runner.context.testcase_runtime_variables_mapping = copy.deepcopy(
+            self.runner.context.testcase_runtime_variables_mapping)
+        session = self.runner.http_client_session
+        step_runner.http_client_session = type(session)(session.base_url)
+        step_runner.http_client_session.headers.update(session.headers)
+        step_runner.http_client_session.cookies.update(session.cookies)
+        step_runner.http_client_session.request_listener = getattr(session, 'request_listener', None)
+        step_runner.http_client_session.deadline = getattr(session, 'deadline', None)
+        if getattr(session, 'cassette', None):
+            step_runner.http_client_session.use_cassette(session.cassette)
+        return step_runner
+
+    def _merge(self, step_runner, teststep_dict):
+        """ 把步骤extract出来的变量和新的cookies合并回用例的runner """
+        mapping = step_runner.context.testcase_runtime_variables_mapping
+        extracted = {key: mapping[key] for ext in teststep_dict.get('extract', []) for key in ext if key in mapping}
+        self.runner.context.update_testcase_runtime_variables_mapping(extracted)
+        self.runner.http_client_session.cookies.update(step_runner.http_client_session.cookies)
+
+    @staticmethod
+    def _run_step(step_runner, teststep_dict):
+        """ 执行单个步骤，异常留到重放时按unittest的规则记录 """
+        error = None
+        try:
+            step_runner.run_test(teststep_dict)
+        except Exception as e:
+            error = e
+        meta_data = getattr(step_runner.http_client_session, 'meta_data', None)
+        validators = step_runner.evaluated_validators
+        if meta_data is not None:
+            step_runner.http_client_session.init_meta_data()
+        return error, meta_data, validators
+
+    def _stopped(self, outcomes):
+        """ 被取消，或开启了failfast且已有步骤失败时，后面的层不再执行 """
+        if not self.run_control:
+            return False
+        if self.run_control.failfast and any(o is not None and o[0] is not None for o in outcomes):
+            return True
+        return self.run_control.cancelled()
+
+    def run(self):
+        self.start_at = time.time()
+        outcomes = [None] * len(self.teststeps)
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for layer in step_layers(self.teststeps):
+                if self._stopped(outcomes):
+                    for index in layer:
+                        outcomes[index] = (unittest.SkipTest('执行已停止'), None, [])
+                    continue
+                if len(layer) == 1:
+                    # 单独一层的步骤直接在原runner执行，和顺序执行完全一致
+                    outcomes[layer[0]] = self._run_step(self.runner, self.teststeps[layer[0]])
+                    continue
+                step_runners = [self._fork_runner() for _ in layer]
+                results = executor.map(self._run_step, step_runners, [self.teststeps[i] for i in layer])
+                for index, step_runner, outcome in zip(layer, step_runners, results):
+                    outcomes[index] = outcome
+                    self._merge(step_runner, self.teststeps[index])
+        return self.replay_suite(outcomes)
+
+    def replay_suite(self, outcomes):
+        """ 生成按原顺序重放执行结果的TestSuite，属性和HttpRunner.initialize生成的一致 """
+        def __replay_step(outcome):
+            def test(self):
+                error, meta_data, validators = outcome
+                if meta_data is not None:
+                    self.meta_data = meta_data
+                    self.meta_data['validators'] = validators
+                if isinstance(error, exceptions.MyBaseFailure):
+                    self.fail(str(error))
+                elif error:
+                    raise error
+            return test
+
+        TestSequense = type('TestSequense', (unittest.TestCase,), {})
+        for index, (teststep_dict, outcome) in enumerate(zip(self.teststeps, outcomes)):
+            test_method = __replay_step(outcome)
+            test_method.__doc__ = teststep_dict['name']
+            setattr(TestSequense, 'test_{:04}_000'.format(index), test_method)
+
+        replay_testcase = unittest.TestLoader().loadTestsFromTestCase(TestSequense)
+        setattr(replay_testcase, 'config', self.testcase.config)
+        setattr(replay_testcase, 'teststeps', self.testcase.teststeps)
+        setattr(replay_testcase, 'runner', self.runner)
+        return replay_testcase
@@ -1,9 +1,14 @@
 # encoding: utf-8
 import ast
-import importlib
 import json
+import math
 import re
-import types
+import threading
+from collections import OrderedDict, deque
+
+from .func_registry import func_registry
+from .global_variable import VARIABLE_CACHE_SIZE
+from .plan_cache import plan_version
 
 
 def auto_num(num, model, **kwargs):
@@ -32,6 +37,7 @@ def num_sort(new_num, old_num, list_data, old_data):
 
 
 variable_regexp = r"\$([\w_]+)"
+variable_regexp_compile = re.compile(variable_regexp)
 function_regexp = r"\$\{([\w_]+\([\$\w\.\-_ =,]*\))\}"
 # function_regexp = r"\$\{([\w_]+\([\$\w\W\.\-_ =,]*\))\}"
 function_regexp_compile = re.compile(r"^([\w_]+)\(([\$\w\.\-/_ =,]*)\)$")
@@ -76,9 +82,7 @@ def check_case(case_data, func_address):
     if func_address:
         for f in json.loads(func_address):
             import_path = 'func_list.{}'.format(f.replace('.py', ''))
-            func_list = importlib.reload(importlib.import_module(import_path))
-            module_functions_dict.update({name: item for name, item in vars(func_list).items() if
-                                          isinstance(item, types.FunctionType)})
+            module_functions_dict.update(func_registry.functions(import_path))
             # module_functions_dict = dict(filter(is_function, vars(func_list).items()))
 
     if isinstance(case_data, list):
@@ -110,42 +114,144 @@ def check_case(case_data, func_address):
                     return '函数“{}”在文件引用中没有定义'.format(func)
 
 
-def convert(variable):
-    """ 同层次参数中，存在引用关系就先赋值
+def _variable_references(value):
+    """ 变量值中引用的变量名 """
+    return extract_variables(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+
+
+def _substitute(value, resolved):
+    """ 把值中引用的已解析变量替换成变量值，没有定义的变量保持$name不变 """
+    if isinstance(value, str):
+        return variable_regexp_compile.sub(
+            lambda m: '{}'.format(resolved[m.group(1)]) if m.group(1) in resolved else m.group(0), value)
+    if isinstance(value, list):
+        return [_substitute(v, resolved) for v in value]
+    if isinstance(value, dict):
+        return {k: _substitute(v, resolved) for k, v in value.items()}
+    return value
+
+
+class VariableResolver(object):
+    """
+    同层次变量之间的引用先赋值：根据引用关系建图，按拓扑顺序解析，被引用的变量先解析，和声明顺序无关；
+    存在循环引用(包括引用自身，如token:$token)的变量不解析，保持原值。解析结果按变量列表的版本号缓存，变量没有修改时直接使用。
     eg:
         phone:123
         name:$phone
         => phone:123
            name:123
     """
-    _temp = json.dumps(variable)
-    content = {v['key']: v['value'] for v in variable if v['key'] != ''}
-    for variable_name in extract_variables(_temp):
-        if content.get(variable_name):
-            # content contains one or several variables
-            _temp = _temp.replace(
-                "${}".format(variable_name),
-                str(content.get(variable_name)), 1
-            )
-    return _temp
+
+    def __init__(self, max_size=VARIABLE_CACHE_SIZE):
+        self.max_size = max_size
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _resolve(variables):
+        # key重复时后面的值生效
+        values = {v['key']: v['value'] for v in variables if v['key'] != ''}
+        dependents = {key: [] for key in values}
+        waiting = {}
+        for key, value in values.items():
+            references = {name for name in _variable_references(value) if name in values}
+            waiting[key] = len(references)
+            for name in references:
+                dependents[name].append(key)
+
+        resolved = {}
+        ready = deque(key for key in values if not waiting[key])
+        while ready:
+            key = ready.popleft()
+            resolved[key] = _substitute(values[key], resolved)
+            for dependent in dependents[key]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    ready.append(dependent)
+        # 循环引用中的变量及引用了它们的变量只替换已解析的引用，循环引用的部分保持$name不变
+        unresolved = {key: _substitute(values[key], resolved) for key in values if key not in resolved}
+        resolved.update(unresolved)
+        return [(v['key'], resolved[v['key']] if v['key'] in resolved else v['value']) for v in variables]
+
+    def resolve(self, variables):
+        """ 返回解析后的 [(变量名, 值)]，顺序和variables一致；结果是共享的，不能修改 """
+        try:
+            version = tuple((v['key'], v['value']) for v in variables)
+            hash(version)
+        except TypeError:
+            # 值为列表、字典时按内容计算版本号
+            version = plan_version(variables)
+        with self._lock:
+            if version in self._resolved:
+                self._resolved.move_to_end(version)
+                return self._resolved[version]
+        result = self._resolve(variables)
+        with self._lock:
+            self._resolved[version] = result
+            while len(self._resolved) > self.max_size:
+                self._resolved.popitem(last=False)
+        return result
+
+
+variable_resolver = VariableResolver()
+
+
+def unresolved_variables(variables):
+    """ 变量之间的引用解析后仍然引用的、在变量中没有定义的变量名 """
+    return extract_variables(json.dumps([value for _, value in variable_resolver.resolve(variables)],
+                                        ensure_ascii=False))
 
 
 def merge_config(pro_config, scene_config):
-    """ 合并公用项目配置和业务集合配置 """
-    for _s in scene_config:
-        for _p in pro_config['config']['variables']:
-            if _p['key'] == _s['key']:
-                break
-        else:
-            pro_config['config']['variables'].append(_s)
+    """ 合并公用项目配置和业务集合配置，变量名相同时以项目配置为准 """
+    pro_keys = {v['key'] for v in pro_config['config']['variables']}
+    pro_config['config']['variables'] += [_s for _s in scene_config if _s['key'] not in pro_keys]
 
-    _temp = convert(pro_config['config']['variables'])
-    pro_config['config']['variables'] = [{v['key']: v['value']} for v in json.loads(_temp)
-                                         if v['key']]
+    pro_config['config']['variables'] = [{key: value} for key, value in
+                                         variable_resolver.resolve(pro_config['config']['variables']) if key]
     # pro_config['config']['output'] = ['token']
     return pro_config
 
 
+def positive_int(value, name, default=1):
+    """ 请求参数转成大于等于1的整数，为空时返回默认值，格式错误时抛出ValueError """
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('{}必须是整数'.format(name))
+    if value < 1:
+        raise ValueError('{}必须大于等于1'.format(name))
+    return value
+
+
+def non_negative_int(value, name, default=0):
+    """ 请求参数转成大于等于0的整数，为空时返回默认值，格式错误时抛出ValueError """
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('{}必须是整数'.format(name))
+    if value < 0:
+        raise ValueError('{}不能小于0'.format(name))
+    return value
+
+
+def positive_number(value, name, default=None):
+    """ 请求参数转成大于0的数字，为空时返回默认值，格式错误时抛出ValueError """
+    if value is None or value == '':
+        return default
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('{}必须是数字'.format(name))
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError('{}必须大于0'.format(name))
+    return value
+
+
 def change_cron(expression):
     args = {}
     expression = expression.split(' ')
@@ -0,0 +1,307 @@
+# encoding: utf-8
+"""
+执行性能基准测试：在临时sqlite数据库中生成指定规模的项目/模块/接口/用例/步骤，
+对本地的桩http服务执行，统计执行计划编译耗时、每秒执行步骤数、内存峰值、报告写入、读取和渲染耗时，结果输出为json。
+
+用法(在项目根目录执行)：
+    python benchmark/run_benchmark.py --cases 20 --steps 10 --output before.json
+    python benchmark/run_benchmark.py --cases 20 --steps 10 --compare before.json
+"""
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ 所有请求都返回固定大小的json，latency为每个请求的处理延迟(秒) """
+    protocol_version = 'HTTP/1.1'
+    # 响应头和内容一次写出，避免nagle算法和延迟确认让每个请求多等几十毫秒
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+    body = b'{}'
+    latency = 0
+
+    def _send(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    do_GET = do_POST = _send
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_stub_server(body_size, latency):
+    StubHandler.body = json.dumps({'status': 1, 'token': 'bench-token', 'data': 'x' * body_size}).encode('utf-8')
+    StubHandler.latency = latency
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+def build_project(db, models, base_url, apis, cases, steps, variables):
+    """ 生成一个项目：apis个接口平均分到每50个一个的模块，cases个用例，每个用例steps个步骤，按顺序引用接口 """
+    project = models.Project(name='benchmark', host=json.dumps([base_url]), host_two='[]', host_three='[]',
+                             host_four='[]', environment_choice='first', user_id=1, headers='[]',
+                             variables=json.dumps([{'key': 'v{}'.format(i), 'value': 'value{}'.format(i)}
+                                                   for i in range(variables)]))
+    db.session.add(project)
+    db.session.commit()
+
+    validate = json.dumps([{'key': 'status_code', 'value': 200, 'comparator': 'equals'},
+                           {'key': 'content.status', 'value': 1, 'comparator': 'equals'}])
+    extract = json.dumps([{'key': 'token', 'value': 'content.token'}])
+    body = json.dumps({'name': '$v0', 'index': 1})
+    api_msgs = []
+    module = None
+    for i in range(apis):
+        if i % 50 == 0:
+            module = models.Module(name='module{}'.format(i // 50), num=i // 50, project_id=project.id)
+            db.session.add(module)
+            db.session.flush()
+        api_msgs.append(models.ApiMsg(name='api{}'.format(i), num=i, variable_type='json', status_url='0',
+                                      method='POST', variable='[]', json_variable=body, param='[]',
+                                      url='/api/{}'.format(i), extract=extract, validate=validate, header='[]',
+                                      module_id=module.id, project_id=project.id))
+    db.session.add_all(api_msgs)
+    case_set = models.CaseSet(name='benchmark', num=1, project_id=project.id)
+    db.session.add(case_set)
+    db.session.commit()
+
+    case_variable = json.dumps([{'key': 'c{}'.format(i), 'value': '$v{}'.format(i)} for i in range(variables)])
+    case_ids = []
+    for i in range(cases):
+        case = models.Case(name='case{}'.format(i), num=i, project_id=project.id, case_set_id=case_set.id,
+                           variable=case_variable, func_address='[]', times=1)
+        db.session.add(case)
+        db.session.flush()
+        for j in range(steps):
+            api_msg = api_msgs[(i * steps + j) % apis]
+            db.session.add(models.CaseData(num=j, status='true', name=api_msg.name, time=1, param='[]',
+                                           status_param='[true, false]', variable='[]',
+                                           json_variable=api_msg.json_variable, status_variables='[true, false]',
+                                           extract=api_msg.extract, status_extract='[true, false]',
+                                           validate=api_msg.validate, status_validate='[true, false]',
+                                           case_id=case.id, api_msg_id=api_msg.id))
+        case_ids.append(case.id)
+    db.session.commit()
+    return project, case_ids
+
+
+def _timed(func, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, round((time.perf_counter() - start_time) * 1000, 2)
+
+
+def trace_memory(run_case_cls, project_name, case_ids, concurrency, step_concurrency):
+    """ 单独执行一次统计python对象的内存峰值，tracemalloc会明显拖慢执行，不和计时的执行放在一起 """
+    run_case = run_case_cls(project_name, case_ids, concurrency=concurrency, step_concurrency=step_concurrency)
+    run_case.run_type = True
+    tracemalloc.start()
+    try:
+        run_case.run_case()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024.0, 2)
+
+
+class WriteTimer(object):
+    """ 累计执行过程中写报告文件的耗时，并发执行时子进程中的写入不在统计内 """
+
+    def __init__(self):
+        self.ms = 0
+
+    def wrap(self, cls, name):
+        func = getattr(cls, name)
+
+        def _timed_write(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.ms += (time.perf_counter() - start_time) * 1000
+
+        setattr(cls, name, _timed_write)
+        return func
+
+
+def run_once(run_case_cls, project_name, case_ids, concurrency, step_concurrency, render):
+    """ 执行一次，返回各项耗时 """
+    from app.util.plan_cache import plan_cache
+    from app.util.compiled_step import step_cache
+    from app.util.report_store import read_report, ReportWriter, BufferedWriter
+    from app.util.report.report import render_html_report
+    from app.util.global_variable import TEMP_REPORT, REPORT_ADDRESS
+
+    plan_cache.clear()
+    step_cache.clear()
+    run_case = run_case_cls(project_name, case_ids)
+    run_case.run_type = True
+    _, cold_ms = _timed(run_case.all_cases_data)
+    _, warm_ms = _timed(run_case.all_cases_data)
+
+    run_case = run_case_cls(project_name, case_ids, concurrency=concurrency, step_concurrency=step_concurrency)
+    run_case.run_type = True
+    write_timer = WriteTimer()
+    originals = [(ReportWriter, 'write', write_timer.wrap(ReportWriter, 'write')),
+                 (BufferedWriter, 'commit', write_timer.wrap(BufferedWriter, 'commit'))]
+    try:
+        res, run_ms = _timed(run_case.run_case)
+    finally:
+        for cls, name, func in originals:
+            setattr(cls, name, func)
+    res = json.loads(res)
+    steps = res['stat']['testsRun']
+
+    summary, read_ms = _timed(read_report, run_case.new_report_id)
+    render_ms, html_write_ms = None, None
+    if render:
+        # 只渲染不写文件，html文件单独计时写到临时目录的报告目录中
+        content, render_ms = _timed(render_html_report, summary, html_report_name='benchmark',
+                                    html_report_template=r'{}/extent_report_template.html'.format(TEMP_REPORT),
+                                    data_or_report=True)
+        start_time = time.perf_counter()
+        with open(os.path.join(REPORT_ADDRESS, 'benchmark.html'), 'w', encoding='utf-8') as f:
+            f.write(content)
+        html_write_ms = round((time.perf_counter() - start_time) * 1000, 2)
+    return {'plan_build_cold_ms': cold_ms,
+            'plan_build_warm_ms': warm_ms,
+            'run_ms': run_ms,
+            'steps': steps,
+            'successes': res['stat']['successes_1'],
+            'steps_per_second': round(steps / (run_ms / 1000.0), 2) if run_ms else 0,
+            # 执行过程中逐条写报告文件的耗时，包含在run_ms中
+            'report_write_ms': round(write_timer.ms, 2),
+            'report_read_ms': read_ms,
+            'report_render_ms': render_ms,
+            'report_html_write_ms': html_write_ms}
+
+
+def aggregate(runs):
+    """ 多次执行取中位数，同时保留最小值 """
+    result = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs if run[key] is not None]
+        if not values:
+            result[key] = None
+        elif key in ('steps', 'successes'):
+            result[key] = values[0]
+        else:
+            result[key] = {'median': round(statistics.median(values), 2), 'min': min(values)}
+    return result
+
+
+def compare(result, baseline):
+    """ 与之前的结果比较，中位数的变化比例，正数表示变大 """
+    diff = {}
+    for key, value in result['results'].items():
+        old = baseline.get('results', {}).get(key)
+        if isinstance(value, dict) and isinstance(old, dict) and old.get('median'):
+            diff[key] = round((value['median'] - old['median']) / old['median'], 4)
+    return diff
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+@click.command()
+@click.option('--apis', default=50, help='接口数量')
+@click.option('--cases', default=20, help='用例数量')
+@click.option('--steps', default=10, help='每个用例的步骤数量')
+@click.option('--variables', default=10, help='项目公用变量和用例变量的数量')
+@click.option('--body-size', default=1024, help='桩服务响应内容的大小(字节)')
+@click.option('--latency', default=0.0, help='桩服务每个请求的延迟(秒)')
+@click.option('--concurrency', default=1, help='用例并发执行的进程数')
+@click.option('--step-concurrency', default=1, help='用例内步骤并发执行的线程数')
+@click.option('--repeat', default=3, help='重复执行次数，结果取中位数')
+@click.option('--no-render', is_flag=True, help='不统计html报告渲染耗时')
+@click.option('--output', default=None, help='结果保存的文件，默认输出到标准输出')
+@click.option('--compare', 'baseline', default=None, help='与之前保存的结果比较')
+def main(apis, cases, steps, variables, body_size, latency, concurrency, step_concurrency, repeat, no_render, output,
+         baseline):
+    work_dir = tempfile.mkdtemp(prefix='api_benchmark_')
+    # 数据库、报告、日志和文件目录都放在临时目录，需要在导入app之前设置
+    os.environ['DEV_DATABASE_URL'] = 'sqlite:///' + os.path.join(work_dir, 'benchmark.sqlite')
+    os.environ['REPORT_ADDRESS'] = os.path.join(work_dir, 'reports') + os.sep
+    os.environ['FILE_ADDRESS'] = os.path.join(work_dir, 'files') + os.sep
+    os.environ['LOG_ADDRESS'] = os.path.join(work_dir, 'logs') + os.sep
+    os.environ['RUN_JOBS_IN_WEB'] = '0'
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    try:
+        from app import create_app, db, scheduler
+        from app import models
+        from app.util.http_run import RunCase
+
+        app = create_app('default')
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        server, base_url = start_stub_server(body_size, latency)
+        with app.app_context():
+            project, case_ids = build_project(db, models, base_url, apis, cases, steps, variables)
+            runs = [run_once(RunCase, project.name, case_ids, concurrency, step_concurrency, not no_render)
+                    for _ in range(repeat)]
+            peak_memory = trace_memory(RunCase, project.name, case_ids, concurrency, step_concurrency)
+        server.shutdown()
+
+        result = {'commit': git_commit(),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'params': {'apis': apis, 'cases': cases, 'steps': steps, 'variables': variables,
+                             'body_size': body_size, 'latency': latency, 'concurrency': concurrency,
+                             'step_concurrency': step_concurrency, 'repeat': repeat},
+                  'results': aggregate(runs),
+                  # 执行期间主进程python对象的内存峰值，并发执行时不含子进程
+                  'peak_traced_memory_kb': peak_memory,
+                  # 进程的最大常驻内存，linux下单位为KB
+                  'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+        if baseline:
+            with open(baseline, 'r', encoding='utf-8') as f:
+                result['compare'] = compare(result, json.load(f))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    click.echo(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -72,8 +72,8 @@ def config_log():
     日志配置
     :return:
     """
-    handler = SafeLog(filename=os.path.abspath('..') + r'/logs/' + 'logger', interval=1, backupCount=50, when="D",
-                      encoding='UTF-8')
+    log_address = os.environ.get('LOG_ADDRESS') or os.path.abspath('..') + r'/logs/'
+    handler = SafeLog(filename=log_address + 'logger', interval=1, backupCount=50, when="D", encoding='UTF-8')
     handler.setLevel(logging.INFO)
     handler.suffix = "%Y-%m-%d.log"
     logging_format = logging.Formatter(
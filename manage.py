@@ -28,6 +28,18 @@ def initdata():
     User.init_user()  # 初始化
     click.echo('Done.')
 
+@app.cli.command()
+@click.option('--concurrency', default=1, help='同时执行的任务数')
+def worker(concurrency):
+    """ 启动执行进程，从共享的执行队列取任务执行，可以在多台机器上启动 """
+    from app import scheduler
+    from app.util.job_queue import run_worker
+    # 定时任务只在web进程运行
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    click.echo('Worker started, concurrency: {}'.format(concurrency))
+    run_worker(app, concurrency)
+
 # manager.add_command("shell", Shell(make_context=make_shell_context))
 # manager.add_command('db', MigrateCommand)
 # manager.add_command('runserver', Server(host='127.0.0.1', port='8080'))  # host设置为本地地址后，局域网内的其他机子都可以访问
@@ -0,0 +1,32 @@
+# encoding: utf-8
+import json
+
+import pytest
+from flask import Flask
+
+from app import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    """ 只初始化数据库的应用，使用临时的sqlite，不启动定时任务和执行队列 """
+    _app = Flask('app')
+    _app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(tmp_path / 'test.sqlite'),
+                       SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(_app)
+    with _app.app_context():
+        db.create_all()
+        yield _app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def project(app):
+    from app.models import Project
+    _project = Project(name='p', host=json.dumps(['http://127.0.0.1:1']), host_two='[]', host_three='[]',
+                       host_four='[]', environment_choice='first', user_id=1, headers='[]',
+                       variables=json.dumps([{'key': 'a', 'value': '1'}]))
+    db.session.add(_project)
+    db.session.commit()
+    return _project
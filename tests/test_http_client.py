@@ -0,0 +1,30 @@
+# encoding: utf-8
+import threading
+import time
+
+from app.util import http_client
+from app.util.http_client import HostPool
+
+
+def test_expired_pool_is_rebuilt_once(monkeypatch):
+    pool = HostPool('http://127.0.0.1:1', keep_alive=1)
+    pool.last_used = time.time() - 10
+    built = []
+
+    class SlowAdapter(http_client.TimedHTTPAdapter):
+        def __init__(self, *args, **kwargs):
+            # 放大检查和重建之间的间隔，没有锁时多个线程都会重建
+            time.sleep(0.05)
+            super(SlowAdapter, self).__init__(*args, **kwargs)
+            built.append(self)
+
+    monkeypatch.setattr(http_client, 'TimedHTTPAdapter', SlowAdapter)
+    adapters = []
+    threads = [threading.Thread(target=lambda: adapters.append(pool.get_adapter())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(built) == 1
+    assert all(adapter is built[0] for adapter in adapters)
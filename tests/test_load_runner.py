@@ -0,0 +1,44 @@
+# encoding: utf-8
+import pytest
+from httprunner.exceptions import ParamsError
+from requests.exceptions import ConnectionError
+
+from app.util.http_client import RunSession
+from app.util.load_runner import LoadRunner, LoadStats, RateLimiter
+
+
+def test_unreachable_host_counts_failures(app):
+    stats = LoadStats(RateLimiter(0))
+    session = RunSession()
+    session.request_listener = stats
+    for _ in range(3):
+        # 端口1没有服务，连接失败的异常照常抛出，不会被统计时的异常覆盖
+        with pytest.raises(ConnectionError):
+            session.request('GET', 'http://127.0.0.1:1/ping', name='ping', timeout=1)
+    with pytest.raises(ParamsError):
+        # 没有基础url，发请求前就抛出异常
+        session.request('GET', 'no-schema', name='bad')
+
+    result = stats.summary(1)
+    assert result['total']['requests'] == 4
+    assert result['total']['failures'] == 4
+    apis = {api['api_msg_id']: api for api in result['apis']}
+    assert apis['ping']['requests'] == 3 and apis['ping']['failures'] == 3
+    assert apis['bad']['requests'] == 1 and apis['bad']['failures'] == 1
+    assert result['errors'] == {'ConnectionError': 3, 'ParamsError': 1}
+
+
+def test_listener_never_raises():
+    stats = LoadStats(RateLimiter(0))
+    stats.after_request('x', {'response': {'status_code': 'N/A', 'response_time_ms': 'N/A'}})
+    stats.after_request('x', None, ValueError('boom'))
+    assert stats.requests['x'] == 2
+    assert stats.failures['x'] == 2
+
+
+def test_runner_errors_are_counted_by_type(app):
+    # 用例数据有误，每次执行都抛出异常，按异常类型计数而不是只记为失败
+    result = LoadRunner([{'config': {}}], users=2, iterations=2).run()
+    assert result['iterations'] == 4
+    assert result['failed_iterations'] == 4
+    assert result['errors'] == {'KeyError': 4}
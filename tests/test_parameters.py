@@ -0,0 +1,28 @@
+# encoding: utf-8
+import pytest
+from httprunner.exceptions import ParamsError
+
+from app.util import parameters
+from app.util.parameters import check_parameters, iter_parameters
+
+
+@pytest.fixture
+def file_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(parameters, 'FILE_ADDRESS', str(tmp_path))
+    (tmp_path / 'users.csv').write_text('name,pwd\na,1\nb\n', encoding='utf-8')
+    return tmp_path
+
+
+def test_check_parameters_reports_missing_column(file_dir):
+    check_parameters([{'name-pwd': 'users.csv'}])
+    with pytest.raises(ValueError, match='users.csv中没有phone列'):
+        check_parameters([{'name-phone': 'users.csv'}])
+
+
+def test_missing_column_raises_params_error(file_dir):
+    assert list(iter_parameters([{'name-pwd': 'users.csv'}], {}, {})) == [{'name': 'a', 'pwd': '1'},
+                                                                         {'name': 'b', 'pwd': None}]
+    # 保存之后文件被替换成没有该列的文件
+    (file_dir / 'users.csv').write_text('name\na\n', encoding='utf-8')
+    with pytest.raises(ParamsError, match='pwd'):
+        list(iter_parameters([{'name-pwd': 'users.csv'}], {}, {}))
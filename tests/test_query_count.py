@@ -0,0 +1,65 @@
+# encoding: utf-8
+import json
+
+from sqlalchemy import event
+
+from app import db
+from app.models import Module, ApiMsg, CaseSet, Case, CaseData
+from app.util.env_resolver import env_resolver
+from app.util.http_run import RunCase
+from app.util.plan_cache import plan_cache
+
+
+def add_cases(project, count):
+    """ 添加count个用例，每个用例两个步骤，分别引用不同的接口 """
+    module = Module(name='m', num=1, project_id=project.id)
+    case_set = CaseSet(name='s', num=1, project_id=project.id)
+    db.session.add_all([module, case_set])
+    db.session.commit()
+    case_ids = []
+    for i in range(count):
+        case = Case(name='c{}'.format(i), num=i, project_id=project.id, case_set_id=case_set.id, variable='[]',
+                    func_address='[]', times=1)
+        db.session.add(case)
+        db.session.commit()
+        for num in range(2):
+            api_msg = ApiMsg(name='a{}_{}'.format(i, num), num=num, variable_type='json', status_url='0',
+                             method='POST', variable='[]', json_variable='{"x": "$a"}', param='[]',
+                             url='/a/{}'.format(num), extract='[]', validate='[]', header='[]', module_id=module.id,
+                             project_id=project.id)
+            db.session.add(api_msg)
+            db.session.commit()
+            db.session.add(CaseData(num=num, status='true', name=api_msg.name, time=1, param='[]',
+                                    status_param='[true, false]', variable='[]', json_variable=api_msg.json_variable,
+                                    status_variables='[true, false]', extract='[]', status_extract='[true, false]',
+                                    validate='[]', status_validate='[true, false]', case_id=case.id,
+                                    api_msg_id=api_msg.id))
+        db.session.commit()
+        case_ids.append(case.id)
+    return case_ids
+
+
+def count_queries(project, case_ids):
+    """ 编译用例时执行的SQL语句数，不使用缓存的执行计划和基础url """
+    plan_cache.clear()
+    env_resolver.invalidate()
+    db.session.expire_all()
+    run_case = RunCase(project.name, case_ids)
+    run_case.run_type = True
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', _count)
+    try:
+        cases = run_case.all_cases_data()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _count)
+    assert len(cases) == len(case_ids)
+    return len(statements)
+
+
+def test_all_cases_data_query_count_is_constant(project):
+    case_ids = add_cases(project, 12)
+    assert count_queries(project, case_ids[:3]) == count_queries(project, case_ids)
@@ -0,0 +1,40 @@
+# encoding: utf-8
+import json
+
+import pytest
+
+from app.models import Report
+from app.util import report_store, run_control
+from app.util.http_run import RunCase
+from app.util.report_store import read_report
+from app.util.run_control import RunControl, request_cancel
+from test_query_count import add_cases
+
+
+@pytest.fixture
+def report_dir(tmp_path, monkeypatch):
+    """ 报告和取消标记写到临时目录 """
+    monkeypatch.setattr(report_store, 'REPORT_ADDRESS', '{}/'.format(tmp_path))
+    monkeypatch.setattr(run_control, 'CONTROL_ADDRESS', str(tmp_path))
+    return tmp_path
+
+
+def test_cancel_before_first_case_writes_empty_report(project, report_dir):
+    case_ids = add_cases(project, 2)
+    run_case = RunCase(project.name, case_ids)
+    run_case.run_type = True
+    run_case.run_control = RunControl(job_id='cancel_test')
+    request_cancel(job_id='cancel_test')
+
+    res = json.loads(run_case.run_case())
+
+    assert res['aborted'] == 'cancelled'
+    assert res['details'] == []
+    assert res['stat']['testsRun'] == 0
+    assert res['stat']['errors_1'] == 0
+    assert Report.query.filter_by(id=run_case.new_report_id).first() is not None
+    report = read_report(run_case.new_report_id)
+    assert report['aborted'] == 'cancelled'
+    assert report['stat']['successes_scene'] == 0
+    # 执行结束后取消标记被清理
+    assert not list(report_dir.glob('*.cancel'))